@@ -11,3 +11,22 @@ if helpers.bool_str(USE_ALL_LOGS):
     USE_ALL_LOGS = True
 else:
     USE_ALL_LOGS = False
+# Only log entries within this time window are searched. Timestamps are of
+# the form "YYYY-MM-DD HH:MM:SS".
+SINCE = os.environ.get('SINCE') or None
+UNTIL = os.environ.get('UNTIL') or None
+# Directory in which searches can save their progress so that subsequent runs
+# only search what has been added to logs since.
+STATE_DIR = os.environ.get('STATE_DIR') or None
+# Whether to build and use an index of the sosreport being analysed.
+USE_INDEX = helpers.bool_str(os.environ.get('USE_INDEX', "False")) is True
+# Directory a sosreport archive was extracted to by hotsos.
+SOS_ARCHIVE_DIR = os.environ.get('SOS_ARCHIVE_DIR') or None
+# Maximum number of processes used to run plugin parts and searches. Lowered
+# when several sosreports are analysed concurrently.
+MAX_WORKERS = int(os.environ.get('MAX_WORKERS') or 0) or os.cpu_count()
+# Whether to collect stats about the resources used by each plugin part and
+# search.
+PROFILE = helpers.bool_str(os.environ.get('PROFILE', "False")) is True
+# Directory in which to save cProfile stats of each plugin part.
+PROFILE_DIR = os.environ.get('PROFILE_DIR') or None
@@ -0,0 +1,354 @@
+#!/usr/bin/python3
+import glob
+import hashlib
+import heapq
+import json
+import math
+import os
+import sys
+import yaml
+
+from common import helpers
+
+# Fields whose values are versions of components.
+VERSION_FIELDS = ["openstack.dpkg",
+                  "kubernetes.snaps",
+                  "storage.ceph.versions",
+                  "juju.charm-versions"]
+# Fields that together make up the config of a host.
+CONFIG_FIELDS = ["openstack.release",
+                 "openstack.debug-logging-enabled",
+                 "openstack.features",
+                 "kernel.boot"]
+# Fields containing counts of errors keyed by agent then error type.
+ERROR_FIELDS = ["openstack.neutron-agent-errors",
+                "openstack.nova-agent-errors"]
+# Number of hosts named for each version or config group.
+MAX_SAMPLE_HOSTS = 5
+# Number of distinct configs tracked. Hosts with any other config are only
+# counted.
+MAX_CONFIG_GROUPS = 50
+# Number of hosts with the highest count of each error tracked.
+MAX_OUTLIERS = 10
+# Hosts whose error count is at least this many standard deviations above
+# the fleet average are outliers.
+OUTLIER_THRESHOLD = 2.0
+BATCH_INDEX_NAME = "hotsos-batch.yaml"
+# Fields of the status file written by hotsos.sh for each sosreport analysed
+# in batch mode. Values are separated by NUL since paths can contain any
+# other character.
+BATCH_STATUS_FIELDS = ["path", "summary", "status", "exit-code", "duration",
+                       "errors"]
+
+
+def get_versions(field, value):
+    """Return a list of (component, version) for the value of one of
+    VERSION_FIELDS.
+    """
+    versions = []
+    if isinstance(value, dict):
+        for component, _versions in value.items():
+            if not isinstance(_versions, list):
+                _versions = [_versions]
+
+            for version in _versions:
+                versions.append((str(component), str(version)))
+    elif field == "juju.charm-versions":
+        # <charm>-<revision>
+        for entry in value:
+            component, _, version = str(entry).rpartition('-')
+            versions.append((component, version))
+    elif isinstance(value, list):
+        # "<package> <version>"
+        for entry in value:
+            component, _, version = str(entry).partition(' ')
+            versions.append((component, version))
+
+    return versions
+
+
+def count_errors(value):
+    """Return the sum of all counts in a tree of error counts."""
+    if isinstance(value, dict):
+        return sum(count_errors(v) for v in value.values())
+
+    if isinstance(value, int):
+        return value
+
+    return 0
+
+
+class FleetReport(object):
+    """Aggregate of the results of many hosts.
+
+    Hosts are added one at a time and only a summary of each is kept so that
+    memory use does not grow with the number of hosts:
+
+      * version skew - number of hosts per version of each component.
+      * config groups - hosts grouped by identical config.
+      * error outliers - hosts with unusually high error counts. The mean
+        and standard deviation of each error count are computed from running
+        sums and only the highest MAX_OUTLIERS counts are kept.
+    """
+
+    def __init__(self):
+        self.hosts = 0
+        # {plugin: number of hosts with results for the plugin}
+        self._plugin_hosts = {}
+        # {field: {component: {version: [count, sample]}}}
+        self._versions = {}
+        # {digest: [count, sample, config]}
+        self._configs = {}
+        self._other_configs = 0
+        # {metric: [sum, sum of squares, heap of (count, host)]}
+        self._errors = {}
+
+    def _add_sample(self, sample, host):
+        if len(sample) < MAX_SAMPLE_HOSTS:
+            sample.append(host)
+
+    def _add_versions(self, host, results):
+        for field in VERSION_FIELDS:
+            value = results.get(field)
+            if not value:
+                continue
+
+            components = self._versions.setdefault(field, {})
+            for component, version in set(get_versions(field, value)):
+                entry = components.setdefault(component, {}).setdefault(
+                    version, [0, []])
+                entry[0] += 1
+                self._add_sample(entry[1], host)
+
+    def _add_config(self, host, results):
+        config = {}
+        for field in CONFIG_FIELDS:
+            value = results.get(field)
+            if value is not None:
+                config[field] = value
+
+        if not config:
+            return
+
+        # json since yaml.safe_dump() only takes sort_keys from PyYAML 5.1.
+        digest = hashlib.sha1(json.dumps(config, sort_keys=True,
+                                         default=str).encode()).hexdigest()
+        group = self._configs.get(digest)
+        if group is None:
+            if len(self._configs) >= MAX_CONFIG_GROUPS:
+                self._other_configs += 1
+                return
+
+            group = [0, [], config]
+            self._configs[digest] = group
+
+        group[0] += 1
+        self._add_sample(group[1], host)
+
+    def _add_errors(self, host, results):
+        for field in ERROR_FIELDS:
+            agents = results.get(field)
+            if not isinstance(agents, dict):
+                continue
+
+            for agent, errors in agents.items():
+                if not isinstance(errors, dict):
+                    continue
+
+                for error, value in errors.items():
+                    count = count_errors(value)
+                    if not count:
+                        continue
+
+                    metric = "{}.{}.{}".format(field, agent, error)
+                    entry = self._errors.setdefault(metric, [0, 0, []])
+                    entry[0] += count
+                    entry[1] += count * count
+                    if len(entry[2]) < MAX_OUTLIERS:
+                        heapq.heappush(entry[2], (count, host))
+                    else:
+                        heapq.heappushpop(entry[2], (count, host))
+
+    def add(self, host, tree):
+        """Add the results of a host.
+
+        @param host: name of the host.
+        @param tree: dict of results as found in a hotsos summary.
+        """
+        self.hosts += 1
+        results = helpers.PluginResults()
+        results.merge(tree.items())
+        for plugin in tree:
+            self._plugin_hosts[plugin] = self._plugin_hosts.get(plugin, 0) + 1
+
+        self._add_versions(host, results)
+        self._add_config(host, results)
+        self._add_errors(host, results)
+
+    def get_version_skew(self):
+        """Return the versions of components that differ between hosts."""
+        skew = {}
+        for field, components in self._versions.items():
+            for component, versions in sorted(components.items()):
+                if len(versions) < 2:
+                    continue
+
+                info = {}
+                for version, (count, sample) in sorted(
+                        versions.items(), key=lambda v: -v[1][0]):
+                    info[version] = {"hosts": count, "sample": sample}
+
+                skew.setdefault(field, {})[component] = info
+
+        return skew
+
+    def get_config_groups(self):
+        groups = []
+        for count, sample, config in sorted(self._configs.values(),
+                                            key=lambda g: -g[0]):
+            groups.append({"hosts": count, "sample": sample,
+                           "config": config})
+
+        return groups
+
+    def get_error_outliers(self):
+        """Return error counts of hosts that are at least OUTLIER_THRESHOLD
+        standard deviations above the average across all hosts with results
+        from the same plugin.
+        """
+        outliers = {}
+        for metric, (total, squares, top) in sorted(self._errors.items()):
+            hosts = self._plugin_hosts.get(metric.partition('.')[0], 0)
+            if hosts < 2:
+                continue
+
+            avg = total / hosts
+            stdev = math.sqrt(max(squares / hosts - avg * avg, 0))
+            _outliers = {}
+            for count, host in sorted(top, reverse=True):
+                if count > avg and count >= avg + OUTLIER_THRESHOLD * stdev:
+                    _outliers[host] = count
+
+            if _outliers:
+                outliers[metric] = {"avg": round(avg, 3),
+                                    "stdev": round(stdev, 3),
+                                    "hosts": _outliers}
+
+        return outliers
+
+    def get_report(self):
+        report = {"hosts": self.hosts}
+        skew = self.get_version_skew()
+        if skew:
+            report["version-skew"] = skew
+
+        groups = self.get_config_groups()
+        if groups:
+            report["config-groups"] = groups
+            if self._other_configs:
+                report["config-groups-untracked"] = self._other_configs
+
+        outliers = self.get_error_outliers()
+        if outliers:
+            report["error-outliers"] = outliers
+
+        return {"fleet": report}
+
+
+def get_summaries(paths):
+    """Return a generator of summary paths from a list of summaries, batch
+    mode index files or directories containing either.
+    """
+    for path in paths:
+        if os.path.isdir(path):
+            index = os.path.join(path, BATCH_INDEX_NAME)
+            if os.path.exists(index):
+                path = index
+            else:
+                for summary in sorted(glob.glob(os.path.join(path,
+                                                             "*.summary"))):
+                    yield summary
+
+                continue
+
+        if os.path.basename(path) == BATCH_INDEX_NAME:
+            with open(path) as fd:
+                index = yaml.safe_load(fd) or {}
+
+            for entry in index.get("sosreports", []):
+                if entry.get("status") == "ok":
+                    yield os.path.join(os.path.dirname(path),
+                                       entry["summary"])
+        else:
+            yield path
+
+
+def read_batch_status(path):
+    """Read the status file of a sosreport analysed in batch mode.
+
+    @return: dict of the non-empty values of BATCH_STATUS_FIELDS.
+    """
+    with open(path, 'rb') as fd:
+        values = fd.read().decode(errors="replace").split("\0")
+
+    status = {}
+    for field, value in zip(BATCH_STATUS_FIELDS, values):
+        if not value:
+            continue
+
+        if field in ["exit-code", "duration"]:
+            value = int(value)
+
+        status[field] = value
+
+    return status
+
+
+def write_batch_index(path, status_files):
+    """Write the batch mode index of the sosreports with the given status
+    files, in the same order.
+    """
+    index = {"sosreports": [read_batch_status(f) for f in status_files]}
+    with open(path, 'w') as fd:
+        fd.write(helpers.HOTSOSYaml.dumps(index) + "\n")
+
+
+def get_host_name(path, tree):
+    hostname = (tree.get("system") or {}).get("hostname")
+    if hostname and hostname != "unavailable":
+        return str(hostname)
+
+    return os.path.basename(path).rpartition(".summary")[0] or path
+
+
+def aggregate(paths):
+    """Aggregate the summaries found in paths, one at a time.
+
+    @param paths: list of paths as accepted by get_summaries().
+    @return: FleetReport
+    """
+    report = FleetReport()
+    for path in get_summaries(paths):
+        try:
+            with open(path) as fd:
+                tree = yaml.safe_load(fd)
+        except (OSError, yaml.YAMLError) as exc:
+            sys.stderr.write("WARNING: skipping summary {}: {}\n".
+                             format(path, exc))
+            continue
+
+        if not isinstance(tree, dict):
+            continue
+
+        tree.pop("hotsos", None)
+        report.add(get_host_name(path, tree), tree)
+
+    return report
+
+
+if __name__ == "__main__":
+    # Usage: fleet PATH... or fleet --batch-index INDEX STATUS_FILE...
+    if sys.argv[1:2] == ["--batch-index"]:
+        write_batch_index(sys.argv[2], sys.argv[3:])
+    else:
+        helpers.HOTSOSYaml.dump(aggregate(sys.argv[1:]).get_report())
@@ -1,11 +1,17 @@
 #!/usr/bin/python3
-import glob
+import fcntl
+import functools
+import hashlib
+import inspect
 import os
 import subprocess
 import yaml
 
 # HOTSOS GLOBALS
 DATA_ROOT = os.environ.get('DATA_ROOT', '/')
+# Directory, created by hotsos.sh for the duration of a run, in which command
+# output is shared between all plugin processes.
+CMD_OUTPUT_CACHE = os.environ.get('CMD_OUTPUT_CACHE')
 
 
 class HOTSOSDumper(yaml.Dumper):
@@ -19,19 +25,7 @@ class HOTSOSDumper(yaml.Dumper):
 class HOTSOSYaml(object):
 
     @staticmethod
-    def master_has_plugin(name):
-        """Returns True if the master yaml has a top-level enrtry (dict key)
-        with the given plugin name.
-        """
-        path = os.environ.get('MASTER_YAML_OUT')
-        if not os.path.exists(path):
-            raise Exception("Master yaml path not found '{}'".format(path))
-
-        master_yaml = yaml.safe_load(open(path))
-        return name in master_yaml
-
-    @staticmethod
-    def dump(data, indent=0):
+    def dumps(data, indent=0):
         indented = []
         HOTSOSDumper.add_representer(
             dict,
@@ -41,7 +35,141 @@ class HOTSOSYaml(object):
         for line in out.split("\n"):
             indented.append("{}{}".format(" " * indent, line))
 
-        print('\n'.join(indented))
+        return '\n'.join(indented)
+
+    @staticmethod
+    def dump(data, indent=0):
+        print(HOTSOSYaml.dumps(data, indent=indent))
+
+
+class RawResults(object):
+    """Results of a plugin as yaml printed by a non-Python part, kept as
+    printed so that they are output unchanged.
+    """
+
+    def __init__(self, plugin, text):
+        """
+        @param plugin: top-level plugin key.
+        @param text: yaml printed by the part, starting with the plugin key.
+        """
+        self.plugin = plugin
+        self.text = text.rstrip("\n")
+
+    @property
+    def data(self):
+        return (yaml.safe_load(self.text) or {}).get(self.plugin)
+
+    def __eq__(self, other):
+        return (isinstance(other, RawResults) and
+                (self.plugin, self.text) == (other.plugin, other.text))
+
+
+def merge_results(current, data):
+    """Merge data into current, recursively for dicts, and return the
+    result.
+    """
+    if not isinstance(current, dict) or not isinstance(data, dict):
+        return data
+
+    for key, value in data.items():
+        current[key] = merge_results(current.get(key), value)
+
+    return current
+
+
+class PluginResults(object):
+    """Tree of results from all plugins.
+
+    Plugins add their results under their top-level plugin key and can query
+    results added by other plugins. Yaml is produced once from the whole tree
+    after all plugins have run.
+    """
+
+    def __init__(self, echo=False):
+        """
+        @param echo: if True, results are also printed as yaml when added
+                     e.g. when a plugin part is run on its own.
+        """
+        self.echo = echo
+        self._tree = {}
+        # results added since the last call to pop_pending()
+        self._pending = []
+
+    def _merge(self, plugin, data):
+        current = self._tree.get(plugin)
+        if isinstance(current, RawResults) and isinstance(data, RawResults):
+            # append without repeating the plugin key
+            text = data.text.partition("\n")[2]
+            self._tree[plugin] = RawResults(plugin, "\n".join(
+                filter(None, [current.text, text])))
+            return
+
+        if isinstance(current, RawResults):
+            current = current.data
+
+        if isinstance(data, RawResults):
+            if current is None:
+                self._tree[plugin] = data
+                return
+
+            data = data.data
+
+        self._tree[plugin] = merge_results(current, data)
+
+    def add(self, plugin, data):
+        """Add results under the given top-level plugin key. If the key
+        already has results, data is merged into them.
+        """
+        self._pending.append((plugin, data))
+        self._merge(plugin, data)
+        if self.echo:
+            HOTSOSYaml.dump({plugin: data})
+
+    def merge(self, entries):
+        """Merge a list of (plugin, data) entries e.g. as returned by
+        pop_pending() in another process.
+        """
+        for plugin, data in entries:
+            self._merge(plugin, data)
+
+    def pop_pending(self):
+        pending = self._pending
+        self._pending = []
+        return pending
+
+    def has_plugin(self, name):
+        """Returns True if results have been added for the given plugin."""
+        return name in self._tree
+
+    def get(self, key):
+        """Return the results found at the given dot-separated key e.g.
+        "openstack.instances" or None if not found.
+        """
+        value = self._tree
+        for subkey in key.split('.'):
+            if not isinstance(value, dict) or subkey not in value:
+                return None
+
+            value = value[subkey]
+            if isinstance(value, RawResults):
+                value = value.data
+
+        return value
+
+    def dumps(self):
+        out = []
+        for plugin, data in self._tree.items():
+            if isinstance(data, RawResults):
+                out.append(data.text)
+            else:
+                out.append(HOTSOSYaml.dumps({plugin: data}))
+
+        return "\n".join(out)
+
+
+# Results are printed as they are added unless collected by the plugin runner
+# (see plugin_runner.run_python_part()).
+PLUGIN_RESULTS = PluginResults(echo=True)
 
 
 def safe_readlines(path):
@@ -59,6 +187,7 @@ def bool_str(val):
 
 def catch_exception(exc_type):
     def catch_exception_inner1(f):
+        @functools.wraps(f)
         def catch_exception_inner2(*args, **kwargs):
             try:
                 return f(*args, **kwargs)
@@ -70,39 +199,167 @@ def catch_exception(exc_type):
     return catch_exception_inner1
 
 
+class DataSourceCache(object):
+    """Cache of the output of data source collectors (the get_* functions
+    below) so that each source is read, or each command run, at most once
+    per run. Use invalidate() to force sources to be re-read.
+
+    generation is incremented whenever output is invalidated so that state
+    built from data sources can tell whether it needs building again without
+    comparing the output it was built from.
+    """
+
+    def __init__(self):
+        self._cache = {}
+        self.generation = 0
+
+    def get(self, collector, args):
+        key = (collector, args)
+        if key not in self._cache:
+            self._cache[key] = collector(*args)
+
+        value = self._cache[key]
+        if isinstance(value, list):
+            # callers get their own copy of the list of lines
+            return list(value)
+
+        return value
+
+    def invalidate(self, collector=None):
+        """Drop cached output for the given collector or, if none provided,
+        for all collectors.
+        """
+        self.generation += 1
+        if collector is None:
+            self._cache = {}
+            return
+
+        collector = getattr(collector, "collector", collector)
+        for key in list(self._cache):
+            if key[0] == collector:
+                del self._cache[key]
+
+
+DATA_SOURCES = DataSourceCache()
+
+
+def data_source(f):
+    """Collector decorator that memoizes output in DATA_SOURCES."""
+    @functools.wraps(f)
+    def data_source_inner(*args):
+        return DATA_SOURCES.get(f, args)
+
+    data_source_inner.collector = f
+    return data_source_inner
+
+
+def load_data_sources(names):
+    """Load the given data sources into DATA_SOURCES e.g. before forking
+    processes that use them so that they are read once for all of them.
+
+    @param names: names of data source collectors e.g. "get_ps". Names that
+                  are not data sources or that take arguments are ignored.
+    """
+    for name in names:
+        collector = globals().get(name)
+        if (not hasattr(collector, "collector") or
+                inspect.signature(collector).parameters):
+            continue
+
+        try:
+            collector()
+        except Exception:
+            # not cached so raised again when used.
+            pass
+
+
+def _check_output_cached(cmd):
+    key = hashlib.sha1('\0'.join(cmd).encode('UTF-8')).hexdigest()
+    path = os.path.join(CMD_OUTPUT_CACHE, key)
+    # hold a lock for the duration so that concurrent callers wait for the
+    # first one to run the command rather than all running it.
+    with open("{}.lock".format(path), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if os.path.exists(path):
+            with open(path, 'rb') as fd:
+                return fd.read()
+
+        output = subprocess.check_output(cmd)
+        with open("{}.tmp".format(path), 'wb') as fd:
+            fd.write(output)
+
+        os.rename("{}.tmp".format(path), path)
+        return output
+
+
+def get_command_output(cmd):
+    """Run the given command and return its output as a list of lines.
+
+    If CMD_OUTPUT_CACHE is set, output is saved there and subsequent calls
+    with the same command, from any process, return the saved output rather
+    than running the command again.
+
+    @param cmd: command and arguments as a list.
+    """
+    if CMD_OUTPUT_CACHE:
+        output = _check_output_cached(cmd)
+    else:
+        output = subprocess.check_output(cmd)
+
+    return output.decode('UTF-8').splitlines(keepends=True)
+
+
+def path_exists(path):
+    """Same as os.path.exists() but answered from the sosreport index where
+    possible (see sosindex.exists()).
+    """
+    # not imported with the other modules since common.constants, which
+    # sosindex imports, imports this module.
+    from common import sosindex
+    return sosindex.exists(path)
+
+
+def glob_files(pattern):
+    """Same as glob.glob() but answered from the sosreport index where
+    possible (see sosindex.glob_files()).
+    """
+    from common import sosindex
+    return sosindex.glob_files(pattern)
+
+
+@data_source
 def get_ip_addr():
     if DATA_ROOT == '/':
-        output = subprocess.check_output(['ip', '-d', 'address'])
-        return output.decode('UTF-8').splitlines(keepends=True)
+        return get_command_output(['ip', '-d', 'address'])
 
     path = os.path.join(DATA_ROOT, "sos_commands/networking/ip_-d_address")
-    if os.path.exists(path):
+    if path_exists(path):
         return open(path, 'r', encoding='utf8').readlines()
 
     return []
 
 
+@data_source
 @catch_exception(OSError)
 def get_ip_link_show():
     if DATA_ROOT == '/':
-        output = subprocess.check_output(['ip', '-s', '-d', 'link'])
-        return output.decode('UTF-8').splitlines(keepends=True)
+        return get_command_output(['ip', '-s', '-d', 'link'])
 
     path = os.path.join(DATA_ROOT, "sos_commands/networking/ip_-s_-d_link")
-    if os.path.exists(path):
+    if path_exists(path):
         return open(path, 'r', encoding='utf8').readlines()
 
     return []
 
 
+@data_source
 @catch_exception(OSError)
 def get_dpkg_l():
     if DATA_ROOT == '/':
-        output = subprocess.check_output(['dpkg', '-l'])
-        return output.decode('UTF-8').splitlines(keepends=True)
+        return get_command_output(['dpkg', '-l'])
 
     path = os.path.join(DATA_ROOT, "sos_commands/dpkg/dpkg_-l")
-    if os.path.exists(path):
+    if path_exists(path):
         # I have observed UnicodeDecodeError with this file so switching to
         # surrogateescape.
         return safe_readlines(path)
@@ -110,234 +367,233 @@ def get_dpkg_l():
     return []
 
 
+@data_source
 @catch_exception(OSError)
 def get_ps():
     if DATA_ROOT == '/':
-        output = subprocess.check_output(['ps', 'auxwww'])
-        return output.decode('UTF-8').splitlines(keepends=True)
+        return get_command_output(['ps', 'auxwww'])
 
     path = os.path.join(DATA_ROOT, "ps")
-    if os.path.exists(path):
+    if path_exists(path):
         return open(path, 'r', encoding='utf8').readlines()
 
     return []
 
 
+@data_source
 @catch_exception(OSError)
 def get_ps_axo_flags():
     if DATA_ROOT == '/':
-        output = subprocess.check_output(['ps', 'axo', 'flags,state,uid,pid,'
-                                          'ppid,pgid,sid,cls,pri,addr,sz,'
-                                          'wchan:20,lstart,tty,time,cmd'])
-        return output.decode('UTF-8').splitlines(keepends=True)
+        return get_command_output(['ps', 'axo', 'flags,state,uid,pid,'
+                                   'ppid,pgid,sid,cls,pri,addr,sz,'
+                                   'wchan:20,lstart,tty,time,cmd'])
 
     # Older sosrepot uses 'wchan' option while newer ones use 'wchan:20' -
     # thus the glob is to cover both
     path = os.path.join(DATA_ROOT, "sos_commands/process/ps_axo_flags_state_"
                         "uid_pid_ppid_pgid_sid_cls_pri_addr_sz_wchan*_lstart_"
                         "tty_time_cmd")
-    for path in glob.glob(path):
+    for path in glob_files(path):
         return open(path, 'r', encoding='utf8').readlines()
 
     return []
 
 
+@data_source
 @catch_exception(OSError)
 def get_numactl():
     if DATA_ROOT == '/':
-        output = subprocess.check_output(['numactl', '--hardware'])
-        return output.decode('UTF-8').splitlines(keepends=True)
+        return get_command_output(['numactl', '--hardware'])
 
     path = os.path.join(DATA_ROOT, "sos_commands/numa/numactl_--hardware")
-    if os.path.exists(path):
+    if path_exists(path):
         return open(path, 'r', encoding='utf8').readlines()
 
     return []
 
 
+@data_source
 @catch_exception(OSError)
 def get_lscpu():
     if DATA_ROOT == '/':
-        output = subprocess.check_output(['lscpu'])
-        return output.decode('UTF-8').splitlines(keepends=True)
+        return get_command_output(['lscpu'])
 
     path = os.path.join(DATA_ROOT, "sos_commands/processor/lscpu")
-    if os.path.exists(path):
+    if path_exists(path):
         return open(path, 'r', encoding='utf8').readlines()
 
     return []
 
 
+@data_source
 @catch_exception(OSError)
 def get_uptime():
     if DATA_ROOT == '/':
-        output = subprocess.check_output(['uptime'])
-        return output.decode('UTF-8').splitlines(keepends=True)
+        return get_command_output(['uptime'])
 
     path = os.path.join(DATA_ROOT, "uptime")
-    if os.path.exists(path):
+    if path_exists(path):
         return open(path, 'r', encoding='utf8').readlines()
 
     return []
 
 
+@data_source
 @catch_exception(OSError)
 def get_df():
     if DATA_ROOT == '/':
-        output = subprocess.check_output(['df'])
-        return output.decode('UTF-8').splitlines(keepends=True)
+        return get_command_output(['df'])
 
     path = os.path.join(DATA_ROOT, "df")
-    if os.path.exists(path):
+    if path_exists(path):
         return open(path, 'r', encoding='utf8').readlines()
 
     return []
 
 
+@data_source
 @catch_exception(OSError)
 def get_apt_config_dump():
     if DATA_ROOT == '/':
-        output = subprocess.check_output(['apt-config', 'dump'])
-        return output.decode('UTF-8').splitlines(keepends=True)
+        return get_command_output(['apt-config', 'dump'])
 
     path = os.path.join(DATA_ROOT, "sos_commands/apt/apt-config_dump")
-    if os.path.exists(path):
+    if path_exists(path):
         return open(path, 'r', encoding='utf8').readlines()
 
     return []
 
 
+@data_source
 @catch_exception(OSError)
 def get_snap_list_all():
     if DATA_ROOT == '/':
-        output = subprocess.check_output(['snap', 'list', '--all'])
-        return output.decode('UTF-8').splitlines(keepends=True)
+        return get_command_output(['snap', 'list', '--all'])
 
     path = os.path.join(DATA_ROOT, "sos_commands/snappy/snap_list_--all")
-    if os.path.exists(path):
+    if path_exists(path):
         return open(path, 'r', encoding='utf8').readlines()
 
     return []
 
 
+@data_source
 @catch_exception(OSError)
 def get_ceph_osd_df_tree():
     if DATA_ROOT == '/':
-        output = subprocess.check_output(['ceph', 'osd', 'df', 'tree'])
-        return output.decode('UTF-8').splitlines(keepends=True)
+        return get_command_output(['ceph', 'osd', 'df', 'tree'])
 
     path = os.path.join(DATA_ROOT, "sos_commands/ceph/ceph_osd_df_tree")
-    if os.path.exists(path):
+    if path_exists(path):
         return open(path, 'r', encoding='utf8').readlines()
 
     return []
 
 
+@data_source
 @catch_exception(OSError)
 def get_ceph_osd_tree():
     if DATA_ROOT == '/':
-        output = subprocess.check_output(['ceph', 'osd', 'tree'])
-        return output.decode('UTF-8').splitlines(keepends=True)
+        return get_command_output(['ceph', 'osd', 'tree'])
 
     path = os.path.join(DATA_ROOT, "sos_commands/ceph/ceph_osd_tree")
-    if os.path.exists(path):
+    if path_exists(path):
         return open(path, 'r', encoding='utf8').readlines()
 
     return []
 
 
+@data_source
 @catch_exception(OSError)
 def get_ceph_versions():
     if DATA_ROOT == '/':
-        output = subprocess.check_output(['ceph', 'versions'])
-        return output.decode('UTF-8').splitlines(keepends=True)
+        return get_command_output(['ceph', 'versions'])
 
     path = os.path.join(DATA_ROOT, "sos_commands/ceph/ceph_versions")
-    if os.path.exists(path):
+    if path_exists(path):
         return open(path, 'r', encoding='utf8').readlines()
 
     return []
 
 
+@data_source
 @catch_exception(OSError)
 def get_sosreport_time():
     if DATA_ROOT == '/':
-        output = subprocess.check_output(['date', '+%s'])
-        return output.decode('UTF-8').splitlines(keepends=True)
+        return get_command_output(['date', '+%s'])
 
     path = os.path.join(DATA_ROOT, "sos_commands/date/date")
-    if os.path.exists(path):
+    if path_exists(path):
         with open(path, 'r', encoding='utf8') as fd:
             date = fd.read()
-            output = subprocess.check_output(["date", "--date={}".format(date),
-                                              "+%s"])
-            return output.decode('UTF-8').splitlines(keepends=True)[0]
+            return get_command_output(["date", "--date={}".format(date),
+                                       "+%s"])[0]
 
     return []
 
 
+@data_source
 @catch_exception(OSError)
 def get_ceph_volume_lvm_list():
     if DATA_ROOT == '/':
-        output = subprocess.check_output(['ceph-volume', 'lvm', 'list'])
-        return output.decode('UTF-8').splitlines(keepends=True)
+        return get_command_output(['ceph-volume', 'lvm', 'list'])
 
     path = os.path.join(DATA_ROOT, "sos_commands/ceph/ceph-volume_lvm_list")
-    if os.path.exists(path):
+    if path_exists(path):
         return open(path, 'r', encoding='utf8').readlines()
 
     return []
 
 
+@data_source
 @catch_exception(OSError)
 def get_ls_lanR_sys_block():
     if DATA_ROOT == '/':
-        output = subprocess.check_output(['ls', '-lanR', '/sys/block/'])
-        return output.decode('UTF-8').splitlines(keepends=True)
+        return get_command_output(['ls', '-lanR', '/sys/block/'])
 
     path = os.path.join(DATA_ROOT, "sos_commands/block/ls_-lanR_.sys.block")
-    if os.path.exists(path):
+    if path_exists(path):
         return open(path, 'r', encoding='utf8').readlines()
 
     return []
 
 
+@data_source
 @catch_exception(OSError)
 def get_udevadm_info_dev(dev):
     if DATA_ROOT == '/':
-        output = subprocess.check_output(['udevadm', 'info',
-                                          '/dev/{}'.format(dev)])
-        return output.decode('UTF-8').splitlines(keepends=True)
+        return get_command_output(['udevadm', 'info',
+                                   '/dev/{}'.format(dev)])
 
     path = os.path.join(DATA_ROOT, "sos_commands/block/udevadm_info_.dev.{}".
                         format(dev))
-    if os.path.exists(path):
+    if path_exists(path):
         return open(path, 'r', encoding='utf8').readlines()
 
     return []
 
 
+@data_source
 @catch_exception(OSError)
 def get_ip_netns():
     if DATA_ROOT == '/':
-        output = subprocess.check_output(['ip', 'netns'])
-        return output.decode('UTF-8').splitlines(keepends=True)
+        return get_command_output(['ip', 'netns'])
 
     path = os.path.join(DATA_ROOT, "sos_commands/networking/ip_netns")
-    if os.path.exists(path):
+    if path_exists(path):
         return open(path, 'r', encoding='utf8').readlines()
 
     return []
 
 
+@data_source
 @catch_exception(OSError)
 def get_hostname():
     if DATA_ROOT == '/':
-        output = subprocess.check_output(['hostname'])
-        return output.decode('UTF-8').splitlines(keepends=True)
+        return get_command_output(['hostname'])
 
     path = os.path.join(DATA_ROOT, "hostname")
-    if os.path.exists(path):
+    if path_exists(path):
         return open(path, 'r', encoding='utf8').readlines()
 
     return []
@@ -0,0 +1,221 @@
+#!/usr/bin/python3
+import re
+
+from common import (
+    helpers,
+)
+
+# e.g. 13: bond1.4003@bond1: <BROADCAST,MULTICAST,UP,LOWER_UP> mtu 9000 ...
+HEADER_EXPR = re.compile(r"^([0-9]+):\s+([^\s:@]+)(?:@([^\s:]+))?:\s+"
+                         r"<([^>]*)>\s*(.*)")
+# Values of these header fields are recorded e.g. "mtu 9000".
+HEADER_FIELDS = ["mtu", "state", "master"]
+
+# InterfaceTable of helpers.get_ip_link_show() and helpers.get_ip_addr() for
+# this process and the collectors and helpers.DATA_SOURCES generation it was
+# built from.
+_INTERFACE_TABLE = None
+_INTERFACE_TABLE_SOURCE = None
+
+
+class Interface(object):
+    """A network interface as listed by ip link and ip address."""
+
+    def __init__(self, index, name, parent=None, flags=None):
+        """
+        @param index: interface index.
+        @param name: interface name.
+        @param parent: optional name of the interface it is linked to e.g.
+                       the interface of a vlan.
+        @param flags: optional list of flags e.g. ["UP", "LOWER_UP"].
+        """
+        self.index = index
+        self.name = name
+        self.parent = parent
+        self.flags = flags or []
+        self.fields = {}
+        # type of link e.g. ether, loopback or none
+        self.link_type = None
+        self.mac = None
+        # alternative names e.g. enp0s3
+        self.altnames = []
+        # lines of detail output (ip -d) e.g. the kind of interface and its
+        # settings.
+        self.details = []
+        # list of "address/prefix length"
+        self.addresses = []
+        # {"RX"|"TX": {counter: value}} from ip -s link
+        self.stats = {}
+        # position of the interface in the table
+        self.position = None
+
+    @property
+    def kind(self):
+        """Return the kind of interface e.g. bond or vxlan or None if not
+        known.
+        """
+        if self.details:
+            return self.details[0].split()[0]
+
+        return None
+
+    @property
+    def ipv4_addresses(self):
+        return [a for a in self.addresses if ':' not in a]
+
+    def update(self, other):
+        """Add what is known about other, the same interface as listed by a
+        different command.
+        """
+        self.flags = self.flags or other.flags
+        for key, value in other.fields.items():
+            self.fields.setdefault(key, value)
+
+        self.link_type = self.link_type or other.link_type
+        self.mac = self.mac or other.mac
+        self.altnames = self.altnames or other.altnames
+        self.details = self.details or other.details
+        self.addresses += [a for a in other.addresses
+                           if a not in self.addresses]
+        self.stats = self.stats or other.stats
+
+
+def parse_ip_output(lines):
+    """Parse the output of ip link or ip address, with or without -s and -d.
+
+    @return: list of Interface.
+    """
+    interfaces = []
+    iface = None
+    counters = None
+    for line in lines:
+        ret = HEADER_EXPR.match(line)
+        if ret:
+            iface = Interface(int(ret[1]), ret[2], ret[3],
+                              ret[4].split(','))
+            fields = ret[5].split()
+            for key, value in zip(fields, fields[1:]):
+                if key in HEADER_FIELDS:
+                    iface.fields[key] = value
+
+            interfaces.append(iface)
+            counters = None
+            continue
+
+        if iface is None:
+            continue
+
+        fields = line.split()
+        if not fields:
+            continue
+
+        if counters is not None:
+            # values of the counters listed in the previous line
+            direction, columns = counters
+            counters = None
+            if direction and all(v.isdigit() for v in fields):
+                iface.stats[direction] = dict(zip(columns, map(int, fields)))
+
+            continue
+
+        key = fields[0]
+        if key.startswith("link/"):
+            iface.link_type = key.partition('/')[2]
+            if len(fields) > 1 and ':' in fields[1]:
+                iface.mac = fields[1]
+        elif key in ["inet", "inet6"]:
+            iface.addresses.append(fields[1])
+        elif key == "altname":
+            # not a detail since it comes before the kind of interface.
+            iface.altnames.append(fields[1])
+        elif key in ["RX:", "TX:"]:
+            counters = (key[:2], fields[1:])
+        elif key in ["RX", "TX"]:
+            # extended counters e.g. "RX errors: length crc ..." are not
+            # recorded.
+            counters = (None, None)
+        elif key != "valid_lft":
+            iface.details.append(line.strip())
+
+    return interfaces
+
+
+class InterfaceTable(object):
+    """Table of network interfaces parsed once from ip link and ip address
+    output.
+
+    Interfaces are indexed by name, MAC and IP address so that looking up an
+    interface is a dictionary lookup rather than a scan of the output.
+    """
+
+    def __init__(self, ip_link, ip_addr):
+        """
+        @param ip_link: lines of ip -s -d link output.
+        @param ip_addr: lines of ip -d address output.
+        """
+        self.ip_link = ip_link
+        self.ip_addr = ip_addr
+        self.interfaces = []
+        self._by_name = {}
+        self._by_mac = {}
+        self._by_address = {}
+        for lines in [ip_link, ip_addr]:
+            for iface in parse_ip_output(lines):
+                self.add(iface)
+
+    def add(self, iface):
+        """Add an interface or, if already added, what is known about it."""
+        existing = self._by_name.get(iface.name)
+        if existing is not None:
+            existing.update(iface)
+            iface = existing
+        else:
+            iface.position = len(self.interfaces)
+            self.interfaces.append(iface)
+            self._by_name[iface.name] = iface
+            if iface.parent:
+                # as ip lists it
+                self._by_name["{}@{}".format(iface.name,
+                                             iface.parent)] = iface
+
+        if iface.mac:
+            ifaces = self._by_mac.setdefault(iface.mac, [])
+            if iface not in ifaces:
+                ifaces.append(iface)
+
+        for address in iface.addresses:
+            self._by_address.setdefault(address.partition('/')[0], iface)
+
+    def find_by_name(self, name):
+        return self._by_name.get(name)
+
+    def find_by_mac(self, *macs):
+        """Return interfaces with any of the given MACs in table order."""
+        ifaces = [iface for mac in macs for iface in
+                  self._by_mac.get(mac, [])]
+        return sorted(set(ifaces), key=lambda iface: iface.position)
+
+    def find_by_address(self, address):
+        """Return the interface with the given IP address (without prefix
+        length) or None.
+        """
+        return self._by_address.get(address)
+
+
+def get_interface_table():
+    """Return the InterfaceTable of helpers.get_ip_link_show() and
+    helpers.get_ip_addr().
+
+    The table is only built again if helpers.DATA_SOURCES has been
+    invalidated since it was built or either collector has been replaced.
+    """
+    global _INTERFACE_TABLE, _INTERFACE_TABLE_SOURCE
+
+    source = (helpers.get_ip_link_show, helpers.get_ip_addr,
+              helpers.DATA_SOURCES.generation)
+    if _INTERFACE_TABLE is None or _INTERFACE_TABLE_SOURCE != source:
+        _INTERFACE_TABLE = InterfaceTable(helpers.get_ip_link_show(),
+                                          helpers.get_ip_addr())
+        _INTERFACE_TABLE_SOURCE = source
+
+    return _INTERFACE_TABLE
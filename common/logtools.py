@@ -0,0 +1,174 @@
+#!/usr/bin/python3
+import bz2
+import contextlib
+import gzip
+import io
+import itertools
+import lzma
+import re
+import sys
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Size of the blocks logs are read and decompressed in.
+READ_BUFFER_SIZE = 1024 * 1024
+# Magic bytes at the start of files compressed with each supported format.
+COMPRESSION_MAGIC = {"gzip": b"\x1f\x8b",
+                     "xz": b"\xfd7zXZ\x00",
+                     "bz2": b"BZh",
+                     "zstd": b"\x28\xb5\x2f\xfd"}
+
+# Timestamp at the start of oslo-style log lines. Timestamps in this format
+# can be compared as strings.
+TIMESTAMP_EXPR = re.compile(r"^([0-9]{4}-[0-9]{2}-[0-9]{2} "
+                            r"[0-9]{2}:[0-9]{2}:[0-9]{2})")
+TIMESTAMP_BYTES_EXPR = re.compile(TIMESTAMP_EXPR.pattern.encode())
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+# Number of lines at the start of a file looked at for a timestamp before
+# deciding that it is not a timestamped log.
+MAX_TIMESTAMP_PROBE_LINES = 100
+# Paths of logs already reported as unreadable by this process.
+_UNREADABLE = set()
+
+
+def get_compression(fd):
+    """Identify the compression format of a file from its magic bytes.
+
+    @param fd: file object opened in binary mode. Its position is reset to the
+               start of the file.
+    @return: name of the compression format or None if not compressed.
+    """
+    header = fd.read(max(len(m) for m in COMPRESSION_MAGIC.values()))
+    fd.seek(0)
+    for compression, magic in COMPRESSION_MAGIC.items():
+        if header.startswith(magic):
+            return compression
+
+    return None
+
+
+def is_readable(compression, path):
+    """Return True if a log compressed with the given format can be
+    decompressed. zstd needs the optional zstandard module and a warning is
+    written, once per log, if it is not available.
+
+    @param compression: name of the compression format, as returned by
+                        get_compression(), or None.
+    @param path: path of the log.
+    """
+    if compression != "zstd" or zstandard is not None:
+        return True
+
+    if path not in _UNREADABLE:
+        _UNREADABLE.add(path)
+        sys.stderr.write("WARNING: skipping {} - zstandard module not "
+                         "available\n".format(path))
+
+    return False
+
+
+def get_log_stream(fd, path):
+    """Return a text stream of the decompressed contents of fd.
+
+    Gzip, xz, bz2 and, if the zstandard module is available, zstd
+    compression are detected from the magic bytes at the start of the file.
+    A log that can't be decompressed (see is_readable()) is read as empty.
+    Lines are decoded as utf-8 with undecodable bytes escaped rather than
+    raising an error.
+
+    @param fd: file object opened in binary mode and positioned at the start
+               of the file.
+    @param path: path of the file fd was opened from.
+    @return: text file object. Closing it also closes fd.
+    """
+    compression = get_compression(fd)
+    if compression == "gzip":
+        stream = gzip.GzipFile(fileobj=fd)
+    elif compression == "xz":
+        stream = lzma.LZMAFile(fd)
+    elif compression == "bz2":
+        stream = bz2.BZ2File(fd)
+    elif not is_readable(compression, path):
+        stream = io.BytesIO()
+    elif compression == "zstd":
+        dctx = zstandard.ZstdDecompressor()
+        stream = dctx.stream_reader(fd)
+    else:
+        stream = fd
+
+    if stream is not fd:
+        stream = io.BufferedReader(stream, buffer_size=READ_BUFFER_SIZE)
+
+    return io.TextIOWrapper(stream, encoding="utf-8",
+                            errors="surrogateescape")
+
+
+@contextlib.contextmanager
+def open_log(path):
+    """Open a, possibly compressed, log file for reading.
+
+    The file is opened once and its format detected from its magic bytes.
+    See get_log_stream().
+
+    @return: text file object.
+    """
+    with open(path, 'rb', buffering=READ_BUFFER_SIZE) as fd:
+        with get_log_stream(fd, path) as text:
+            yield text
+
+
+def get_line_timestamp(line):
+    """Return the oslo-style timestamp at the start of a str or bytes line
+    or None if it does not have one.
+    """
+    if isinstance(line, bytes):
+        ret = TIMESTAMP_BYTES_EXPR.match(line)
+        if ret:
+            return ret.group(1).decode()
+
+        return None
+
+    ret = TIMESTAMP_EXPR.match(line)
+    if ret:
+        return ret.group(1)
+
+    return None
+
+
+def get_first_timestamp(path):
+    """Return the first timestamp in a, possibly compressed, log file or None
+    if there is none within its first MAX_TIMESTAMP_PROBE_LINES lines.
+    """
+    with open_log(path) as fd:
+        for line in itertools.islice(fd, MAX_TIMESTAMP_PROBE_LINES):
+            timestamp = get_line_timestamp(line)
+            if timestamp:
+                return timestamp
+
+    return None
+
+
+def get_last_timestamp(path):
+    """Return the last timestamp in an uncompressed log file or None if there
+    is none within its last MAX_TIMESTAMP_PROBE_LINES lines. Only the tail of
+    the file is read.
+
+    @return: timestamp or None if the file is compressed.
+    """
+    with open(path, 'rb') as fd:
+        if get_compression(fd):
+            return None
+
+        fd.seek(0, io.SEEK_END)
+        fd.seek(max(fd.tell() - READ_BUFFER_SIZE, 0))
+        lines = fd.read().splitlines()
+
+    for line in reversed(lines[-MAX_TIMESTAMP_PROBE_LINES:]):
+        timestamp = get_line_timestamp(line)
+        if timestamp:
+            return timestamp
+
+    return None
@@ -0,0 +1,467 @@
+#!/usr/bin/python3
+import ast
+import contextlib
+import cProfile
+import importlib
+import io
+import multiprocessing
+import multiprocessing.connection
+import os
+import re
+import resource
+import runpy
+import subprocess
+import sys
+import time
+import traceback
+import yaml
+
+from common import (
+    constants,
+    helpers,
+    searchtools,
+    sosindex,
+)
+
+PLUGINS_DIR = os.path.join(os.path.dirname(os.path.dirname(
+                           os.path.realpath(__file__))), "plugins")
+# {function: common module} of functions that build state from data sources,
+# such as a table parsed from command output, that parts may declare in
+# PLUGIN_DATA_SOURCES alongside helpers data sources.
+SHARED_STATE = {"get_interface_table": "interfacetable",
+                "get_process_table": "processtable"}
+
+
+def get_plugin_parts(plugin):
+    """Return the list of executable parts of the given plugin sorted by
+    priority i.e. the two-digit prefix of their filename.
+    """
+    plugin_dir = os.path.join(PLUGINS_DIR, plugin)
+    if not os.path.isdir(plugin_dir):
+        return []
+
+    parts = []
+    for entry in os.listdir(plugin_dir):
+        if re.compile(r"^[0-9]{2}").match(entry):
+            parts.append(os.path.join(plugin_dir, entry))
+
+    return sorted(parts, key=os.path.basename)
+
+
+def is_python_part(path):
+    with open(path, 'r', errors="surrogateescape") as fd:
+        return "python" in fd.readline()
+
+
+def get_part_declarations(path):
+    """Return the data a plugin part declares it produces and consumes.
+
+    Parts declare these as module-level lists of result keys e.g.
+
+        PLUGIN_PRODUCES = ["openstack.instances"]
+        PLUGIN_CONSUMES = ["openstack.instances"]
+
+    and the data sources it uses that are loaded before parts are forked, as
+    a list of helpers data sources and SHARED_STATE functions e.g.
+
+        PLUGIN_DATA_SOURCES = ["get_process_table"]
+
+    and the searches it executes (see get_part_searchers()).
+
+    The part is parsed but not executed.
+    """
+    declarations = {"PLUGIN_PRODUCES": [], "PLUGIN_CONSUMES": [],
+                    "PLUGIN_DATA_SOURCES": [], "PLUGIN_SEARCHERS": {}}
+    if not is_python_part(path):
+        return declarations
+
+    with open(path, 'r', errors="surrogateescape") as fd:
+        tree = ast.parse(fd.read(), filename=path)
+
+    for node in tree.body:
+        if not isinstance(node, ast.Assign):
+            continue
+
+        for target in node.targets:
+            if isinstance(target, ast.Name) and target.id in declarations:
+                declarations[target.id] = ast.literal_eval(node.value)
+
+    return declarations
+
+
+def has_part_searchers(path):
+    """Return True if a plugin part declares its searches in
+    PLUGIN_SEARCHERS. The part is parsed but not executed.
+    """
+    return bool(get_part_declarations(path)["PLUGIN_SEARCHERS"])
+
+
+def _add_plugin_path(path):
+    plugin_dir = os.path.dirname(path)
+    # plugins import their own *_common modules from the plugin directory.
+    if plugin_dir not in sys.path:
+        sys.path.insert(0, plugin_dir)
+
+
+def get_part_searchers(path):
+    """Return the searches a plugin part will execute so that they can be
+    planned before the part is run.
+
+    Parts declare their searches as a dict of the functions that create
+    their searchers and the keyword arguments they call them with e.g.
+
+        PLUGIN_SEARCHERS = {"openstack_utils.get_rpc_loop_searcher":
+                            {"logs_path": "var/log/neutron"}}
+
+    where each function is in a module the part imports from its plugin
+    directory or common and returns a searcher or list of searchers. The
+    part itself is not executed.
+
+    @return: list of searchtools.FileSearcher.
+    """
+    searchers = []
+    declared = get_part_declarations(path)["PLUGIN_SEARCHERS"]
+    if declared:
+        _add_plugin_path(path)
+
+    for name, kwargs in declared.items():
+        module, _, function = name.rpartition(".")
+        try:
+            ret = getattr(importlib.import_module(module), function)(**kwargs)
+        except Exception:
+            sys.stderr.write("WARNING: unable to plan searches {} of plugin "
+                             "part {}:\n".format(name, path))
+            traceback.print_exc()
+            continue
+
+        if isinstance(ret, searchtools.FileSearcher):
+            ret = [ret]
+
+        searchers += ret
+
+    return searchers
+
+
+def plan_part_searches(parts):
+    """Plan the searches of all parts together so that files searched by
+    more than one part are read once.
+    """
+    searchers = []
+    for part in parts:
+        searchers += get_part_searchers(part)
+
+    if searchers:
+        searchtools.plan_searches(searchers)
+
+
+def run_python_part(path):
+    """Execute a Python plugin part in this interpreter and return whatever
+    it printed to stdout.
+    """
+    _add_plugin_path(path)
+    out = io.StringIO()
+    # results are collected by the runner rather than printed.
+    echo = helpers.PLUGIN_RESULTS.echo
+    helpers.PLUGIN_RESULTS.echo = False
+    with contextlib.redirect_stdout(out):
+        try:
+            runpy.run_path(path, run_name="__main__")
+        except SystemExit:
+            pass
+        except Exception:
+            sys.stderr.write("ERROR: plugin part {} failed:\n".format(path))
+            traceback.print_exc()
+        finally:
+            helpers.PLUGIN_RESULTS.echo = echo
+
+    return out.getvalue()
+
+
+def get_output_results(path, output):
+    """Convert yaml printed by a part into a list of (plugin, data) results
+    entries.
+
+    The yaml of each top-level plugin key is kept as printed (see
+    helpers.RawResults) so that it is output unchanged.
+    """
+    try:
+        data = yaml.safe_load(output)
+    except yaml.YAMLError:
+        sys.stderr.write("ERROR: plugin part {} printed invalid yaml\n".
+                         format(path))
+        return []
+
+    if not isinstance(data, dict):
+        return []
+
+    # split into the lines of each top-level key, in order.
+    blocks = []
+    for line in output.splitlines():
+        if line and not line[0].isspace() and not line.startswith('#'):
+            blocks.append([])
+
+        if blocks:
+            blocks[-1].append(line)
+
+    results = []
+    for plugin, lines in zip(data, blocks):
+        results.append((plugin, helpers.RawResults(plugin, "\n".join(lines))))
+
+    return results
+
+
+def run_part(path):
+    """Execute a plugin part and return the list of (plugin, data) results
+    entries it produced.
+
+    Python parts add their results to helpers.PLUGIN_RESULTS. Anything a part
+    prints to stdout (e.g. non-Python parts) is expected to be yaml and is
+    converted into results.
+    """
+    # discard anything not added by this part
+    helpers.PLUGIN_RESULTS.pop_pending()
+    if is_python_part(path):
+        output = run_python_part(path)
+    else:
+        output = subprocess.run([path], stdout=subprocess.PIPE).stdout.decode(
+            'UTF-8', errors="surrogateescape")
+
+    results = helpers.PLUGIN_RESULTS.pop_pending()
+    if output:
+        results += get_output_results(path, output)
+
+    return results
+
+
+def get_part_name(path):
+    """Return <plugin>/<part> for the given part."""
+    return os.path.relpath(path, PLUGINS_DIR)
+
+
+def profile_part(path):
+    """Execute a plugin part and collect stats about the resources it used.
+
+    Times and peak RSS include the search workers and any subprocesses of
+    the part. Bytes read are those read by the part and its searches. If
+    constants.PROFILE_DIR is set, cProfile stats of the part, excluding its
+    searches which run in other processes, are saved there as
+    <plugin>.<part>.pstats.
+
+    @return: tuple of the results of the part and its stats.
+    """
+    profiler = None
+    if constants.PROFILE_DIR:
+        profiler = cProfile.Profile()
+
+    searchtools.SEARCH_STATS.clear()
+    start = time.monotonic()
+    read_start = searchtools.get_read_bytes()
+    if profiler:
+        profiler.enable()
+
+    results = run_part(path)
+    if profiler:
+        profiler.disable()
+
+    # reap the search workers so that their usage is included.
+    searchtools.close_pool()
+    wall_time = time.monotonic() - start
+    usage_self = resource.getrusage(resource.RUSAGE_SELF)
+    usage_children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu_time = (usage_self.ru_utime + usage_self.ru_stime +
+                usage_children.ru_utime + usage_children.ru_stime)
+    searches = {}
+    bytes_read = searchtools.get_read_bytes() - read_start
+    for file, stats in searchtools.SEARCH_STATS.items():
+        bytes_read += stats["bytes-read"]
+        stats = {k: round(v, 3) if isinstance(v, float) else v
+                 for k, v in stats.items()}
+        searches[os.path.relpath(file, constants.DATA_ROOT)] = stats
+
+    stats = {"wall-time": round(wall_time, 3),
+             "cpu-time": round(cpu_time, 3),
+             "peak-rss-kb": max(usage_self.ru_maxrss,
+                                usage_children.ru_maxrss),
+             "bytes-read": bytes_read}
+    if searches:
+        stats["searches"] = searches
+
+    if profiler:
+        os.makedirs(constants.PROFILE_DIR, exist_ok=True)
+        profiler.dump_stats(os.path.join(
+            constants.PROFILE_DIR,
+            "{}.pstats".format(get_part_name(path).replace(os.sep, '.'))))
+
+    return results, stats
+
+
+def _run_part_task(path, conn):
+    if constants.PROFILE:
+        conn.send(profile_part(path))
+    else:
+        conn.send((run_part(path), None))
+
+    conn.close()
+    # save any log info the part added to the index
+    sosindex.save_index()
+
+
+def get_part_dependencies(parts):
+    """For each part return the set of indexes of preceding parts that
+    produce something it consumes.
+    """
+    producers = {}
+    dependencies = []
+    for idx, part in enumerate(parts):
+        declarations = get_part_declarations(part)
+        deps = set()
+        for key in declarations["PLUGIN_CONSUMES"]:
+            deps.update(producers.get(key, []))
+
+        dependencies.append(deps)
+        for key in declarations["PLUGIN_PRODUCES"]:
+            producers.setdefault(key, []).append(idx)
+
+    return dependencies
+
+
+def get_part_data_sources(parts):
+    """Return the names of the data sources declared by the given parts in
+    PLUGIN_DATA_SOURCES.
+    """
+    names = set()
+    for part in parts:
+        names.update(get_part_declarations(part)["PLUGIN_DATA_SOURCES"])
+
+    return sorted(names)
+
+
+def share_state(parts):
+    """Load the data sources declared by the given parts so that each forked
+    part inherits them rather than loading them again.
+    """
+    # load or build the sosreport index once and save any inventory taken.
+    sosindex.get_index()
+    sosindex.save_index()
+    names = get_part_data_sources(parts)
+    helpers.load_data_sources([name for name in names
+                               if name not in SHARED_STATE])
+    for name in names:
+        if name not in SHARED_STATE:
+            continue
+
+        try:
+            module = importlib.import_module(
+                "common.{}".format(SHARED_STATE[name]))
+            getattr(module, name)()
+        except Exception:
+            # built again, raising the same error, when used.
+            pass
+
+
+def run_plugins(plugins, max_workers=None):
+    """Run all parts of the given plugins and append their results to the
+    master yaml.
+
+    Parts run concurrently, each in its own process forked from this one,
+    with at most max_workers running at once. Data sources declared by parts
+    are loaded before any part is started (see share_state()). Results from
+    each part are merged into helpers.PLUGIN_RESULTS in the order the plugins
+    are provided and, within each plugin, in priority order. A part that
+    consumes data produced by another part is only started once the results
+    of its producer(s) have been merged. Searches declared by parts are
+    planned together, once the parts that can be started first have been
+    forked, so that each file is read once for all of them. No part is
+    forked while planned searches are running and parts with planned
+    searches are started once they have completed. Yaml is written once all
+    parts have completed. If constants.PROFILE is set, the stats of each
+    part are added to the yaml in a separate profile section.
+    """
+    if not max_workers:
+        max_workers = constants.MAX_WORKERS
+
+    parts = []
+    for plugin in plugins:
+        parts += get_plugin_parts(plugin)
+
+    share_state(parts)
+    dependencies = get_part_dependencies(parts)
+    planned = set(idx for idx, part in enumerate(parts)
+                  if has_part_searchers(part))
+    searching = False
+    pending = list(range(len(parts)))
+    running = {}
+    results = {}
+    profile = {}
+    merged = 0
+    while pending or running:
+        for idx in list(pending):
+            if len(running) >= max_workers:
+                break
+
+            if any(dep >= merged for dep in dependencies[idx]):
+                continue
+
+            if idx in planned and not searching:
+                # started once searches have been planned.
+                continue
+
+            if searching:
+                # parts inherit the results of planned searches and are not
+                # forked while the search pool's threads are running.
+                searchtools.wait_planned()
+                searchtools.close_pool()
+                sosindex.save_index()
+                searching = False
+                planned = set()
+
+            reader, writer = multiprocessing.Pipe(duplex=False)
+            proc = multiprocessing.Process(target=_run_part_task,
+                                           args=(parts[idx], writer))
+            proc.start()
+            writer.close()
+            running[reader] = (idx, proc)
+            pending.remove(idx)
+
+        if planned and not searching:
+            # planned once the parts that can be started without them have
+            # been forked, so that searches run alongside those parts.
+            plan_part_searches([parts[idx] for idx in sorted(planned)])
+            searching = True
+
+        if not running:
+            continue
+
+        for reader in multiprocessing.connection.wait(list(running)):
+            idx, proc = running.pop(reader)
+            try:
+                results[idx], stats = reader.recv()
+                if stats:
+                    profile[idx] = stats
+            except EOFError:
+                sys.stderr.write("ERROR: plugin part {} exited without "
+                                 "results\n".format(parts[idx]))
+                results[idx] = []
+
+            reader.close()
+            proc.join()
+
+        while merged in results:
+            helpers.PLUGIN_RESULTS.merge(results.pop(merged))
+            merged += 1
+
+    output = helpers.PLUGIN_RESULTS.dumps()
+    if profile:
+        # kept apart from the results of plugins.
+        profile = {"profile": {get_part_name(parts[idx]): profile[idx]
+                               for idx in sorted(profile)}}
+        profile = helpers.HOTSOSYaml.dumps(profile)
+        output = "\n".join(filter(None, [output, profile]))
+
+    if output:
+        with open(constants.MASTER_YAML_OUT, 'a') as fd:
+            fd.write(output + "\n")
+
+
+if __name__ == "__main__":
+    run_plugins(sys.argv[1:])
@@ -0,0 +1,180 @@
+#!/usr/bin/python3
+import os
+import re
+
+from common import (
+    helpers,
+)
+
+# Arguments processes are indexed by, as {key: expression matching the
+# values of the argument in a command line}.
+INDEXED_ARGS = {"--id": re.compile(r"\s--id[\s=]+([^\s,]+)"),
+                "uuid": re.compile(r"uuid[\s=]+([a-z0-9\-]+)"),
+                "unit": re.compile(r"unit-([0-9a-z\-]+-[0-9]+)"),
+                "machine": re.compile(r"machine-([0-9]+)")}
+# Number of fields before the command in each line of ps auxwww and ps axo
+# flags,...,lstart,tty,time,cmd output.
+PS_FIELDS = 10
+PS_AXO_FLAGS_FIELDS = 19
+
+# ProcessTable of helpers.get_ps() for this process and the collector and
+# helpers.DATA_SOURCES generation it was built from.
+_PROCESS_TABLE = None
+_PROCESS_TABLE_SOURCE = None
+
+
+class Process(object):
+    """A process as listed by ps auxwww."""
+
+    def __init__(self, index, fields):
+        """
+        @param index: position of the process in the ps output.
+        @param fields: fields of its line of ps auxwww output.
+        """
+        self.index = index
+        self.user = fields[0]
+        self.pid = int(fields[1])
+        # resident set size in KiB
+        self.rss = int(fields[5])
+        self.start = fields[8]
+        self.cmd = fields[10].rstrip("\n")
+        self.argv = self.cmd.split()
+        self.exe = os.path.basename(self.argv[0])
+        # basenames of all arguments, in order, since services are often run
+        # by an interpreter e.g. python3 /usr/bin/nova-compute.
+        self.names = [name for name in dict.fromkeys(
+            arg.rpartition('/')[2] for arg in self.argv) if name]
+
+    def get_arg(self, name):
+        """Return the value of option name, given as "name value" or
+        "name=value", or None if not found.
+        """
+        for i, arg in enumerate(self.argv):
+            if arg == name:
+                if i + 1 < len(self.argv):
+                    return self.argv[i + 1]
+            elif arg.startswith(name + "="):
+                return arg.partition('=')[2]
+
+        return None
+
+
+class ProcessTable(object):
+    """Table of processes parsed once from ps output.
+
+    Processes are indexed by executable name, by the basename of each of
+    their arguments and by the values of INDEXED_ARGS so that finding the
+    processes of a service is a dictionary lookup rather than a match of
+    every line of ps.
+    """
+
+    def __init__(self, ps):
+        """
+        @param ps: lines of ps auxwww output.
+        """
+        self.ps = ps
+        self.processes = []
+        self._by_exe = {}
+        self._by_name = {}
+        self._by_arg = {}
+        # {pid: lstart} from ps axo flags, loaded on first use.
+        self._lstart = None
+        self._exprs = {}
+        for line in ps:
+            fields = line.split(None, PS_FIELDS)
+            if len(fields) <= PS_FIELDS or not fields[1].isdigit():
+                # header or truncated line
+                continue
+
+            self.add(Process(len(self.processes), fields))
+
+    def add(self, process):
+        self.processes.append(process)
+        self._by_exe.setdefault(process.exe, []).append(process)
+        for name in process.names:
+            self._by_name.setdefault(name, []).append(process)
+
+        for key, expr in INDEXED_ARGS.items():
+            for value in set(expr.findall(process.cmd)):
+                self._by_arg.setdefault((key, value), []).append(process)
+
+    def find_by_exe(self, exe):
+        """Return processes whose executable has the given basename."""
+        return self._by_exe.get(exe, [])
+
+    def find_by_name(self, name):
+        """Return processes with an argument, including the executable,
+        with the given basename.
+        """
+        return self._by_name.get(name, [])
+
+    def find_by_arg(self, key, value):
+        """Return processes with the given value of one of INDEXED_ARGS."""
+        return self._by_arg.get((key, str(value)), [])
+
+    def get_arg_values(self, key):
+        """Return the values of one of INDEXED_ARGS found in any process."""
+        return sorted(value for _key, value in self._by_arg if _key == key)
+
+    def get_names(self, expr):
+        """Return names of processes (see Process.names) that fully match
+        expr, in order of the first process with each name.
+        """
+        if expr not in self._exprs:
+            self._exprs[expr] = re.compile(expr)
+
+        names = [name for name in self._by_name
+                 if self._exprs[expr].fullmatch(name)]
+        return sorted(names, key=lambda name: self._by_name[name][0].index)
+
+    def get_service_counts(self, exprs):
+        """Count processes by service name i.e. the first of their names (see
+        Process.names) that fully matches any of exprs. Each process is
+        counted under one name only, even if several of its arguments match
+        e.g. /usr/bin/nova-api-metadata --config-dir /etc/nova.
+
+        @return: dict of {name: number of processes} in order of the first
+        process with each name.
+        """
+        names = set()
+        for expr in exprs:
+            names.update(self.get_names(expr))
+
+        processes = {p.index: p for name in names for p in
+                     self._by_name[name]}
+        counts = {}
+        for index in sorted(processes):
+            name = next(n for n in processes[index].names if n in names)
+            counts[name] = counts.get(name, 0) + 1
+
+        return counts
+
+    def get_lstart(self, process):
+        """Return the start time of a process as listed by ps axo lstart or
+        None if not known.
+        """
+        if self._lstart is None:
+            self._lstart = {}
+            for line in helpers.get_ps_axo_flags():
+                fields = line.split(None, PS_AXO_FLAGS_FIELDS)
+                if len(fields) > PS_AXO_FLAGS_FIELDS and fields[3].isdigit():
+                    # lstart without the day of the week
+                    self._lstart[int(fields[3])] = ' '.join(fields[13:17])
+
+        return self._lstart.get(process.pid)
+
+
+def get_process_table():
+    """Return the ProcessTable of helpers.get_ps().
+
+    The table is only built again if helpers.DATA_SOURCES has been
+    invalidated since it was built or helpers.get_ps has been replaced.
+    """
+    global _PROCESS_TABLE, _PROCESS_TABLE_SOURCE
+
+    source = (helpers.get_ps, helpers.DATA_SOURCES.generation)
+    if _PROCESS_TABLE is None or _PROCESS_TABLE_SOURCE != source:
+        _PROCESS_TABLE = ProcessTable(helpers.get_ps())
+        _PROCESS_TABLE_SOURCE = source
+
+    return _PROCESS_TABLE
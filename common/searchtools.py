@@ -1,50 +1,114 @@
 #!/usr/bin/python3
 import os
 
+import collections
+import datetime
+import hashlib
 import glob
-import gzip
+import itertools
+import mmap
 import multiprocessing
 import re
+import time
+import yaml
 
+from common import (
+    constants,
+    logtools,
+    sosarchive,
+    sosindex,
+)
 
-class SearchResultPart(object):
+try:
+    from re import _parser as sre_parse
+except ImportError:
+    import sre_parse
 
-    def __init__(self, index, value):
-        self.index = index
-        self.value = value
+# Literals shorter than this are too common to be worth screening lines with.
+MIN_LITERAL_LEN = 4
+# Uncompressed files larger than this are split into chunks of (roughly) this
+# many bytes that are searched concurrently.
+CHUNK_SIZE = 64 * 1024 * 1024
+# Search uncompressed files by scanning a memory map of them for the literals
+# of search terms rather than reading them line by line.
+USE_MMAP = True
+# e.g. nova-compute.log, nova-compute.log.1, nova-compute.log.2.gz
+ROTATION_EXPR = re.compile(r"^(.+?)(?:\.([0-9]+))?(?:\.(?:gz|xz|bz2|zst))?$")
+
+# Worker pool shared by all searches and the pid of the process that owns it.
+_POOL = None
+_POOL_PID = None
+# Stats of the search task being run by this worker when profiling.
+_TASK_STATS = None
+# Stats of all searches run by this process when profiling, keyed by file.
+SEARCH_STATS = {}
+# FusedTask of searches planned by plan_searches() keyed by get_task_key().
+_PLANNED = {}
 
 
 class SearchResult(object):
+    # There can be millions of results so keep them as small as possible.
+    __slots__ = ("tag", "source", "linenumber", "_indices", "_values")
 
-    def __init__(self, linenumber, source, search_term_tag=None):
+    def __init__(self, linenumber, source, search_term_tag=None, indices=(),
+                 values=()):
+        """
+        @param indices: optional tuple of result part indexes. This is shared
+                        by all results of a search term.
+        @param values: optional tuple of result part values in the same order
+                       as indices.
+        """
         self.tag = search_term_tag
         self.source = source
         self.linenumber = linenumber
-        self._parts = {}
+        self._indices = indices
+        self._values = values
 
     def add(self, index, value):
-        self._parts[index] = SearchResultPart(index, value)
+        self._indices += (index,)
+        self._values += (value,)
 
     def get(self, index):
         """Retrieve a result part by its index."""
-        if index not in self._parts:
-            return None
+        for i, value in zip(self._indices, self._values):
+            if i == index:
+                return value
 
-        return self._parts[index].value
+        return None
 
 
 class SearchResultsCollection(object):
+    """Search results keyed by the file they were found in.
+
+    Results are also indexed by tag, by (path, tag) and by source as they are
+    added so that lookups do not need to scan every result.
+    """
 
     def __init__(self):
         self._iter_idx = 0
         self._results = {}
+        self._by_tag = {}
+        self._by_path_tag = {}
+        self._by_source = {}
 
     @property
     def files(self):
         return list(self._results.keys())
 
+    @property
+    def tags(self):
+        return list(self._by_tag.keys())
+
     def add(self, path, results):
-        self._results[path] = results
+        """Add results found in path. Results already added for path are
+        extended.
+        """
+        self._results.setdefault(path, []).extend(results)
+        for result in results:
+            self._by_tag.setdefault(result.tag, []).append(result)
+            self._by_path_tag.setdefault((path, result.tag),
+                                         []).append(result)
+            self._by_source.setdefault(result.source, []).append(result)
 
     def find_by_path(self, path):
         if path not in self._results:
@@ -52,34 +116,1036 @@ class SearchResultsCollection(object):
 
         return self._results[path]
 
+    def find_by_source(self, source):
+        """Return all results whose source is the given file."""
+        return list(self._by_source.get(source, []))
+
     def find_by_tag(self, tag, path=None):
         """Return all result tagged with tag.
 
         If no path is provided tagged results from all paths are returned.
         """
-        results = []
         if path:
-            paths = [path]
-        else:
-            paths = list(self._results.keys())
+            return list(self._by_path_tag.get((path, tag), []))
 
-        for path in paths:
-            for result in self._results.get(path, []):
-                if result.tag == tag:
-                    results.append(result)
+        return list(self._by_tag.get(tag, []))
 
-        return results
+    def group_by_tag(self, path=None):
+        """Iterate over results grouped by tag.
+
+        @param path: optionally only include results from this path.
+        @return: generator of (tag, results) tuples.
+        """
+        if not path:
+            for tag, results in self._by_tag.items():
+                yield tag, list(results)
+
+            return
+
+        for (_path, tag), results in self._by_path_tag.items():
+            if _path == path:
+                yield tag, list(results)
 
     def __iter__(self):
         return iter(self._results.items())
 
 
+def _get_literal_runs(parsed):
+    """Return the runs of literal characters that any match of the parsed
+    pattern must contain.
+    """
+    runs = []
+    run = ""
+    for op, av in parsed:
+        if op == sre_parse.LITERAL:
+            run += chr(av)
+            continue
+
+        if run:
+            runs.append(run)
+            run = ""
+
+        if op == sre_parse.SUBPATTERN:
+            # av is (group, add_flags, del_flags, pattern)
+            if not (len(av) > 2 and av[1] & re.IGNORECASE):
+                runs += _get_literal_runs(av[-1])
+        elif op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT):
+            # av is (min, max, pattern)
+            if av[0] >= 1:
+                runs += _get_literal_runs(av[2])
+
+    if run:
+        runs.append(run)
+
+    return runs
+
+
+def get_required_literal(key):
+    """Return the longest literal string that any line matching the given
+    regex must contain or None if there is no such literal of at least
+    MIN_LITERAL_LEN characters.
+
+    @param key: regex pattern string
+    """
+    if re.compile(key).flags & re.IGNORECASE:
+        return None
+
+    try:
+        runs = _get_literal_runs(sre_parse.parse(key))
+    except Exception:
+        return None
+
+    runs = [r for r in runs if len(r) >= MIN_LITERAL_LEN]
+    if not runs:
+        return None
+
+    return max(runs, key=len)
+
+
+class CombinedMatcher(object):
+    """Matches lines against a set of search terms.
+
+    Rather than applying each term's regex to each line, terms are compiled
+    into a single alternation so that a line that matches none of them (the
+    common case) costs a single regex match. When a line does match, the
+    alternation tells us the first term that matched and we continue with
+    an alternation of the remaining terms. Terms that cannot be combined
+    e.g. because they use backreferences are matched individually.
+
+    If every term has a literal that a matching line must contain, lines
+    are first screened for those literals and lines that contain none of
+    them are not matched against any regex.
+    """
+
+    def __init__(self, terms):
+        """
+        @param terms: list of search term entries as created by
+                      FileSearcher.add_search_term().
+        """
+        self.terms = terms
+        self._combinable = []
+        self._standalone = []
+        for idx, term in enumerate(terms):
+            # backreferences and global inline flags do not survive being
+            # combined with other terms.
+            expr = r"\\[1-9]|\(\?P=|\(\?[aiLmsux]+\)"
+            if re.compile(expr).search(term["key"].pattern):
+                self._standalone.append(idx)
+            else:
+                self._combinable.append(idx)
+
+        # alternations of self._combinable[n:] keyed by n
+        self._combined = {}
+        if self._combinable and self._get_combined(0) is None:
+            self._standalone = sorted(self._standalone + self._combinable)
+            self._combinable = []
+
+        self._combinable_pos = {idx: pos for pos, idx in
+                                enumerate(self._combinable)}
+        self._literals = None
+        if all([term.get("literal") for term in terms]):
+            self._literals = [(idx, term["literal"])
+                              for idx, term in enumerate(terms)]
+
+    def get_literals_regex(self):
+        """Return a bytes regex that matches any of the literals of the terms
+        or None if not all terms have one.
+        """
+        if self._literals is None:
+            return None
+
+        literals = set([literal for _, literal in self._literals])
+        # prefer longer literals where one is a prefix of another.
+        literals = sorted(literals, key=len, reverse=True)
+        return re.compile(b"|".join([re.escape(literal.encode("utf-8"))
+                                     for literal in literals]))
+
+    def _get_combined(self, start):
+        if start not in self._combined:
+            expr = "|".join(["(?P<__t{}>{})".format(idx,
+                                                    self.terms[idx]["key"].
+                                                    pattern)
+                             for idx in self._combinable[start:]])
+            try:
+                self._combined[start] = re.compile(expr)
+            except re.error:
+                self._combined[start] = None
+
+        return self._combined[start]
+
+    def match(self, line):
+        """Return a list of (term index, match) for every term that matches
+        the given line, ordered by term index.
+        """
+        if self._literals is not None:
+            candidates = [idx for idx, literal in self._literals
+                          if literal in line]
+            if not candidates:
+                return []
+
+            if len(candidates) < len(self.terms):
+                matches = []
+                for idx in candidates:
+                    ret = self.terms[idx]["key"].match(line)
+                    if ret:
+                        matches.append((idx, ret))
+
+                return matches
+
+        matches = []
+        start = 0
+        while start < len(self._combinable):
+            ret = self._get_combined(start).match(line)
+            if not ret:
+                break
+
+            idx = int(ret.lastgroup[3:])
+            # re-match with the term's own regex so that group indices are
+            # those of the term.
+            matches.append((idx, self.terms[idx]["key"].match(line)))
+            start = self._combinable_pos[idx] + 1
+
+        for idx in self._standalone:
+            ret = self.terms[idx]["key"].match(line)
+            if ret:
+                matches.append((idx, ret))
+
+        if self._standalone:
+            matches = sorted(matches, key=lambda m: m[0])
+
+        return matches
+
+
+def count_newlines(buf, start, end):
+    """Count newlines in buf[start:end] a block at a time."""
+    count = 0
+    while start < end:
+        stop = min(start + logtools.READ_BUFFER_SIZE, end)
+        count += buf[start:stop].count(b"\n")
+        start = stop
+
+    return count
+
+
+def get_file_chunks(path, start=0, end=None):
+    """Split a file, or the range [start, end) of it, into newline-aligned
+    byte ranges of roughly CHUNK_SIZE bytes.
+
+    Compressed files and ranges no larger than CHUNK_SIZE are not split.
+
+    @param start: offset of the start of a line.
+    @param end: offset of the end of the range. Defaults to the end of file.
+    @return: list of (start, end) byte offsets.
+    """
+    if end is None:
+        end = os.path.getsize(path)
+
+    if end - start <= CHUNK_SIZE:
+        return [(start, end)]
+
+    with open(path, 'rb') as fd:
+        if logtools.get_compression(fd):
+            return [(start, end)]
+
+        chunks = []
+        while start < end:
+            fd.seek(start + CHUNK_SIZE)
+            # move the boundary to the start of the next line
+            fd.readline()
+            chunk_end = min(fd.tell(), end)
+            chunks.append((start, chunk_end))
+            start = chunk_end
+
+    return chunks
+
+
+def get_first_timestamp(path):
+    """Return the first timestamp in a, possibly compressed, log file or None
+    if there is none within its first logtools.MAX_TIMESTAMP_PROBE_LINES
+    lines. The timestamp is taken from the sosreport index if there is one.
+    """
+    info = sosindex.get_log_info(path)
+    if info is not None:
+        return info["first"]
+
+    return logtools.get_first_timestamp(path)
+
+
+def _get_next_timestamp(fd, offset):
+    """Return the offset and timestamp of the first timestamped line that
+    starts at or after offset or (None, None) if there is none.
+    """
+    if offset > 0:
+        fd.seek(offset - 1)
+        # move to the start of the next line
+        fd.readline()
+    else:
+        fd.seek(0)
+
+    while True:
+        pos = fd.tell()
+        line = fd.readline()
+        if not line:
+            return None, None
+
+        timestamp = logtools.get_line_timestamp(line)
+        if timestamp:
+            return pos, timestamp
+
+
+def find_timestamp_offset(fd, size, match):
+    """Binary search a log whose lines are in timestamp order for the first
+    timestamped line whose timestamp satisfies match.
+
+    @param fd: file object opened in binary mode.
+    @param size: size of the file.
+    @param match: function that takes a timestamp and returns True or False
+                  and that, for timestamps in order, returns False until it
+                  first returns True.
+    @return: offset of the start of the line or size if there is no match.
+    """
+    lo = 0
+    hi = size
+    while lo < hi:
+        mid = (lo + hi) // 2
+        _, timestamp = _get_next_timestamp(fd, mid)
+        if timestamp is None or match(timestamp):
+            hi = mid
+        else:
+            lo = mid + 1
+
+    pos, _ = _get_next_timestamp(fd, lo)
+    if pos is None:
+        return size
+
+    return pos
+
+
+def get_window_offsets(path, since=None, until=None):
+    """Return the byte range of an uncompressed log with lines in timestamp
+    order that holds the entries from since until until, inclusive.
+    """
+    size = os.path.getsize(path)
+    with open(path, 'rb') as fd:
+        start = 0
+        end = size
+        if since:
+            start = find_timestamp_offset(fd, size, lambda t: t >= since)
+
+        if until:
+            end = find_timestamp_offset(fd, size, lambda t: t > until)
+
+    return start, max(start, end)
+
+
+def get_rotation(path):
+    """Return the name a log is rotated from and its rotation number e.g.
+    ("nova-compute.log", 2) for nova-compute.log.2.gz. The current log has
+    rotation number 0.
+    """
+    ret = ROTATION_EXPR.match(path)
+    return ret.group(1), int(ret.group(2) or 0)
+
+
+def get_newer_rotation(path, files):
+    """Return the file in files that path was rotated from i.e. the one with
+    the same name and the next lowest rotation number or None.
+    """
+    name, num = get_rotation(path)
+    newer = None
+    newer_num = None
+    for f in files:
+        _name, _num = get_rotation(f)
+        if _name != name or _num >= num:
+            continue
+
+        if newer_num is None or _num > newer_num:
+            newer = f
+            newer_num = _num
+
+    return newer
+
+
+def read_range(fd, size):
+    """Yield lines from fd until size bytes have been read."""
+    while size > 0:
+        line = fd.readline()
+        if not line:
+            break
+
+        size -= len(line)
+        yield line
+
+
+class LineCounter(object):
+    """Iterator wrapper that counts the lines it has yielded."""
+
+    def __init__(self, lines):
+        self.lines = lines
+        self.count = 0
+
+    def __iter__(self):
+        for line in self.lines:
+            self.count += 1
+            yield line
+
+
+def get_pool():
+    """Return the worker pool shared by all searches in this process.
+
+    The pool is created on first use. A process forked from one that already
+    has a pool gets its own since the workers of a pool belong to the
+    process that created it.
+    """
+    global _POOL, _POOL_PID
+
+    if _POOL is None or _POOL_PID != os.getpid():
+        _POOL = multiprocessing.Pool(processes=constants.MAX_WORKERS)
+        _POOL_PID = os.getpid()
+
+    return _POOL
+
+
+def close_pool():
+    """Wait for the workers of this process's pool to exit, if it has one."""
+    global _POOL, _POOL_PID
+
+    if _POOL is not None and _POOL_PID == os.getpid():
+        _POOL.close()
+        _POOL.join()
+
+    _POOL = None
+    _POOL_PID = None
+
+
+def get_read_bytes():
+    """Return the number of bytes read by this process or 0 if unknown."""
+    try:
+        with open("/proc/self/io") as fd:
+            for line in fd:
+                if line.startswith("rchar:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+
+    return 0
+
+
+def _add_task_stat(key, value):
+    if _TASK_STATS is not None:
+        _TASK_STATS[key] += value
+
+
+def _add_task_match(idx):
+    if _TASK_STATS is not None:
+        matches = _TASK_STATS["matches"]
+        matches[idx] = matches.get(idx, 0) + 1
+
+
+def _profile_task(task, args):
+    """Run a search task and collect stats about it.
+
+    @return: tuple of the return value of the task and a dict of stats.
+    """
+    global _TASK_STATS
+
+    _TASK_STATS = {"lines": 0, "bytes-decompressed": 0, "matches": {}}
+    start = time.monotonic()
+    cpu_start = time.process_time()
+    read_start = get_read_bytes()
+    try:
+        ret = task(*args)
+        stats = _TASK_STATS
+    finally:
+        _TASK_STATS = None
+
+    stats["time"] = time.monotonic() - start
+    stats["cpu-time"] = time.process_time() - cpu_start
+    stats["bytes-read"] = get_read_bytes() - read_start
+    return ret, stats
+
+
+def _search_task_wrapper(path, terms, use_mmap=False, window=None):
+    with open(path, 'rb', buffering=logtools.READ_BUFFER_SIZE) as fd:
+        if use_mmap and not window and logtools.get_compression(fd) is None:
+            ret = _search_mmap(terms, fd, path)
+            if ret is not None:
+                return ret[0]
+
+        with logtools.get_log_stream(fd, path) as text:
+            ret = _search_task(terms, text, path, window=window)
+            if text.buffer is not fd:
+                _add_task_stat("bytes-decompressed", text.buffer.tell())
+
+            return ret
+
+
+def _count_lines_task(path, start, end, first_line=0):
+    """Count the lines in the byte range [start, end) of a file.
+
+    @param first_line: optional number of lines known to precede start.
+    @return: tuple of an empty list of results and the number of lines so
+             that this can be treated like a chunk search.
+    """
+    count = first_line
+    with open(path, 'rb') as fd:
+        fd.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            block = fd.read(min(logtools.READ_BUFFER_SIZE, remaining))
+            if not block:
+                break
+
+            count += block.count(b"\n")
+            remaining -= len(block)
+
+    return [], count
+
+
+def _search_chunk_task(path, terms, start, end, use_mmap=False,
+                       first_line=0):
+    """Search the byte range [start, end) of an uncompressed file.
+
+    @param first_line: optional number of lines known to precede start. This
+                       is added to line numbers and the number of lines.
+    @return: tuple of results, with line numbers relative to the start of the
+             chunk, and the number of lines in the chunk.
+    """
+    with open(path, 'rb') as fd:
+        ret = None
+        if use_mmap:
+            ret = _search_mmap(terms, fd, path, start, end)
+
+        if ret is None:
+            fd.seek(start)
+            lines = LineCounter(read_range(fd, end - start))
+            ret = _search_task(terms, lines, path, decode=True), lines.count
+
+    results, num_lines = ret
+    if first_line:
+        for r in results:
+            r.linenumber += first_line
+
+    return results, num_lines + first_line
+
+
+def _search_mmap(terms, fd, path, start=0, end=None):
+    """Search the byte range [start, end) of an uncompressed file without
+    reading it line by line.
+
+    The file is mapped into memory and scanned for the literals of the
+    terms. Only lines containing a literal are decoded and matched and line
+    numbers are found by counting newlines up to each of those lines.
+
+    @param start: offset of the start of a line.
+    @param end: offset of the end of the range. Defaults to the end of file.
+    @return: tuple of results and number of lines in the range or None if
+             not all terms have a literal to scan for.
+    """
+    matcher = CombinedMatcher(terms)
+    literals = matcher.get_literals_regex()
+    if literals is None:
+        return None
+
+    size = os.fstat(fd.fileno()).st_size
+    if end is None or end > size:
+        end = size
+
+    results = []
+    if start >= end:
+        return results, 0
+
+    term_indices = [tuple(t["indices"]) for t in terms]
+    with mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        # number of lines before pos
+        ln = 0
+        pos = start
+        while True:
+            hit = literals.search(mm, pos, end)
+            if not hit:
+                break
+
+            line_start = mm.rfind(b"\n", pos, hit.start()) + 1
+            if line_start == 0:
+                line_start = pos
+
+            line_end = mm.find(b"\n", hit.end(), end)
+            if line_end < 0:
+                line_end = end
+            else:
+                line_end += 1
+
+            ln += count_newlines(mm, pos, line_start) + 1
+            pos = line_end
+            line = mm[line_start:line_end].decode("utf-8",
+                                                  errors="surrogateescape")
+            for idx, ret in matcher.match(line):
+                s_term = terms[idx]
+                indices = term_indices[idx]
+                results.append(SearchResult(ln, path, s_term.get("tag"),
+                                            indices,
+                                            tuple(ret[i] for i in indices)))
+                _add_task_match(idx)
+
+        ln += count_newlines(mm, pos, end)
+        if pos < end and mm[end - 1:end] != b"\n":
+            # last line has no newline
+            ln += 1
+
+    _add_task_stat("lines", ln)
+    return results, ln
+
+
+def _search_task(terms, fd, path, decode=False, window=None):
+    """
+    @param window: optional (since, until) tuple of timestamps. If provided,
+                   lines before since are skipped and the search stops at the
+                   first line after until.
+    """
+    results = []
+    matcher = CombinedMatcher(terms)
+    term_indices = [tuple(t["indices"]) for t in terms]
+    since, until = window or (None, None)
+    in_window = not since
+    ln = 0
+    for ln, line in enumerate(fd):
+        # line numbers are not zero-indexed
+        ln += 1
+        if decode:
+            line = line.decode("utf-8", errors="surrogateescape")
+
+        if window:
+            timestamp = logtools.get_line_timestamp(line)
+            if timestamp:
+                if until and timestamp > until:
+                    break
+
+                if not in_window and timestamp >= since:
+                    in_window = True
+
+            if not in_window:
+                continue
+
+        for idx, ret in matcher.match(line):
+            s_term = terms[idx]
+            indices = term_indices[idx]
+            results.append(SearchResult(ln, path, s_term.get("tag"), indices,
+                                        tuple(ret[i] for i in indices)))
+            _add_task_match(idx)
+
+    _add_task_stat("lines", ln)
+    return results
+
+
+def get_task_key(task, args):
+    """Return what identifies the part of a file read by a search task i.e.
+    the task and its arguments other than the search terms.
+    """
+    if task is _count_lines_task:
+        return task, args
+
+    return task, args[:1] + args[2:]
+
+
+def _get_task_terms(task, args):
+    if task is _count_lines_task:
+        return []
+
+    return args[1]
+
+
+def _get_terms_signature(terms):
+    return tuple((t["key"].pattern, tuple(t["indices"]), t["tag"],
+                  t["literal"]) for t in terms)
+
+
+class FusedTask(object):
+    """A search task run once for the terms of every search of the same part
+    of a file.
+
+    Each search adds its terms and gets back the results of only those
+    terms so that the file is read once however many searches there are.
+    """
+
+    def __init__(self, task, args):
+        self.task = task
+        self.args = args
+        self.terms = []
+        # (offset, number, signature) of the terms of each search
+        self.owners = []
+        self.pid = os.getpid()
+        self._job = None
+        # (return value, stats) of the task for each search
+        self._results = None
+        self._claimed = set()
+
+    def add(self, terms):
+        """Add the terms of a search.
+
+        @return: index of the search to get its results with.
+        """
+        self.owners.append((len(self.terms), len(terms),
+                            _get_terms_signature(terms)))
+        self.terms += terms
+        return len(self.owners) - 1
+
+    def claim(self, terms):
+        """Return the index of an unclaimed search with the given terms or
+        None if there isn't one.
+        """
+        signature = _get_terms_signature(terms)
+        for idx, (_, _, _signature) in enumerate(self.owners):
+            if idx not in self._claimed and _signature == signature:
+                self._claimed.add(idx)
+                return idx
+
+        return None
+
+    @property
+    def usable(self):
+        """Whether results can be got in this process."""
+        return self._results is not None or self.pid == os.getpid()
+
+    def submit(self, pool):
+        if self._job is not None or self._results is not None:
+            return
+
+        args = self.args
+        if self.task is not _count_lines_task:
+            terms = self.terms
+            if len(self.owners) > 1:
+                # tag results with the index of their term so that they can
+                # be returned to the search the term belongs to.
+                terms = [dict(t, tag=idx) for idx, t in enumerate(terms)]
+
+            args = args[:1] + (terms,) + args[2:]
+
+        if constants.PROFILE:
+            self._job = pool.apply_async(_profile_task, (self.task, args))
+        else:
+            self._job = pool.apply_async(self.task, args)
+
+    def _split(self, ret, stats):
+        """Split the return value and stats of the task by search."""
+        num_lines = None
+        if isinstance(ret, tuple):
+            ret, num_lines = ret
+
+        owner_of = [idx for idx, (_, num, _) in enumerate(self.owners)
+                    for _ in range(num)]
+        results = [[] for _ in self.owners]
+        for r in ret:
+            idx = r.tag
+            r.tag = self.terms[idx]["tag"]
+            results[owner_of[idx]].append(r)
+
+        split = []
+        for idx, (offset, num, _) in enumerate(self.owners):
+            _ret = results[idx]
+            if num_lines is not None:
+                _ret = (_ret, num_lines)
+
+            _stats = None
+            if stats is not None:
+                # the file was read once so only the first search reads it.
+                _stats = {k: v if idx == 0 else 0 for k, v in stats.items()
+                          if k != "matches"}
+                _stats["matches"] = {i - offset: m for i, m in
+                                     stats["matches"].items()
+                                     if offset <= i < offset + num}
+
+            split.append((_ret, _stats))
+
+        return split
+
+    def wait(self):
+        """Wait for the task to complete."""
+        if self._results is not None:
+            return
+
+        ret = self._job.get()
+        self._job = None
+        stats = None
+        if constants.PROFILE:
+            ret, stats = ret
+
+        if len(self.owners) > 1:
+            self._results = self._split(ret, stats)
+        else:
+            self._results = [(ret, stats)]
+
+    def get(self, owner):
+        """Return what the task would have returned for the terms of a
+        search alone.
+        """
+        self.wait()
+        ret, stats = self._results[owner]
+        if constants.PROFILE:
+            return ret, stats
+
+        return ret
+
+
+class FusedJob(object):
+    """Job of one of the searches of a FusedTask."""
+
+    def __init__(self, task, owner):
+        self.task = task
+        self.owner = owner
+
+    @property
+    def end(self):
+        """Offset of the end of the byte range read by a chunked task."""
+        if self.task.task is _count_lines_task:
+            return self.task.args[2]
+
+        return self.task.args[3]
+
+    def get(self):
+        return self.task.get(self.owner)
+
+
+def _get_planned_job(task, args):
+    """Return a FusedJob of a planned search with the same task and terms or
+    None if there isn't one.
+    """
+    fused = _PLANNED.get(get_task_key(task, args))
+    if fused is None or not fused.usable:
+        return None
+
+    owner = fused.claim(_get_task_terms(task, args))
+    if owner is None:
+        return None
+
+    return FusedJob(fused, owner)
+
+
+def fuse_tasks(searchers, use_planned=True):
+    """Group the search tasks of searchers by the part of a file they read.
+
+    @param use_planned: use the tasks of planned searches where possible.
+    @return: tuple of a dict of new FusedTask, keyed by get_task_key(), and
+             for each searcher a list of (path, file, chunked, FusedJob).
+    """
+    tasks = {}
+    jobs = []
+    for s in searchers:
+        s_jobs = []
+        for path, entry, chunked, task, args in s._get_tasks():
+            job = None
+            if use_planned:
+                job = _get_planned_job(task, args)
+
+            if job is None:
+                key = get_task_key(task, args)
+                if key not in tasks:
+                    tasks[key] = FusedTask(task, args)
+
+                job = FusedJob(tasks[key],
+                               tasks[key].add(_get_task_terms(task, args)))
+
+            s_jobs.append((path, entry, chunked, job))
+
+        jobs.append(s_jobs)
+
+    return tasks, jobs
+
+
+def plan_searches(searchers):
+    """Start the searches of searchers, fused, before they are asked for.
+
+    Searches subsequently executed by this process, or by processes forked
+    from it once wait_planned() has returned, with the same tasks and terms
+    as a planned search get its results rather than searching again. This
+    lets searches of the same files by different plugin parts share a
+    single read of each file.
+    """
+    tasks, _ = fuse_tasks(searchers, use_planned=False)
+    pool = get_pool()
+    for key, task in tasks.items():
+        task.submit(pool)
+        _PLANNED[key] = task
+
+
+def wait_planned():
+    """Wait for all planned searches to complete."""
+    for task in _PLANNED.values():
+        task.wait()
+
+
+class SearchCheckpoints(object):
+    """How far files have been searched by previous runs along with data
+    aggregated from the results found in them so that subsequent searches
+    need only search what has since been appended.
+
+    Checkpoints are stored in a yaml file in constants.STATE_DIR, named after
+    the search and the data root so that runs against different sosreports
+    or hosts sharing a state directory do not reset each other's
+    checkpoints. They are keyed by device and inode so that a log that has
+    been rotated i.e. renamed is continued from where it was and a new log
+    created in its place is searched from the start. Checkpoints are
+    discarded if the search they were saved by had a different signature
+    e.g. different search terms. If no state directory is configured
+    checkpoints are disabled.
+    """
+
+    def __init__(self, name, signature, state_dir=None):
+        """
+        @param name: name of the search, used to name the file checkpoints
+                     are stored in.
+        @param signature: anything whose repr() identifies the searches and
+                          aggregation that checkpoints were saved by.
+        @param state_dir: optional directory to store checkpoints in. Defaults
+                          to constants.STATE_DIR.
+        """
+        self.state_dir = state_dir or constants.STATE_DIR
+        self.path = None
+        if self.state_dir:
+            root = hashlib.sha1(os.path.realpath(
+                constants.DATA_ROOT).encode()).hexdigest()[:12]
+            self.path = os.path.join(self.state_dir,
+                                     "{}-{}.yaml".format(name, root))
+
+        self.signature = hashlib.sha1(repr(signature).encode()).hexdigest()
+        self._files = {}
+        # keys of checkpoints for files that still exist
+        self._seen = set()
+        if self.enabled:
+            self._load()
+
+    @property
+    def enabled(self):
+        return self.path is not None
+
+    def _load(self):
+        try:
+            with open(self.path) as fd:
+                state = yaml.safe_load(fd)
+        except (OSError, yaml.YAMLError):
+            return
+
+        if (not isinstance(state, dict) or
+                state.get("signature") != self.signature):
+            return
+
+        self._files = state.get("files") or {}
+
+    def save(self):
+        """Save checkpoints of files seen during this run."""
+        if not self.enabled:
+            return
+
+        files = {k: v for k, v in self._files.items() if k in self._seen}
+        state = {"signature": self.signature, "files": files}
+        os.makedirs(self.state_dir, exist_ok=True)
+        tmp = "{}.{}.tmp".format(self.path, os.getpid())
+        with open(tmp, 'w') as fd:
+            yaml.safe_dump(state, fd)
+
+        os.rename(tmp, self.path)
+
+    def _get_key(self, path):
+        st = os.stat(path)
+        return "{}:{}".format(st.st_dev, st.st_ino)
+
+    def _get_head(self, path, size):
+        with open(path, 'rb') as fd:
+            return hashlib.sha1(fd.read(size)).hexdigest()
+
+    def get(self, path):
+        """Return the checkpoint for a file or None if it has not been
+        searched before or has been replaced since.
+        """
+        key = self._get_key(path)
+        self._seen.add(key)
+        checkpoint = self._files.get(key)
+        if checkpoint is None:
+            return None
+
+        # the inode may have been reused by a different file
+        if (os.path.getsize(path) < checkpoint["offset"] or
+                self._get_head(path, checkpoint["head_size"]) !=
+                checkpoint["head"]):
+            del self._files[key]
+            return None
+
+        return checkpoint
+
+    def update(self, path, offset, lines):
+        """Record that a file has been searched up to offset, which is the
+        end of line number lines.
+        """
+        key = self._get_key(path)
+        self._seen.add(key)
+        checkpoint = self._files.setdefault(key, {"data": None})
+        head_size = min(offset, logtools.READ_BUFFER_SIZE)
+        checkpoint.update({"path": path, "offset": offset, "lines": lines,
+                           "head_size": head_size,
+                           "head": self._get_head(path, head_size)})
+
+    def reset(self, path):
+        """Discard the checkpoint of a file that is to be searched from the
+        start.
+        """
+        key = self._get_key(path)
+        self._seen.add(key)
+        self._files.pop(key, None)
+
+    def get_data(self, path):
+        """Return data aggregated from the results of previous searches of a
+        file or None.
+        """
+        checkpoint = self._files.get(self._get_key(path))
+        if checkpoint is None:
+            return None
+
+        return checkpoint["data"]
+
+    def set_data(self, path, data):
+        """Set data aggregated from the results of all searches of a file
+        so far. The file must have a checkpoint.
+        """
+        self._files[self._get_key(path)]["data"] = data
+
+    def get_all_data(self):
+        """Return the aggregated data of all files seen during this run."""
+        return [v["data"] for k, v in self._files.items()
+                if k in self._seen and v["data"] is not None]
+
+
 class FileSearcher(object):
 
-    def __init__(self):
+    def __init__(self, since=None, until=None, checkpoints=None):
+        """
+        @param since: optional "YYYY-MM-DD HH:MM:SS" timestamp. If set, only
+                      entries of timestamped logs at or after this time are
+                      searched. Defaults to constants.SINCE.
+        @param until: optional "YYYY-MM-DD HH:MM:SS" timestamp. If set, only
+                      entries of timestamped logs at or before this time are
+                      searched. Defaults to constants.UNTIL.
+        @param checkpoints: optional SearchCheckpoints. If enabled, files are
+                            only searched from where the last search that
+                            used these checkpoints got to and files that are
+                            unchanged are not searched at all. Checkpoints
+                            are not used if a time window is set.
+        """
         self.paths = {}
+        self.since = since or constants.SINCE
+        self.until = until or constants.UNTIL
+        self.checkpoints = None
+        if (checkpoints and checkpoints.enabled and
+                not (self.since or self.until)):
+            self.checkpoints = checkpoints
 
-    def add_search_term(self, key, indices, path, tag=None):
+        # offsets that files will have been searched up to keyed by file
+        self._checkpoint_offsets = {}
+        for timestamp in [self.since, self.until]:
+            if timestamp:
+                # raises ValueError if invalid
+                datetime.datetime.strptime(timestamp,
+                                           logtools.TIMESTAMP_FORMAT)
+
+    def add_search_term(self, key, indices, path, tag=None, hint=None):
         """Add a term to search for.
 
         A search term is registered against a path which can be a file,
@@ -91,73 +1157,385 @@ class FileSearcher(object):
                         to extract.
         @param path: path that we will be searching for this key
         @param tag: optional user-friendly identifier for this search term
+        @param hint: optional literal string that any line matching key must
+                     contain. Lines that contain none of the literals of the
+                     terms for a path are skipped without applying any regex.
+                     If not provided, a literal is extracted from key where
+                     possible.
         """
-        entry = {"key": re.compile(key), "indices": indices, "tag": tag}
+        if hint is None:
+            hint = get_required_literal(key)
+
+        entry = {"key": re.compile(key), "indices": indices, "tag": tag,
+                 "literal": hint}
         if path in self.paths:
             self.paths[path].append(entry)
         else:
             self.paths[path] = [entry]
 
-    def _job_wrapper(self, pool, path, entry):
-        term_key = path
-        return pool.apply_async(self._search_task_wrapper,
-                                (entry, term_key))
+    def _get_files(self, path):
+        """Return the list of files matched by a search path.
 
-    def _search_task_wrapper(self, path, term_key):
-        with gzip.open(path, 'r') as fd:
-            try:
-                # test if file is gzip
-                fd.read(1)
-                fd.seek(0)
-                return self._search_task(term_key, fd, path, decode=True)
-            except OSError:
-                pass
+        The sosreport index is used where possible rather than the
+        filesystem.
+        """
+        index = sosindex.get_index()
+        if index is not None:
+            if index.isfile(path):
+                return [path]
+
+            entries = index.listdir(path)
+            if entries is not None:
+                return [os.path.join(path, e) for e in entries]
 
-        with open(path) as fd:
-            return self._search_task(term_key, fd, path)
+            files = index.glob(path)
+            if files is not None:
+                return files
 
-    def _search_task(self, term_key, fd, path, decode=False):
+        if os.path.isfile(path):
+            return [path]
+
+        if os.path.isdir(path):
+            return [os.path.join(path, e) for e in os.listdir(path)]
+
+        return glob.glob(path)
+
+    def _get_window_tasks(self, entry, files, terms, first_timestamps):
+        """Return (chunked, task, args) for the tasks that search the part of
+        a file within the time window or None if the file is not a
+        timestamped log.
+
+        Rotated logs whose entries all lie outside the window are skipped
+        using the first timestamp of the log they were rotated from to tell
+        when their last entry was written. Uncompressed logs are binary
+        searched for the start and end of the window and only that range is
+        searched. Compressed logs are read up to the end of the window.
+        """
+        def get_first_timestamp_cached(path):
+            if path not in first_timestamps:
+                first_timestamps[path] = get_first_timestamp(path)
+
+            return first_timestamps[path]
+
+        first = get_first_timestamp_cached(entry)
+        if first is None:
+            return None
+
+        if self.until and first > self.until:
+            return []
+
+        info = sosindex.get_log_info(entry)
+        if info and info["last"] and self.since and info["last"] < self.since:
+            return []
+
+        newer = get_newer_rotation(entry, files)
+        if self.since and newer:
+            newer_first = get_first_timestamp_cached(newer)
+            if newer_first and newer_first < self.since:
+                return []
+
+        if info:
+            compression = info["compression"]
+        else:
+            with open(entry, 'rb') as fd:
+                compression = logtools.get_compression(fd)
+
+        if not logtools.is_readable(compression, entry):
+            return []
+
+        window = (self.since, self.until)
+        if compression:
+            return [(False, _search_task_wrapper,
+                     (entry, terms, USE_MMAP, window))]
+
+        start, end = get_window_offsets(entry, self.since, self.until)
+        tasks = []
+        if start > 0:
+            # the lines before the window are counted rather than searched so
+            # that line numbers are correct. The index tells us the line
+            # number at the closest offset reached by a previous search.
+            offset, line = sosindex.get_line_offset(entry, start)
+            tasks.append((True, _count_lines_task,
+                          (entry, offset, start, line)))
+
+        for chunk_start, chunk_end in get_file_chunks(entry, start, end):
+            tasks.append((True, _search_chunk_task,
+                          (entry, terms, chunk_start, chunk_end, USE_MMAP)))
+
+        return tasks
+
+    def _get_checkpoint_tasks(self, entry, terms):
+        """Return (chunked, task, args) for the tasks that search the part of
+        a file that has not already been searched.
+
+        Uncompressed files are searched from their checkpoint up to the end
+        of their last complete line. Compressed files are searched in full if
+        changed.
+        """
+        checkpoint = self.checkpoints.get(entry)
+        size = os.path.getsize(entry)
+        with open(entry, 'rb') as fd:
+            compression = logtools.get_compression(fd)
+            if not compression:
+                # don't search a line that is still being written
+                fd.seek(max(size - logtools.READ_BUFFER_SIZE, 0))
+                block = fd.read()
+                size = size - len(block) + block.rfind(b"\n") + 1
+
+        if checkpoint and checkpoint["offset"] >= size:
+            return []
+
+        if not logtools.is_readable(compression, entry):
+            return []
+
+        self._checkpoint_offsets[entry] = size
+        if compression:
+            self.checkpoints.reset(entry)
+            return [(False, _search_task_wrapper, (entry, terms, USE_MMAP))]
+
+        if checkpoint:
+            start = checkpoint["offset"]
+            first_line = checkpoint["lines"]
+        else:
+            self.checkpoints.reset(entry)
+            start = 0
+            first_line = 0
+
+        tasks = []
+        for chunk_start, chunk_end in get_file_chunks(entry, start, size):
+            tasks.append((True, _search_chunk_task,
+                          (entry, terms, chunk_start, chunk_end, USE_MMAP,
+                           first_line)))
+            first_line = 0
+
+        return tasks
+
+    def _update_checkpoint(self, entry, num_lines):
+        """Record that a file has been searched up to the offset its tasks
+        were created for.
+        """
+        offset = self._checkpoint_offsets.pop(entry, None)
+        if offset is not None:
+            self.checkpoints.update(entry, offset, num_lines)
+
+    def _get_tasks(self):
+        """Yield (path, file, chunked, task, args) for every search task.
+
+        Large uncompressed files are split into CHUNK_SIZE byte ranges that
+        are searched concurrently. Only the terms for path are sent to the
+        worker. Chunked tasks return a tuple of results and number of lines
+        searched.
+        """
+        first_timestamps = {}
+        files = {path: self._get_files(path) for path in self.paths}
+        # logs in an archive are only extracted once they are searched.
+        sosarchive.extract([f for _files in files.values() for f in _files])
+        for path, files in files.items():
+            terms = self.paths[path]
+            for entry in files:
+                if self.checkpoints:
+                    for chunked, task, args in self._get_checkpoint_tasks(
+                            entry, terms):
+                        yield path, entry, chunked, task, args
+
+                    continue
+
+                if self.since or self.until:
+                    tasks = self._get_window_tasks(entry, files, terms,
+                                                   first_timestamps)
+                    if tasks is not None:
+                        for chunked, task, args in tasks:
+                            yield path, entry, chunked, task, args
+
+                        continue
+
+                chunks = get_file_chunks(entry)
+                if len(chunks) <= 1:
+                    yield (path, entry, False, _search_task_wrapper,
+                           (entry, terms, USE_MMAP))
+                    continue
+
+                for start, end in chunks:
+                    yield (path, entry, True, _search_chunk_task,
+                           (entry, terms, start, end, USE_MMAP))
+
+    def _get_job(self, pool, task, args):
+        """Submit a search task unless a planned search has the same task and
+        terms.
+        """
+        job = _get_planned_job(task, args)
+        if job is None:
+            fused = FusedTask(task, args)
+            job = FusedJob(fused, fused.add(_get_task_terms(task, args)))
+            fused.submit(pool)
+
+        return job
+
+    def _add_stats(self, path, file, stats):
+        """Add the stats of a search task to SEARCH_STATS."""
+        file_stats = SEARCH_STATS.setdefault(file, {
+            "time": 0, "cpu-time": 0, "lines": 0, "bytes-read": 0,
+            "bytes-decompressed": 0, "terms": {}})
+        for key in ["time", "cpu-time", "lines", "bytes-read",
+                    "bytes-decompressed"]:
+            file_stats[key] += stats[key]
+
+        terms = self.paths[path]
+        for term in terms:
+            key = term["tag"] or term["key"].pattern
+            file_stats["terms"].setdefault(key, 0)
+
+        for idx, matches in stats["matches"].items():
+            term = terms[idx]
+            file_stats["terms"][term["tag"] or term["key"].pattern] += matches
+
+    def _get_job_result(self, path, file, job):
+        ret = job.get()
+        if not constants.PROFILE:
+            return ret
+
+        ret, stats = ret
+        self._add_stats(path, file, stats)
+        return ret
+
+    def _get_job_results(self, path, file, jobs):
+        """Merge the results of all chunks of a file in order, offsetting
+        line numbers by the number of lines in preceding chunks.
+
+        @param jobs: list of (chunked, job) tuples.
+        """
         results = []
-        for ln, line in enumerate(fd):
-            # line numbers are not zero-indexed
-            ln += 1
-            for s_term in self.paths[term_key]:
-                if type(line) == bytes:
-                    line = line.decode("utf-8")
+        offset = 0
+        for chunked, job in jobs:
+            if not chunked:
+                results += self._get_job_result(path, file, job)
+                continue
+
+            chunk_results, num_lines = self._get_job_result(path, file, job)
+            for r in chunk_results:
+                r.linenumber += offset
+
+            results += chunk_results
+            offset += num_lines
+            # chunks end at the start of a line so the index can record its
+            # line number.
+            sosindex.add_line_offset(file, job.end, offset)
+
+        return results, offset
+
+    def _get_jobs(self, fused_jobs):
+        """Group the jobs returned for this searcher by fuse_tasks() by path
+        and file.
+        """
+        jobs = {}
+        for path, entry, chunked, job in fused_jobs:
+            path_jobs = jobs.setdefault(path, {})
+            path_jobs.setdefault(entry, []).append((chunked, job))
+
+        return jobs
+
+    def submit(self, pool):
+        """Submit jobs for all search queries without waiting for them to
+        complete.
+
+        @param pool: pool to run the jobs in.
+        @return: jobs to be passed to collect()
+        """
+        tasks, jobs = fuse_tasks([self])
+        for task in tasks.values():
+            task.submit(pool)
+
+        return self._get_jobs(jobs[0])
 
-                ret = s_term["key"].match(line)
-                if ret:
-                    r = SearchResult(ln, path, s_term.get("tag"))
-                    for i in s_term["indices"]:
-                        r.add(i, ret[i])
+    def collect(self, jobs):
+        """Wait for jobs returned by submit() to complete.
 
-                    results.append(r)
+        @return: search results
+        """
+        results = SearchResultsCollection()
+        for path in jobs:
+            for file in jobs[path]:
+                file_results, num_lines = self._get_job_results(
+                    path, file, jobs[path][file])
+                results.add(file, file_results)
+                if self.checkpoints:
+                    self._update_checkpoint(file, num_lines)
 
         return results
 
     def search(self):
-        results = SearchResultsCollection()
         """Execute all the search queries.
 
         @return: search results
         """
-        with multiprocessing.Pool(processes=os.cpu_count()) as pool:
-            jobs = {}
-            for path in self.paths:
-                jobs[path] = {}
-                if os.path.isfile(path):
-                    jobs[path][path] = self._job_wrapper(pool, path, path)
-                elif os.path.isdir(path):
-                    for e in os.listdir(path):
-                        d_entry = os.path.join(path, e)
-                        jobs[path][d_entry] = self._job_wrapper(pool, path,
-                                                                d_entry)
-                else:
-                    for e in glob.glob(path):
-                        jobs[path][e] = self._job_wrapper(pool, path, e)
-
-            for path in jobs:
-                for file in jobs[path]:
-                    results.add(file, jobs[path][file].get())
+        return search_batch([self])[0]
 
-        return results
+    def search_iter(self, max_pending=None):
+        """Execute all the search queries and yield results as they become
+        available.
+
+        Files, and chunks of large files, are searched concurrently but
+        results are yielded in the same order as search() would return them.
+        At most max_pending tasks are in flight at once so that only their
+        results are held in memory rather than those of the whole search.
+
+        @param max_pending: maximum number of tasks to submit ahead of the
+                            results being consumed. Defaults to twice
+                            constants.MAX_WORKERS.
+        @return: generator of (file, SearchResult) tuples.
+        """
+        if not max_pending:
+            max_pending = 2 * constants.MAX_WORKERS
+
+        pool = get_pool()
+        jobs = ((path, entry, chunked, self._get_job(pool, task, args))
+                for path, entry, chunked, task, args in self._get_tasks())
+        pending = collections.deque(itertools.islice(jobs, max_pending))
+        current = None
+        offset = 0
+        while pending:
+            path, entry, chunked, job = pending.popleft()
+            # keep the pool busy while results are being consumed.
+            pending.extend(itertools.islice(jobs, 1))
+            if entry != current:
+                if current and self.checkpoints:
+                    self._update_checkpoint(current, offset)
+
+                current = entry
+                offset = 0
+
+            if chunked:
+                results, num_lines = self._get_job_result(path, entry, job)
+            else:
+                results = self._get_job_result(path, entry, job)
+                num_lines = 0
+
+            for r in results:
+                r.linenumber += offset
+                yield entry, r
+
+            if chunked:
+                offset += num_lines
+                sosindex.add_line_offset(entry, job.end, offset)
+
+        if current and self.checkpoints:
+            self._update_checkpoint(current, offset)
+
+
+def search_batch(searchers):
+    """Execute the search queries of several searchers together.
+
+    Tasks of any of the searchers that read the same part of a file are
+    fused so that it is read once for all of them. All tasks are submitted
+    to the shared pool before any results are collected so that the queries
+    of all searchers run concurrently.
+
+    @param searchers: list of FileSearcher objects.
+    @return: list of search results in the same order as searchers.
+    """
+    tasks, jobs = fuse_tasks(searchers)
+    pool = get_pool()
+    for task in tasks.values():
+        task.submit(pool)
+
+    return [s.collect(s._get_jobs(j)) for s, j in zip(searchers, jobs)]
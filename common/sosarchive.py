@@ -0,0 +1,277 @@
+#!/usr/bin/python3
+import fcntl
+import json
+import os
+import re
+import shutil
+import sys
+import tarfile
+
+from common import constants
+
+ARCHIVE_EXPR = re.compile(r".+\.(tar|tar\.gz|tgz|tar\.xz|txz|tar\.bz2)$")
+INDEX_NAME = ".hotsos-archive"
+INDEX_VERSION = 1
+# Files in DEFERRED_DIRS larger than this are only extracted once searched.
+DEFER_SIZE = 1024 * 1024
+# Directories containing logs i.e. the bulk of a sosreport that is only read
+# by searches.
+DEFERRED_DIRS = ("var/log/", "sos_commands/logs/")
+COPY_BUFFER_SIZE = 1024 * 1024
+# Raised for members refused by a tarfile extraction filter. Filters are only
+# available from python 3.12 and some backported security releases.
+_FILTER_ERROR = getattr(tarfile, "FilterError", ())
+
+# Archive of constants.DATA_ROOT for this process.
+_ARCHIVE = None
+_ARCHIVE_LOADED = False
+
+
+def is_archive(path):
+    return os.path.isfile(path) and ARCHIVE_EXPR.match(path) is not None
+
+
+def _is_safe_name(name):
+    return not (os.path.isabs(name) or
+                ".." in os.path.normpath(name).split(os.sep))
+
+
+class SOSArchive(object):
+    """A sosreport archive extracted on demand.
+
+    The archive is read once, as a stream, to index its members and extract
+    all but large logs into a directory. Logs are left as empty placeholders
+    so that the layout of the sosreport is complete and are only extracted
+    once a search asks for them. Compressed tar streams can't be read from
+    an arbitrary offset so extracting logs decompresses the archive up to
+    the last of them, but without writing anything other than the logs
+    themselves to disk.
+    """
+
+    def __init__(self, archive, extract_dir):
+        self.archive = os.path.abspath(archive)
+        self.extract_dir = os.path.realpath(extract_dir)
+        self.path = os.path.join(self.extract_dir, INDEX_NAME)
+        self.data_root = self.extract_dir
+        # {path: [offset, size, mtime]} of members not extracted by unpack().
+        self._deferred = {}
+
+    def _get_deferred(self, member):
+        if not member.isreg() or member.size <= DEFER_SIZE:
+            return None
+
+        # paths are relative to the top-level directory of the sosreport.
+        relpath = member.name.partition('/')[2]
+        if not any(relpath.startswith(d) for d in DEFERRED_DIRS):
+            return None
+
+        return [member.offset_data, member.size, member.mtime]
+
+    def _is_within(self, path):
+        """Whether path, with any symlinks resolved, is in the extract
+        directory.
+        """
+        path = os.path.realpath(path)
+        return (path == self.extract_dir or
+                path.startswith(self.extract_dir + os.sep))
+
+    def _is_safe_member(self, member):
+        """Whether a member would be extracted within the extract directory
+        and, if a link, links to something within it.
+
+        Extracting a member follows symlinks extracted before it so a
+        member is only safe if the path it is extracted to is not outside
+        the extract directory once symlinks are resolved.
+        """
+        if not _is_safe_name(member.name):
+            return False
+
+        path = os.path.join(self.extract_dir, member.name)
+        if not self._is_within(path):
+            return False
+
+        if member.issym():
+            if os.path.isabs(member.linkname):
+                return False
+
+            target = os.path.join(os.path.dirname(path), member.linkname)
+            return self._is_within(target)
+
+        if member.islnk():
+            return (_is_safe_name(member.linkname) and
+                    self._is_within(os.path.join(self.extract_dir,
+                                                 member.linkname)))
+
+        return True
+
+    def unpack(self):
+        """Index the archive and extract all but the deferred members.
+
+        Members that would be extracted outside the extract directory e.g.
+        through a symlink, or that link outside it, are skipped. Where
+        supported, the "data" extraction filter of tarfile is also applied.
+
+        @return: path of the root of the sosreport.
+        """
+        roots = set()
+        deferred_members = {}
+        kwargs = {}
+        if getattr(tarfile, "data_filter", None):
+            kwargs["filter"] = "data"
+
+        with tarfile.open(self.archive, 'r|*') as tar:
+            for member in tar:
+                if not self._is_safe_member(member):
+                    continue
+
+                roots.add(member.name.partition('/')[0])
+                deferred = self._get_deferred(member)
+                if deferred is None and member.islnk():
+                    deferred = deferred_members.get(member.linkname)
+
+                path = os.path.join(self.extract_dir, member.name)
+                if deferred is not None:
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    # never write through a symlink.
+                    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC |
+                                 os.O_NOFOLLOW)
+                    os.close(fd)
+                    deferred_members[os.path.realpath(path)] = deferred
+                elif (member.isreg() or member.isdir() or member.issym() or
+                        member.islnk()):
+                    # directory permissions could prevent extracting into
+                    # them.
+                    try:
+                        tar.extract(member, self.extract_dir,
+                                    set_attrs=not member.isdir(), **kwargs)
+                    except _FILTER_ERROR:
+                        # e.g. an absolute symlink
+                        continue
+
+        # sosreports have a single top-level directory.
+        if len(roots) == 1:
+            data_root = os.path.join(self.extract_dir, roots.pop())
+            if self._is_within(data_root):
+                self.data_root = data_root
+
+        self._deferred = deferred_members
+        self.save()
+        return self.data_root
+
+    def save(self):
+        index = {"version": INDEX_VERSION,
+                 "archive": self.archive,
+                 "data_root": self.data_root,
+                 "deferred": self._deferred}
+        with open(self.path, 'w') as fd:
+            json.dump(index, fd)
+
+    def load(self):
+        try:
+            with open(self.path) as fd:
+                index = json.load(fd)
+        except (OSError, ValueError):
+            return False
+
+        if index.get("version") != INDEX_VERSION:
+            return False
+
+        self.archive = index["archive"]
+        self.data_root = index["data_root"]
+        self._deferred = index["deferred"]
+        return True
+
+    def get_member_stat(self, path):
+        """Return [size, mtime] of a deferred member or None."""
+        deferred = self._deferred.get(os.path.realpath(path))
+        if deferred is None:
+            return None
+
+        return deferred[1:3]
+
+    def _is_extracted(self, path):
+        # deferred members are never empty.
+        try:
+            return os.path.getsize(path) == self._deferred[path][1]
+        except OSError:
+            return False
+
+    def extract(self, paths):
+        """Extract any of the given paths that are deferred members.
+
+        All members are extracted in a single pass over the archive. Other
+        processes wait for an extraction in progress.
+        """
+        paths = [os.path.realpath(p) for p in paths]
+        paths = [p for p in set(paths) if p in self._deferred and
+                 self._is_within(p) and not self._is_extracted(p)]
+        if not paths:
+            return
+
+        with open(self.path + ".lock", 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            paths = [p for p in paths if not self._is_extracted(p)]
+            if not paths:
+                return
+
+            with tarfile.open(self.archive, 'r:*') as tar:
+                # the decompressed stream of the archive
+                fd = tar.fileobj
+                for path in sorted(paths, key=lambda p: self._deferred[p][0]):
+                    offset, size, mtime = self._deferred[path]
+                    fd.seek(offset)
+                    tmp = "{}.{}.tmp".format(path, os.getpid())
+                    with open(tmp, 'wb') as out:
+                        shutil.copyfileobj(_LimitedReader(fd, size), out,
+                                           COPY_BUFFER_SIZE)
+
+                    os.utime(tmp, (mtime, mtime))
+                    os.rename(tmp, path)
+
+
+class _LimitedReader(object):
+    """File-like object reading at most size bytes from fd."""
+
+    def __init__(self, fd, size):
+        self.fd = fd
+        self.remaining = size
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+
+        data = self.fd.read(size)
+        self.remaining -= len(data)
+        return data
+
+
+def get_archive():
+    """Return the archive constants.DATA_ROOT was extracted from or None if
+    it was not extracted by hotsos.
+    """
+    global _ARCHIVE, _ARCHIVE_LOADED
+
+    if _ARCHIVE_LOADED:
+        return _ARCHIVE
+
+    _ARCHIVE_LOADED = True
+    if not constants.SOS_ARCHIVE_DIR:
+        return None
+
+    archive = SOSArchive("", constants.SOS_ARCHIVE_DIR)
+    if archive.load():
+        _ARCHIVE = archive
+
+    return _ARCHIVE
+
+
+def extract(paths):
+    """Ensure the given files of an extracted archive are on disk."""
+    archive = get_archive()
+    if archive is not None:
+        archive.extract(paths)
+
+
+if __name__ == "__main__":
+    # Usage: sosarchive ARCHIVE DIR
+    print(SOSArchive(sys.argv[1], sys.argv[2]).unpack())
@@ -0,0 +1,526 @@
+#!/usr/bin/python3
+import atexit
+import bisect
+import fcntl
+import fnmatch
+import glob
+import hashlib
+import json
+import os
+import time
+
+from common import (
+    constants,
+    logtools,
+    sosarchive,
+)
+
+INDEX_VERSION = 3
+# Minimum distance in bytes between the line offsets recorded for
+# uncompressed logs.
+LINE_OFFSET_INTERVAL = 4 * 1024 * 1024
+# Indexes not used for this many seconds are removed.
+INDEX_MAX_AGE = 30 * 24 * 60 * 60
+INDEX_PREFIX = "index-"
+
+# Index of constants.DATA_ROOT for this process.
+_INDEX = None
+_INDEX_LOADED = False
+
+
+def _get_archive_key(data_root):
+    """Return a key identifying the archive data_root was extracted from by
+    hotsos, or None if it wasn't.
+    """
+    archive = sosarchive.get_archive()
+    if (archive is None or os.path.realpath(archive.data_root) !=
+            os.path.realpath(data_root)):
+        return None
+
+    try:
+        st = os.stat(archive.archive)
+    except OSError:
+        return None
+
+    return "{}:{}:{}".format(os.path.realpath(archive.archive), st.st_size,
+                             st.st_mtime)
+
+
+def get_index_dir():
+    """Return the directory indexes are stored in i.e. constants.STATE_DIR if
+    set otherwise the user's cache directory, never the sosreport itself.
+    """
+    if constants.STATE_DIR:
+        return constants.STATE_DIR
+
+    cache_dir = os.environ.get("XDG_CACHE_HOME",
+                               os.path.expanduser("~/.cache"))
+    return os.path.join(cache_dir, "hotsos")
+
+
+def get_index_path(data_root):
+    """Return the path of the index of a sosreport.
+
+    Archives are extracted to a new directory by each run so the index of a
+    sosreport extracted from an archive is keyed on the archive, its size
+    and its mtime rather than on where it was extracted.
+    """
+    key = (_get_archive_key(data_root) or
+           os.path.realpath(data_root))
+    key = hashlib.sha1(key.encode()).hexdigest()
+    return os.path.join(get_index_dir(), "{}{}".format(INDEX_PREFIX, key))
+
+
+def prune_indexes(index_dir, max_age=INDEX_MAX_AGE):
+    """Remove indexes, and their lock files, that have not been used for
+    max_age seconds e.g. those of sosreports that have since been deleted.
+    """
+    expiry = time.time() - max_age
+    try:
+        names = os.listdir(index_dir)
+    except OSError:
+        return
+
+    for name in names:
+        if not name.startswith(INDEX_PREFIX):
+            continue
+
+        path = os.path.join(index_dir, name)
+        try:
+            if os.stat(path).st_mtime < expiry:
+                os.remove(path)
+        except OSError:
+            # e.g. removed by another run
+            continue
+
+
+class SOSIndex(object):
+    """Index of the contents of a sosreport.
+
+    The index records the inventory of the sosreport i.e. every directory
+    entry along with the size and mtime of files so that looking for files
+    does not need to touch the filesystem. The inventory is saved and reused
+    by subsequent runs for as long as the mtimes of the sosreport and its
+    top-level entries, or of the archive it was extracted from, are
+    unchanged. For logs it also records the compression type and first and
+    last timestamp, read from the head and tail of the log on first use, and
+    the line number at offsets reached by searches. Log info is reused for as
+    long as the size and mtime of the log are unchanged, which is checked
+    when it is used.
+
+    Paths are absolute i.e. include the data root. Lookups of paths outside
+    the data root or not in the index return None so that callers can fall
+    back to the filesystem.
+    """
+
+    def __init__(self, data_root, path=None):
+        self.data_root = os.path.abspath(data_root)
+        self.path = path or get_index_path(data_root)
+        self._dirs = {}
+        self._logs = {}
+        # True if the inventory was taken or updated by this process
+        self._new_dirs = False
+        # logs whose info was computed or extended by this process
+        self._new_logs = {}
+
+    def _get_signature(self):
+        """Return what the inventory is valid for i.e. the archive the
+        sosreport was extracted from or the mtimes of the sosreport and its
+        top-level entries.
+        """
+        archive_key = _get_archive_key(self.data_root)
+        if archive_key:
+            return archive_key
+
+        signature = []
+        try:
+            names = sorted(os.listdir(self.data_root))
+            signature.append(["", os.stat(self.data_root).st_mtime])
+        except OSError:
+            return None
+
+        for name in names:
+            try:
+                mtime = os.lstat(os.path.join(self.data_root, name)).st_mtime
+            except OSError:
+                mtime = None
+
+            signature.append([name, mtime])
+
+        return signature
+
+    def _relpath(self, path):
+        path = os.path.abspath(path)
+        if path == self.data_root:
+            return ""
+
+        if not path.startswith(self.data_root + os.sep):
+            return None
+
+        return path[len(self.data_root) + 1:]
+
+    def _read(self):
+        """Return the index saved to disk or None if there is none."""
+        try:
+            with open(self.path) as fd:
+                index = json.load(fd)
+        except (OSError, ValueError):
+            return None
+
+        if index.get("version") != INDEX_VERSION:
+            return None
+
+        return index
+
+    def load(self):
+        """Load the index saved by a previous run. The inventory is taken
+        again if the sosreport has changed since it was saved, keeping the
+        info of logs that are unchanged.
+
+        @return: True if the saved inventory was loaded.
+        """
+        index = self._read()
+        if index is not None and index["root"] == self._get_signature():
+            self._dirs = index["dirs"]
+            self._logs = index["logs"]
+            try:
+                # mark the index as used (see prune_indexes()).
+                os.utime(self.path)
+            except OSError:
+                pass
+
+            return True
+
+        self.build()
+        if index is None:
+            return False
+
+        for relpath, info in index["logs"].items():
+            found, entry = self._get_entry(os.path.join(self.data_root,
+                                                        relpath))
+            if found and [info["size"], info["mtime"]] == entry:
+                self._logs[relpath] = info
+
+        return False
+
+    def build(self):
+        """Build the inventory of the sosreport."""
+        self._dirs = {}
+        self._logs = {}
+        archive = sosarchive.get_archive()
+        for root, dirs, files in os.walk(self.data_root):
+            reldir = os.path.relpath(root, self.data_root)
+            if reldir == ".":
+                reldir = ""
+
+            entries = {}
+            for d in dirs:
+                entries[d] = None
+
+            for f in files:
+                entries[f] = _stat(archive, os.path.join(root, f))
+
+            self._dirs[reldir] = entries
+
+        self._new_dirs = True
+
+    def save(self):
+        """Save the inventory and log info computed by this process to disk.
+
+        Log info saved by other processes since this index was loaded is
+        preserved and line offsets recorded for the same log are merged.
+        """
+        index_dir = os.path.dirname(self.path)
+        try:
+            os.makedirs(index_dir, exist_ok=True)
+            with open(self.path + ".lock", 'w') as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                saved = self._read() or {}
+                logs = saved.get("logs", {})
+                for relpath, info in self._new_logs.items():
+                    saved_info = logs.get(relpath)
+                    if (saved_info and
+                            [saved_info["size"], saved_info["mtime"]] ==
+                            [info["size"], info["mtime"]]):
+                        offsets = dict(saved_info["offsets"] +
+                                       info["offsets"])
+                        info = dict(info, offsets=[list(o) for o in
+                                                   sorted(offsets.items())])
+
+                    logs[relpath] = info
+
+                index = {"version": INDEX_VERSION,
+                         "root": saved.get("root"),
+                         "dirs": saved.get("dirs"),
+                         "logs": logs}
+                if self._new_dirs or index["dirs"] is None:
+                    index["root"] = self._get_signature()
+                    index["dirs"] = self._dirs
+
+                tmp = "{}.{}.tmp".format(self.path, os.getpid())
+                with open(tmp, 'w') as fd:
+                    json.dump(index, fd)
+
+                os.rename(tmp, self.path)
+        except OSError:
+            # the index is only an optimisation.
+            return
+
+        self._new_dirs = False
+        self._new_logs = {}
+
+    @property
+    def dirty(self):
+        return self._new_dirs or bool(self._new_logs)
+
+    def _get_entry(self, path):
+        """Return (found, entry) for the given path where entry is None for
+        directories.
+        """
+        relpath = self._relpath(path)
+        if relpath is None:
+            return False, None
+
+        if relpath in self._dirs:
+            return True, None
+
+        reldir, name = os.path.split(relpath)
+        entries = self._dirs.get(reldir)
+        if entries is None or name not in entries:
+            return False, None
+
+        return True, entries[name]
+
+    def exists(self, path):
+        relpath = self._relpath(path)
+        if relpath is None:
+            return None
+
+        found, entry = self._get_entry(path)
+        if not found:
+            # parent not indexed e.g. within a symlinked directory
+            if os.path.dirname(relpath) not in self._dirs:
+                return None
+
+            return False
+
+        return entry is None or entry[0] is not None
+
+    def isfile(self, path):
+        found, entry = self._get_entry(path)
+        if not found:
+            return self.exists(path)
+
+        return entry is not None and entry[0] is not None
+
+    def listdir(self, path):
+        relpath = self._relpath(path)
+        if relpath is None or relpath not in self._dirs:
+            return None
+
+        return list(self._dirs[relpath])
+
+    def glob(self, pattern):
+        """Return files matching a glob whose directory part has no wildcards
+        in the same way as glob.glob() or None if that can't be done using
+        the index.
+        """
+        dirname, basename = os.path.split(pattern)
+        if glob.has_magic(dirname):
+            return None
+
+        names = self.listdir(dirname)
+        if names is None:
+            return None
+
+        if not glob.has_magic(basename):
+            if basename in names:
+                return [pattern]
+
+            return []
+
+        if not basename.startswith('.'):
+            names = [n for n in names if not n.startswith('.')]
+
+        return [os.path.join(dirname, n)
+                for n in fnmatch.filter(names, basename)]
+
+    def get_size(self, path):
+        found, entry = self._get_entry(path)
+        if not found or entry is None:
+            return None
+
+        return entry[0]
+
+    def get_log_info(self, path):
+        """Return info about a log, computing it if it is not yet indexed.
+
+        @return: dict with compression, first and last timestamp and a list
+                 of [offset, line number] pairs for uncompressed logs or None
+                 if path is not an indexed file.
+        """
+        found, entry = self._get_entry(path)
+        if not found or entry is None or entry[0] is None:
+            return None
+
+        relpath = self._relpath(path)
+        current = _stat(sosarchive.get_archive(), path)
+        if current != entry:
+            # changed since the inventory was taken.
+            reldir, name = os.path.split(relpath)
+            self._dirs[reldir][name] = entry = current
+            self._new_dirs = True
+            if entry[0] is None:
+                return None
+
+        info = self._logs.get(relpath)
+        if info is None or [info["size"], info["mtime"]] != entry:
+            info = compute_log_info(path)
+            info["size"], info["mtime"] = entry
+            self._logs[relpath] = info
+            self._new_logs[relpath] = info
+
+        return info
+
+    def add_line_offset(self, path, offset, line):
+        """Record the line number at an offset of an uncompressed log unless
+        one is already recorded less than LINE_OFFSET_INTERVAL bytes before
+        it.
+
+        @param offset: offset of the start of a line.
+        @param line: number of lines before offset.
+        """
+        info = self.get_log_info(path)
+        if not info or info["compression"] or not 0 < offset < info["size"]:
+            return
+
+        offsets = info["offsets"]
+        idx = bisect.bisect_right([o[0] for o in offsets], offset)
+        if idx and offset - offsets[idx - 1][0] < LINE_OFFSET_INTERVAL:
+            return
+
+        offsets.insert(idx, [offset, line])
+        self._new_logs[self._relpath(path)] = info
+
+
+def _stat(archive, path):
+    """Return the [size, mtime] of a file of the sosreport, as recorded in the
+    inventory.
+    """
+    stat = archive and archive.get_member_stat(path)
+    if stat:
+        # not yet extracted
+        return stat
+
+    try:
+        st = os.stat(path)
+        return [st.st_size, st.st_mtime]
+    except OSError:
+        # e.g. broken symlink
+        return [None, None]
+
+
+def compute_log_info(path):
+    """Compute the index info of a log from its head and tail. See
+    SOSIndex.get_log_info().
+    """
+    info = {"compression": None, "first": None, "last": None, "offsets": []}
+    with open(path, 'rb') as fd:
+        info["compression"] = logtools.get_compression(fd)
+
+    info["first"] = logtools.get_first_timestamp(path)
+    if info["first"] and not info["compression"]:
+        info["last"] = logtools.get_last_timestamp(path)
+
+    return info
+
+
+def get_index():
+    """Return the index of constants.DATA_ROOT, loading it on first use, or
+    None if indexing is disabled or running against localhost.
+    """
+    global _INDEX, _INDEX_LOADED
+
+    if _INDEX_LOADED:
+        return _INDEX
+
+    _INDEX_LOADED = True
+    if not constants.USE_INDEX or constants.DATA_ROOT == "/":
+        return None
+
+    _INDEX = SOSIndex(constants.DATA_ROOT)
+    _INDEX.load()
+    prune_indexes(os.path.dirname(_INDEX.path))
+    # log info computed by a process that uses the index is saved when it
+    # exits. Processes that exit without running exit handlers, such as
+    # plugin parts, call save_index() themselves.
+    atexit.register(save_index)
+    return _INDEX
+
+
+def save_index():
+    """Save the inventory or log info taken by this process to the index, if
+    any.
+    """
+    if _INDEX is not None and _INDEX.dirty:
+        _INDEX.save()
+
+
+def get_log_info(path):
+    """Return the indexed info of a log or None if not available. See
+    SOSIndex.get_log_info().
+    """
+    index = get_index()
+    if index is None:
+        return None
+
+    return index.get_log_info(path)
+
+
+def get_line_offset(path, offset):
+    """Return the nearest indexed (offset, line number) at or before the
+    given offset of an uncompressed log.
+    """
+    info = get_log_info(path)
+    if not info:
+        return 0, 0
+
+    ret = (0, 0)
+    for _offset, line in info["offsets"]:
+        if _offset > offset:
+            break
+
+        ret = (_offset, line)
+
+    return ret
+
+
+def add_line_offset(path, offset, line):
+    """Record the line number at an offset of an uncompressed log in the
+    index, if there is one. See SOSIndex.add_line_offset().
+    """
+    index = get_index()
+    if index is not None:
+        index.add_line_offset(path, offset, line)
+
+
+def exists(path):
+    """Same as os.path.exists() but answered from the index if possible."""
+    index = get_index()
+    if index is not None:
+        ret = index.exists(path)
+        if ret is not None:
+            return ret
+
+    return os.path.exists(path)
+
+
+def glob_files(pattern):
+    """Same as glob.glob() but answered from the index if possible."""
+    index = get_index()
+    if index is not None:
+        ret = index.glob(pattern)
+        if ret is not None:
+            return ret
+
+    return glob.glob(pattern)
@@ -28,11 +28,36 @@ export OPENSTACK_SHOW_CPU_PINNING_RESULTS=false
 # This is the path to the end product that plugins can see along the way.
 export MASTER_YAML_OUT
 export USE_ALL_LOGS=false
+# Only analyse log entries within this time window (YYYY-MM-DD HH:MM:SS).
+export SINCE=
+export UNTIL=
+# Directory in which searches save their progress between runs.
+export STATE_DIR=
+# Index sosreports on first analysis to speed up subsequent runs.
+export USE_INDEX=true
+# Maximum number of processes each run uses to run plugins and searches.
+# Defaults to the number of cpus.
+export MAX_WORKERS=
+# Collect stats about the resources used by each plugin part and search.
+export PROFILE=false
+# Directory in which cProfile stats of each plugin part are saved.
+export PROFILE_DIR=
+# When analysing a sosreport archive this is the directory it is extracted to.
+export SOS_ARCHIVE_DIR=
+# When running against localhost this is a directory in which command output
+# is shared by all plugins so that each command is run once per run.
+export CMD_OUTPUT_CACHE=
 
 # import helpers functions
 . `dirname $0`/common/helpers.sh
 
 SAVE_OUTPUT=false
+# Number of sosreports analysed concurrently in batch mode.
+BATCH_JOBS=1
+# Exit code of run_sosreport when a sosreport archive can't be extracted.
+EXTRACT_FAILED_RC=2
+OUTPUT_DIR=.
+FLEET_REPORT=false
 declare -a SOS_PATHS=()
 # unordered
 declare -A PLUGINS=(
@@ -82,6 +107,45 @@ OPTIONS
         log file by default since parsing the full history could take a lot
         longer. Setting this to true tells plugins that we wish to analyse
         all available log history.
+    --since TIME
+        Only analyse log entries at or after TIME. TIME can be anything
+        accepted by date -d e.g. "2021-03-04 16:00" or "2 days ago". Rotated
+        logs that only contain older entries are skipped.
+    --until TIME
+        Only analyse log entries at or before TIME.
+    --no-index
+        Don't build or use an index of the sosreport. By default an index
+        of the files in a sosreport, along with info such as the time range
+        of logs, is saved in the --state-dir DIR, if given, or in
+        ~/.cache/hotsos and used by subsequent runs. Indexes not used for
+        30 days are removed.
+    --state-dir DIR
+        Save how far logs have been analysed, along with what was found, in
+        DIR so that subsequent runs using the same DIR only analyse what has
+        been added to logs since. Intended for periodic runs against
+        localhost. Not used with --since/--until.
+    -j|--jobs N
+        Batch mode. Analyse N of the provided sosreports at a time, each
+        using an equal share of the cpus. The summary of each sosreport is
+        saved in the output directory along with an index of all results
+        (hotsos-batch.yaml) giving the status of each.
+    -o|--output-dir DIR
+        Directory in which batch mode results are saved. Defaults to the
+        current directory.
+    --fleet
+        Batch mode (see --jobs) with a report aggregating the results of all
+        sosreports saved in the output directory (hotsos-fleet.yaml). The
+        report shows components whose versions differ between hosts, hosts
+        grouped by identical config and hosts with unusually high error
+        counts.
+    --profile
+        Add a profile section to the output with the wall time, cpu time,
+        peak RSS and bytes read of each plugin part along with, for each
+        file searched by a part, the number of lines searched, matches of
+        each search term, time spent and bytes read and decompressed.
+    --profile-dir DIR
+        As --profile and also save cProfile stats of each plugin part in DIR
+        (see python3 -m pstats).
     -a|--all
         Enable all plugins. This is the default.
     -v
@@ -89,7 +153,10 @@ OPTIONS
 
 SOSPATH
     Path to a sosreport. Can be provided multiple times. If none provided,
-    will run against local host.
+    will run against local host. Can also be a sosreport archive e.g.
+    sosreport-*.tar.xz in which case only the files that are analysed are
+    extracted, to a temporary directory (see TMPDIR), and logs are only
+    extracted if they are searched.
 
 EOF
 }
@@ -145,6 +212,48 @@ while (($#)); do
         --all-logs)
             USE_ALL_LOGS=true
             ;;
+        --since|--until)
+            (($# > 1)) || { echo "ERROR: $1 requires a time"; exit 1; }
+            timestamp=`date -d "$2" '+%Y-%m-%d %H:%M:%S'` || \
+                { echo "ERROR: invalid time '$2'"; exit 1; }
+            if [ "$1" = "--since" ]; then
+                SINCE="$timestamp"
+            else
+                UNTIL="$timestamp"
+            fi
+            shift
+            ;;
+        -j|--jobs)
+            [[ ${2:-""} =~ ^[1-9][0-9]*$ ]] || \
+                { echo "ERROR: $1 requires a number"; exit 1; }
+            BATCH_JOBS=$2
+            shift
+            ;;
+        -o|--output-dir)
+            (($# > 1)) || { echo "ERROR: $1 requires a directory"; exit 1; }
+            OUTPUT_DIR=$2
+            shift
+            ;;
+        --fleet)
+            FLEET_REPORT=true
+            ;;
+        --profile)
+            PROFILE=true
+            ;;
+        --profile-dir)
+            (($# > 1)) || { echo "ERROR: $1 requires a directory"; exit 1; }
+            PROFILE=true
+            PROFILE_DIR=`realpath -m "$2"`
+            shift
+            ;;
+        --no-index)
+            USE_INDEX=false
+            ;;
+        --state-dir)
+            (($# > 1)) || { echo "ERROR: $1 requires a directory"; exit 1; }
+            STATE_DIR=`realpath -m "$2"`
+            shift
+            ;;
         -v)
             VERBOSITY_LEVEL=1
             ;;
@@ -155,8 +264,9 @@ while (($#)); do
             VERBOSITY_LEVEL=3
             ;;
         *)
-            [[ -d $1 ]] || { echo "ERROR: invalid path '$1'"; exit 1; }
-            SOS_PATHS+=( $1 )
+            [[ -d $1 ]] || [[ -f $1 && $1 =~ \.(tar|tar\.gz|tgz|tar\.xz|txz|tar\.bz2)$ ]] || \
+                { echo "ERROR: invalid path '$1'"; exit 1; }
+            SOS_PATHS+=( "$1" )
             ;;
     esac
     shift
@@ -184,9 +294,22 @@ get_git_rev_info ()
     popd &>/dev/null
 }
 
-MASTER_YAML_OUT=`mktemp`
-CWD=$(dirname `realpath $0`)
-for data_root in ${SOS_PATHS[@]}; do
+# Analyse a single sosreport, displaying the summary or saving it to the
+# given file. Sets globals so must be run in a subshell if run concurrently.
+# Returns EXTRACT_FAILED_RC, without writing a summary, if the sosreport is
+# an archive that can't be extracted.
+run_sosreport ()
+{
+    local data_root=$1
+    local out=${2:-""}
+    local rc
+
+    if [ -f "$data_root" ]; then
+        SOS_ARCHIVE_DIR=`mktemp -d`
+        data_root=`PYTHONPATH=$CWD python3 -m common.sosarchive "$data_root" "$SOS_ARCHIVE_DIR"` || \
+            { rm -rf "$SOS_ARCHIVE_DIR"; return $EXTRACT_FAILED_RC; }
+    fi
+
     if [ "$data_root" = "/" ]; then
         echo -e "INFO: running against localhost since no sosreport path provided\n" 1>&2
         DATA_ROOT=/
@@ -202,36 +325,142 @@ for data_root in ${SOS_PATHS[@]}; do
     if [[ -n ${REPO_INFO_PATH:-""} ]] && [[ -r $REPO_INFO_PATH ]]; then
         repo_info=`cat $REPO_INFO_PATH`
     else
-        repo_info=`get_git_rev_info` || repo_info="unknown" 
+        repo_info=`get_git_rev_info` || repo_info="unknown"
     fi
-    echo -e "hotsos:\n  version: ${SNAP_REVISION:-"development"}\n  repo-info: $repo_info" > $MASTER_YAML_OUT
+    MASTER_YAML_OUT=`mktemp`
+    echo -e "hotsos:\n  version: ${SNAP_REVISION:-"development"}\n  repo-info: $repo_info" > "$MASTER_YAML_OUT"
 
+    declare -a enabled_plugins=()
     for plugin in ${PLUGIN_NAMES[@]}; do
         # skip this since not a real plugin
         [ "$plugin" = "all" ] && continue
         # is plugin enabled?
         ${PLUGINS[$plugin]} || continue
+        enabled_plugins+=( $plugin )
+    done
+
+    if [ "$DATA_ROOT" = "/" ]; then
+        CMD_OUTPUT_CACHE=`mktemp -d`
+    fi
+
+    # Plugin parts are run concurrently, each in a process forked from a
+    # single interpreter that first loads state shared by all parts.
+    PYTHONPATH=$CWD python3 -m common.plugin_runner ${enabled_plugins[@]}
+    rc=$?
+
+    if [[ -n $CMD_OUTPUT_CACHE ]]; then
+        rm -rf "$CMD_OUTPUT_CACHE"
+        CMD_OUTPUT_CACHE=
+    fi
+
+    if [[ -n $SOS_ARCHIVE_DIR ]]; then
+        rm -rf "$SOS_ARCHIVE_DIR"
+        SOS_ARCHIVE_DIR=
+    fi
 
-        for priority in {00..99}; do
-            for plug in `find $CWD/plugins/$plugin -name $priority\*| grep -v __pycache__`; do
-                $plug >> $MASTER_YAML_OUT
-            done
+    if [[ -n $out ]]; then
+        mv "$MASTER_YAML_OUT" "$out"
+    else
+        cat "$MASTER_YAML_OUT"
+        echo "" 1>&2
+        rm "$MASTER_YAML_OUT"
+    fi
+
+    return $rc
+}
+
+# Analyse all sosreports, BATCH_JOBS at a time, each in its own subshell.
+# The summary of each is saved in OUTPUT_DIR along with anything it wrote to
+# stderr and an index of all results.
+run_batch ()
+{
+    local index="$OUTPUT_DIR/hotsos-batch.yaml"
+    local status_dir=`mktemp -d`
+    local -A names=()
+    local -a summaries=()
+    local -a status_files=()
+    local name
+    local i
+
+    mkdir -p "$OUTPUT_DIR" || exit 1
+    # Share the cpus between concurrent runs.
+    if [[ -z $MAX_WORKERS ]]; then
+        MAX_WORKERS=$(( `nproc` / BATCH_JOBS ))
+        ((MAX_WORKERS)) || MAX_WORKERS=1
+    fi
+
+    for ((i=0; i<${#SOS_PATHS[@]}; i++)); do
+        name=`basename "${SOS_PATHS[$i]}"`
+        # different paths can have the same basename
+        [[ -z ${names[$name]:-""} ]] || name="${name}.$i"
+        names[$name]=true
+        summaries+=( "${name}.summary" )
+        status_files+=( "$status_dir/$i" )
+    done
+
+    for ((i=0; i<${#SOS_PATHS[@]}; i++)); do
+        while (( `jobs -rp | wc -l` >= BATCH_JOBS )); do
+            wait -n
         done
+
+        (
+            name=${summaries[$i]%.summary}
+            if [[ -n $STATE_DIR ]]; then
+                STATE_DIR=$STATE_DIR/$name
+            fi
+            start=`date +%s`
+            run_sosreport "${SOS_PATHS[$i]}" "$OUTPUT_DIR/${name}.summary" \
+                2>"$OUTPUT_DIR/${name}.errors"
+            rc=$?
+            summary=${name}.summary
+            if ((rc == EXTRACT_FAILED_RC)); then
+                status=extraction-failed
+                summary=
+            elif ((rc)); then
+                status=failed
+            else
+                status=ok
+            fi
+            errors=${name}.errors
+            [ -s "$OUTPUT_DIR/$errors" ] || { rm "$OUTPUT_DIR/$errors"; errors=; }
+            # see BATCH_STATUS_FIELDS in common/fleet.py
+            printf '%s\0' "`realpath "${SOS_PATHS[$i]}"`" "$summary" $status \
+                $rc $(( `date +%s` - start )) "$errors" > "${status_files[$i]}"
+            echo "INFO: finished ${SOS_PATHS[$i]} ($status, exit code $rc)" 1>&2
+        ) &
     done
+    wait
+
+    PYTHONPATH=$CWD python3 -m common.fleet --batch-index "$index" \
+        "${status_files[@]}" || exit 1
+    rm -rf "$status_dir"
+    echo "Index written to $index"
+
+    if $FLEET_REPORT; then
+        PYTHONPATH=$CWD python3 -m common.fleet "$index" > \
+            "$OUTPUT_DIR/hotsos-fleet.yaml"
+        echo "Fleet report written to $OUTPUT_DIR/hotsos-fleet.yaml"
+    fi
+}
 
+CWD=$(dirname `realpath $0`)
+if ((BATCH_JOBS > 1)) || $FLEET_REPORT; then
+    run_batch
+    exit
+fi
+
+for data_root in "${SOS_PATHS[@]}"; do
     if $SAVE_OUTPUT; then
         if [[ $data_root != "/" ]]; then
-            archive_name=`basename $data_root`
+            archive_name=`basename "$data_root"`
         else
             archive_name="hotsos-`hostname`"
         fi
         out=${archive_name}.summary
-        mv $MASTER_YAML_OUT $out
+        run_sosreport "$data_root" "$out"
         echo "Summary written to $out"
     else
-        cat $MASTER_YAML_OUT
-        echo "" 1>&2
-        rm $MASTER_YAML_OUT
+        run_sosreport "$data_root"
     fi
 
     echo "INFO: see --help for more display options" 1>&2
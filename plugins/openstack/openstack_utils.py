@@ -7,49 +7,186 @@ from common import (
 )
 
 
+def _get_agent_checkpoints(agent, exc_types, include_time_in_key):
+    return searchtools.SearchCheckpoints("{}-exceptions".format(agent),
+                                         [exc_types, include_time_in_key])
+
+
+def _get_agent_searcher(agent, logs_path, exc_types, checkpoints=None):
+    s = searchtools.FileSearcher(checkpoints=checkpoints)
+    if constants.USE_ALL_LOGS:
+        data_source = os.path.join(constants.DATA_ROOT, logs_path,
+                                   '{}.log*'.format(agent))
+    else:
+        data_source = os.path.join(constants.DATA_ROOT, logs_path,
+                                   '{}.log'.format(agent))
+
+    for exc_type in exc_types:
+        s.add_search_term(r"^([0-9\-]+) (\S+) .+({}).+".format(exc_type),
+                          [1, 2, 3], data_source)
+
+    return s
+
+
+def get_rpc_loop_searcher(logs_path):
+    """Return a searcher that finds the start and end of neutron openvswitch
+    agent rpc_loop iterations.
+
+    @param logs_path: (str) path to neutron logs directory
+    """
+    s = searchtools.FileSearcher()
+    if constants.USE_ALL_LOGS:
+        data_source = os.path.join(constants.DATA_ROOT, logs_path,
+                                   'neutron-openvswitch-agent.log*')
+    else:
+        data_source = os.path.join(constants.DATA_ROOT, logs_path,
+                                   'neutron-openvswitch-agent.log')
+
+    s.add_search_term(r"^([0-9\-]+) (\S+) .+ Agent rpc_loop - "
+                      "iteration:([0-9]+) started.*", [1, 2, 3], data_source,
+                      tag="rpc-loop-start")
+    s.add_search_term(r"^([0-9\-]+) (\S+) .+ Agent rpc_loop - "
+                      "iteration:([0-9]+) completed..+Elapsed:([0-9.]+).+",
+                      [1, 2, 3, 4], data_source, tag="rpc-loop-end")
+    return s
+
+
+def get_events_searcher(event_name, stages, data_source):
+    """Return a searcher that finds all stages of events of the given type.
+
+    The first stage is the sequence starter e.g. "Preparing to wait for
+    external event", which can be anywhere after the instance, and the
+    timestamp is optional so that lines without one still count.
+
+    @param event_name: (str) name of the external event
+    @param stages: (list) names of the stages of the event, in order
+    @param data_source: (str) path to the log
+    """
+    s = searchtools.FileSearcher()
+    expr = (r"^(?:([0-9\-]+ [0-9:\.]+) )?.*\[instance: (\S+)\]"
+            r"(?:.+({}) to wait for external event|\s+({})\s.*\s?event)"
+            r"\s+({}-\S+)\s")
+    key = expr.format(stages[0], "|".join(stages[1:]), event_name)
+    s.add_search_term(key, [1, 2, 3, 4, 5], data_source)
+    return s
+
+
+def get_events_searchers(event_meta, log_path):
+    """Return the searchers of get_events_searcher() for each event in
+    event_meta, a dict of {event name: {"stages_keys": stages}}.
+
+    @param log_path: (str) path to the log, relative to the data root
+    """
+    data_source = os.path.join(constants.DATA_ROOT, log_path)
+    return [get_events_searcher(event_name, meta["stages_keys"], data_source)
+            for event_name, meta in event_meta.items()]
+
+
 def get_agent_exceptions(agent, logs_path, exc_types,
                          include_time_in_key=False):
     """Search agent logs and determine frequency of occurrences of the given
     exception types.
 
+    If a state directory is configured, only what has been added to the logs
+    since the last run is searched and the counts found are added to those
+    saved by previous runs.
+
     @param agent: (str) name of agent whose logs we want to search.
     @param logs_path: (str) path to logs directory
     @param exc_types: (list) list of exceptions we want to search for
     @param include_time_in_key: (bool) whether to include time of exception in
                                 output. Default is to only show date.
     """
-    s = searchtools.FileSearcher()
-    if constants.USE_ALL_LOGS:
-        data_source = os.path.join(constants.DATA_ROOT, logs_path,
-                                   '{}.log*'.format(agent))
-    else:
-        data_source = os.path.join(constants.DATA_ROOT, logs_path,
-                                   '{}.log'.format(agent))
+    checkpoints = _get_agent_checkpoints(agent, exc_types,
+                                         include_time_in_key)
+    s = _get_agent_searcher(agent, logs_path, exc_types, checkpoints)
+    # checkpoints are not used by searches limited to a time window.
+    return _get_exceptions_from_results(s.search(), include_time_in_key,
+                                        s.checkpoints)
 
-    for exc_type in exc_types:
-        s.add_search_term(r"^([0-9\-]+) (\S+) .+({}).+".format(exc_type),
-                          [1, 2, 3], data_source)
 
-    results = s.search()
+def get_agents_searchers(agents, logs_path, exc_types,
+                         include_time_in_key=False):
+    """Return the searchers used by get_agents_exceptions_batch()."""
+    return [_get_agent_searcher(agent, logs_path, exc_types,
+                                _get_agent_checkpoints(agent, exc_types,
+                                                       include_time_in_key))
+            for agent in agents]
+
+
+def get_agents_exceptions_batch(agents, logs_path, exc_types,
+                                include_time_in_key=False):
+    """Same as get_agent_exceptions() but for a list of agents whose logs are
+    all searched together.
+
+    @return: dict of exceptions info keyed by agent name. Agents with no
+             exceptions are omitted.
+    """
+    searchers = get_agents_searchers(agents, logs_path, exc_types,
+                                     include_time_in_key)
+    info = {}
+    batch = zip(agents, searchers, searchtools.search_batch(searchers))
+    for agent, s, results in batch:
+        e = _get_exceptions_from_results(results, include_time_in_key,
+                                         s.checkpoints)
+        if e:
+            info[agent] = e
+
+    return info
+
+
+def _count_exceptions(results, include_time_in_key):
+    counts = {}
+    for result in results:
+        exc_tag = result.get(3)
+        if exc_tag not in counts:
+            counts[exc_tag] = {}
+
+        if include_time_in_key:
+            # use hours and minutes only
+            time = re.compile("([0-9]+:[0-9]+).+").search(result.get(2))[1]
+            key = "{}_{}".format(result.get(1), time)
+        else:
+            key = str(result.get(1))
+
+        if key not in counts[exc_tag]:
+            counts[exc_tag][key] = 0
+
+        counts[exc_tag][key] += 1
+
+    return counts
+
+
+def _merge_exception_counts(counts, other):
+    for exc_tag in other:
+        if exc_tag not in counts:
+            counts[exc_tag] = {}
+
+        for key, count in other[exc_tag].items():
+            counts[exc_tag][key] = counts[exc_tag].get(key, 0) + count
+
+    return counts
+
+
+def _get_exceptions_from_results(results, include_time_in_key,
+                                 checkpoints=None):
+    if checkpoints:
+        # add what was found in each file to what previous runs found in it.
+        for path, _results in results:
+            counts = checkpoints.get_data(path) or {}
+            _merge_exception_counts(counts, _count_exceptions(
+                _results, include_time_in_key))
+            checkpoints.set_data(path, counts)
+
+        file_counts = checkpoints.get_all_data()
+        checkpoints.save()
+    else:
+        file_counts = [_count_exceptions(_results, include_time_in_key)
+                       for _, _results in results]
 
     agent_exceptions = {}
-    for path, _results in results:
-        for result in _results:
-            exc_tag = result.get(3)
-            if exc_tag not in agent_exceptions:
-                agent_exceptions[exc_tag] = {}
-
-            if include_time_in_key:
-                # use hours and minutes only
-                time = re.compile("([0-9]+:[0-9]+).+").search(result.get(2))[1]
-                key = "{}_{}".format(result.get(1), time)
-            else:
-                key = str(result.get(1))
-
-            if key not in agent_exceptions[exc_tag]:
-                agent_exceptions[exc_tag][key] = 0
-
-            agent_exceptions[exc_tag][key] += 1
+    for counts in file_counts:
+        _merge_exception_counts(agent_exceptions, counts)
 
     if not agent_exceptions:
         return
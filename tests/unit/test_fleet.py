@@ -0,0 +1,150 @@
+import os
+import tempfile
+
+import mock
+import utils
+
+from common import fleet
+
+
+def get_tree(nova_version="2:17.0.12", az="AZ1", errors=0):
+    tree = {"openstack": {"dpkg": ["nova-common {}".format(nova_version),
+                                   "neutron-common 2:12.1.0"],
+                          "features": {"neutron": {"neutron": {
+                              "availability_zone": az}}}},
+            "storage": {"ceph": {"versions": {"osd": ["14.2.11"]}}},
+            "juju": {"charm-versions": ["nova-compute-330"]}}
+    if errors:
+        tree["openstack"]["nova-agent-errors"] = {
+            "nova-compute": {"DBConnectionError": {"2021-03-08_17:12": errors,
+                                                   "2021-03-08_17:13": 1}}}
+
+    return tree
+
+
+class TestFleet(utils.BaseTestCase):
+
+    def test_get_versions(self):
+        self.assertEqual(fleet.get_versions("juju.charm-versions",
+                                            ["ceph-osd-310"]),
+                         [("ceph-osd", "310")])
+        self.assertEqual(fleet.get_versions("storage.ceph.versions",
+                                            {"mon": ["14.2.11", "15.2.1"]}),
+                         [("mon", "14.2.11"), ("mon", "15.2.1")])
+        self.assertEqual(fleet.get_versions("kubernetes.snaps",
+                                            {"kubelet": "1.20.4"}),
+                         [("kubelet", "1.20.4")])
+
+    def test_version_skew(self):
+        report = fleet.FleetReport()
+        for i in range(8):
+            report.add("host{}".format(i), get_tree())
+
+        report.add("host8", get_tree(nova_version="2:17.0.13"))
+        skew = report.get_report()["fleet"]["version-skew"]
+        self.assertEqual(list(skew), ["openstack.dpkg"])
+        self.assertEqual(skew["openstack.dpkg"],
+                         {"nova-common": {
+                             "2:17.0.12": {"hosts": 8,
+                                           "sample": ["host0", "host1",
+                                                      "host2", "host3",
+                                                      "host4"]},
+                             "2:17.0.13": {"hosts": 1,
+                                           "sample": ["host8"]}}})
+
+    def test_config_groups(self):
+        report = fleet.FleetReport()
+        for i in range(5):
+            report.add("host{}".format(i), get_tree(az="AZ{}".format(i % 2)))
+
+        groups = report.get_config_groups()
+        self.assertEqual([(g["hosts"], g["sample"]) for g in groups],
+                         [(3, ["host0", "host2", "host4"]),
+                          (2, ["host1", "host3"])])
+        self.assertEqual(groups[1]["config"],
+                         {"openstack.features": {"neutron": {"neutron": {
+                             "availability_zone": "AZ1"}}}})
+
+        # the order of keys doesn't matter.
+        tree = get_tree(az="AZ1")
+        tree["openstack"]["features"]["neutron"]["neutron"] = {
+            "debug": False, "availability_zone": "AZ1"}
+        report.add("host5", tree)
+        tree = get_tree(az="AZ1")
+        tree["openstack"]["features"]["neutron"]["neutron"]["debug"] = False
+        report.add("host6", tree)
+        self.assertEqual(report.get_config_groups()[2]["sample"],
+                         ["host5", "host6"])
+
+        with mock.patch.object(fleet, "MAX_CONFIG_GROUPS", 1):
+            report = fleet.FleetReport()
+            for i in range(5):
+                report.add("host{}".format(i),
+                           get_tree(az="AZ{}".format(i % 2)))
+
+            info = report.get_report()["fleet"]
+
+        self.assertEqual(len(info["config-groups"]), 1)
+        self.assertEqual(info["config-groups-untracked"], 2)
+
+    def test_error_outliers(self):
+        report = fleet.FleetReport()
+        for i in range(20):
+            report.add("host{}".format(i), get_tree(errors=i % 2))
+
+        report.add("bad", get_tree(errors=99))
+        report.add("nonova", {"storage": {}})
+        outliers = report.get_error_outliers()
+        metric = "openstack.nova-agent-errors.nova-compute.DBConnectionError"
+        self.assertEqual(list(outliers), [metric])
+        self.assertEqual(outliers[metric]["hosts"], {"bad": 100})
+        # only hosts with openstack results count towards the average.
+        self.assertEqual(outliers[metric]["avg"], round((10 * 2 + 100) / 21,
+                                                        3))
+
+    def test_aggregate(self):
+        with tempfile.TemporaryDirectory() as dtmp:
+            for name, tree in [("a", get_tree()),
+                               ("b", get_tree(nova_version="2:17.0.13"))]:
+                with open(os.path.join(dtmp, name + ".summary"), 'w') as fd:
+                    fd.write(fleet.helpers.HOTSOSYaml.dumps(tree))
+
+            with open(os.path.join(dtmp, fleet.BATCH_INDEX_NAME), 'w') as fd:
+                fd.write("sosreports:\n"
+                         "  - summary: a.summary\n    status: ok\n"
+                         "  - summary: b.summary\n    status: ok\n"
+                         "  - summary: c.summary\n    status: failed\n")
+
+            report = fleet.aggregate([dtmp])
+
+        self.assertEqual(report.hosts, 2)
+        skew = report.get_version_skew()["openstack.dpkg"]["nova-common"]
+        self.assertEqual({v: info["sample"] for v, info in skew.items()},
+                         {"2:17.0.12": ["a"], "2:17.0.13": ["b"]})
+
+    def test_write_batch_index(self):
+        with tempfile.TemporaryDirectory() as dtmp:
+            statuses = [["/sos reports/a: [1]", "a.summary", "ok", "0", "5",
+                         ""],
+                        ["/sos reports/b.tar.gz", "", "extraction-failed",
+                         "2", "0", "b.tar.gz.errors"]]
+            status_files = []
+            for idx, status in enumerate(statuses):
+                path = os.path.join(dtmp, str(idx))
+                with open(path, 'w') as fd:
+                    fd.write("".join(v + "\0" for v in status))
+
+                status_files.append(path)
+
+            index = os.path.join(dtmp, fleet.BATCH_INDEX_NAME)
+            fleet.write_batch_index(index, status_files)
+            with open(index) as fd:
+                self.assertEqual(fleet.yaml.safe_load(fd), {"sosreports": [
+                    {"path": "/sos reports/a: [1]", "summary": "a.summary",
+                     "status": "ok", "exit-code": 0, "duration": 5},
+                    {"path": "/sos reports/b.tar.gz",
+                     "status": "extraction-failed", "exit-code": 2,
+                     "duration": 0, "errors": "b.tar.gz.errors"}]})
+
+            self.assertEqual(list(fleet.get_summaries([dtmp])),
+                             [os.path.join(dtmp, "a.summary")])
@@ -1,4 +1,5 @@
 import os
+import tempfile
 
 import mock
 import utils
@@ -34,3 +35,112 @@ class TestHelpers(utils.BaseTestCase):
         ret = helpers.get_ps()
         self.assertEquals(ret, out)
         self.assertFalse(mock_subprocess.called)
+
+    def test_data_source(self):
+        calls = []
+
+        @helpers.data_source
+        def get_fake():
+            calls.append(1)
+            return ["line1\n"]
+
+        self.assertEqual(get_fake(), ["line1\n"])
+        # callers get a copy
+        get_fake().append("line2\n")
+        self.assertEqual(get_fake(), ["line1\n"])
+        self.assertEqual(len(calls), 1)
+        generation = helpers.DATA_SOURCES.generation
+        helpers.DATA_SOURCES.invalidate(get_fake)
+        self.assertEqual(helpers.DATA_SOURCES.generation, generation + 1)
+        self.assertEqual(get_fake(), ["line1\n"])
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(get_fake.__name__, "get_fake")
+        self.assertEqual(helpers.get_ps.__name__, "get_ps")
+
+    @mock.patch.object(helpers, 'subprocess')
+    def test_load_data_sources(self, mock_subprocess):
+        helpers.DATA_SOURCES.invalidate()
+        with mock.patch('builtins.open', wraps=open) as mock_open:
+            helpers.load_data_sources(["get_ps", "get_udevadm_info_dev",
+                                       "get_command_output", "get_foo"])
+            self.assertEqual(mock_open.call_count, 1)
+            helpers.get_ps()
+            self.assertEqual(mock_open.call_count, 1)
+
+    @mock.patch.object(helpers, 'subprocess')
+    def test_get_ps_cached(self, mock_subprocess):
+        helpers.DATA_SOURCES.invalidate()
+        with mock.patch('builtins.open', wraps=open) as mock_open:
+            helpers.get_ps()
+            helpers.get_ps()
+            self.assertEqual(mock_open.call_count, 1)
+
+    @mock.patch.object(helpers.subprocess, 'check_output')
+    def test_get_command_output(self, mock_check_output):
+        mock_check_output.return_value = b"line1\nline2\n"
+        with mock.patch.object(helpers, 'CMD_OUTPUT_CACHE', None):
+            helpers.get_command_output(['ps', 'auxwww'])
+            out = helpers.get_command_output(['ps', 'auxwww'])
+
+        self.assertEqual(out, ["line1\n", "line2\n"])
+        self.assertEqual(mock_check_output.call_count, 2)
+
+    @mock.patch.object(helpers.subprocess, 'check_output')
+    def test_get_command_output_cached(self, mock_check_output):
+        mock_check_output.return_value = b"line1\nline2\n"
+        with tempfile.TemporaryDirectory() as dtmp:
+            with mock.patch.object(helpers, 'CMD_OUTPUT_CACHE', dtmp):
+                helpers.get_command_output(['ps', 'auxwww'])
+                out = helpers.get_command_output(['ps', 'auxwww'])
+                self.assertEqual(out, ["line1\n", "line2\n"])
+                helpers.get_command_output(['ps', 'axo'])
+
+        self.assertEqual(mock_check_output.call_count, 2)
+
+    def test_plugin_results(self):
+        results = helpers.PluginResults()
+        self.assertFalse(results.has_plugin("openstack"))
+        results.add("openstack", {"instances": ["a"]})
+        results.add("openstack", {"dpkg": ["b"]})
+        self.assertTrue(results.has_plugin("openstack"))
+        self.assertEqual(results.get("openstack.instances"), ["a"])
+        self.assertEqual(results.get("openstack.network"), None)
+        self.assertEqual(results.dumps(),
+                         "openstack:\n  instances:\n    - a\n  dpkg:\n"
+                         "    - b")
+
+    def test_plugin_results_nested(self):
+        results = helpers.PluginResults()
+        results.add("openstack", {"network": {"namespaces": {"qrouter": 1}}})
+        results.add("openstack", {"network": {"config": {"nova": "a"}}})
+        self.assertEqual(results.get("openstack.network"),
+                         {"namespaces": {"qrouter": 1},
+                          "config": {"nova": "a"}})
+
+    def test_plugin_results_raw(self):
+        results = helpers.PluginResults()
+        results.add("system", {"hostname": "host1"})
+        boot = helpers.RawResults("kernel", "kernel:\n  boot: foo\n")
+        systemd = helpers.RawResults("kernel", "kernel:\n  systemd:\n")
+        results.merge([("kernel", boot), ("kernel", systemd)])
+        self.assertEqual(results.get("kernel.boot"), "foo")
+        self.assertEqual(results.dumps(), "system:\n  hostname: host1\n"
+                                          "kernel:\n  boot: foo\n  systemd:")
+
+    @mock.patch("builtins.print")
+    def test_plugin_results_echo(self, mock_print):
+        results = helpers.PluginResults(echo=True)
+        results.add("system", {"hostname": "host1"})
+        mock_print.assert_called_once_with("system:\n  hostname: host1")
+
+    def test_plugin_results_pending(self):
+        results = helpers.PluginResults()
+        results.add("system", {"hostname": "host1"})
+        pending = results.pop_pending()
+        self.assertEqual(pending, [("system", {"hostname": "host1"})])
+        self.assertEqual(results.pop_pending(), [])
+
+        other = helpers.PluginResults()
+        other.merge(pending)
+        self.assertEqual(other.get("system.hostname"), "host1")
+        self.assertEqual(other.pop_pending(), [])
@@ -0,0 +1,118 @@
+import mock
+import utils
+
+from common import (
+    helpers,
+    interfacetable,
+)
+
+IP_LINK = """1: lo: <LOOPBACK,UP,LOWER_UP> mtu 65536 qdisc noqueue state UNKNOWN mode DEFAULT group default qlen 1000
+    link/loopback 00:00:00:00:00:00 brd 00:00:00:00:00:00 promiscuity 0 minmtu 0 maxmtu 0
+    RX: bytes  packets  errors  dropped overrun mcast
+    1000       10       0       0       0       0
+    TX: bytes  packets  errors  dropped carrier collsns
+    1000       10       0       0       0       0
+2: ens3: <BROADCAST,MULTICAST,UP,LOWER_UP> mtu 1500 qdisc fq_codel state UP mode DEFAULT group default qlen 1000
+    link/ether 52:54:00:e2:28:a3 brd ff:ff:ff:ff:ff:ff promiscuity 0 minmtu 68 maxmtu 65535
+    RX: bytes  packets  errors  dropped overrun mcast
+    100000     1000     0       100     0       0
+    RX errors: length   crc     frame   fifo    missed
+               0        0       0       0       0
+    TX: bytes  packets  errors  dropped carrier collsns
+    100000     1000     {}      0       0       0
+3: ens3.100@ens3: <BROADCAST,MULTICAST,UP,LOWER_UP> mtu 1500 qdisc noqueue state UP mode DEFAULT group default qlen 1000
+    link/ether 52:54:00:e2:28:a3 brd ff:ff:ff:ff:ff:ff promiscuity 0 minmtu 0 maxmtu 65535
+    altname enp0s3.100
+    vlan protocol 802.1Q id 100 <REORDER_HDR> addrgenmode eui64
+    RX: bytes  packets  errors  dropped overrun mcast
+    0          0        0       0       0       0
+    TX: bytes  packets  errors  dropped carrier collsns
+    0          0        0       0       0       0
+""".splitlines(keepends=True)  # noqa: E501
+
+IP_ADDR = """1: lo: <LOOPBACK,UP,LOWER_UP> mtu 65536 qdisc noqueue state UNKNOWN group default qlen 1000
+    link/loopback 00:00:00:00:00:00 brd 00:00:00:00:00:00 promiscuity 0 minmtu 0 maxmtu 0
+    inet 127.0.0.1/8 scope host lo
+       valid_lft forever preferred_lft forever
+2: ens3: <BROADCAST,MULTICAST,UP,LOWER_UP> mtu 1500 qdisc fq_codel state UP group default qlen 1000
+    link/ether 52:54:00:e2:28:a3 brd ff:ff:ff:ff:ff:ff promiscuity 0 minmtu 68 maxmtu 65535
+    inet 10.78.2.55/24 brd 10.78.2.255 scope global ens3
+       valid_lft forever preferred_lft forever
+    inet6 fe80::5054:ff:fee2:28a3/64 scope link
+       valid_lft forever preferred_lft forever
+3: ens3.100@ens3: <BROADCAST,MULTICAST,UP,LOWER_UP> mtu 1500 qdisc noqueue state UP group default qlen 1000
+    link/ether 52:54:00:e2:28:a3 brd ff:ff:ff:ff:ff:ff promiscuity 0 minmtu 0 maxmtu 65535
+    vlan protocol 802.1Q id 100 <REORDER_HDR> addrgenmode eui64
+    inet 10.100.0.5/24 brd 10.100.0.255 scope global ens3.100
+       valid_lft forever preferred_lft forever
+""".splitlines(keepends=True)  # noqa: E501
+
+
+class TestInterfaceTable(utils.BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.table = interfacetable.InterfaceTable(IP_LINK, IP_ADDR)
+
+    def tearDown(self):
+        super().tearDown()
+
+    def test_parse(self):
+        self.assertEqual([iface.name for iface in self.table.interfaces],
+                         ["lo", "ens3", "ens3.100"])
+        iface = self.table.interfaces[1]
+        self.assertEqual(iface.index, 2)
+        self.assertEqual(iface.fields, {"mtu": "1500", "state": "UP"})
+        self.assertEqual(iface.link_type, "ether")
+        self.assertEqual(iface.mac, "52:54:00:e2:28:a3")
+        self.assertEqual(iface.addresses, ["10.78.2.55/24",
+                                           "fe80::5054:ff:fee2:28a3/64"])
+        self.assertEqual(iface.ipv4_addresses, ["10.78.2.55/24"])
+        # counters that are not numbers are ignored
+        self.assertEqual(iface.stats, {"RX": {"bytes": 100000,
+                                              "packets": 1000,
+                                              "errors": 0,
+                                              "dropped": 100,
+                                              "overrun": 0,
+                                              "mcast": 0}})
+        self.assertIsNone(iface.kind)
+        vlan = self.table.interfaces[2]
+        self.assertEqual(vlan.parent, "ens3")
+        # altnames come before the kind of interface.
+        self.assertEqual(vlan.kind, "vlan")
+        self.assertEqual(vlan.altnames, ["enp0s3.100"])
+        self.assertEqual(self.table.interfaces[0].link_type, "loopback")
+
+    def test_indexes(self):
+        vlan = self.table.find_by_name("ens3.100")
+        self.assertIs(self.table.find_by_name("ens3.100@ens3"), vlan)
+        self.assertIsNone(self.table.find_by_name("ens4"))
+        self.assertEqual([iface.name for iface in
+                          self.table.find_by_mac("52:54:00:e2:28:a3",
+                                                 "fe:54:00:e2:28:a3")],
+                         ["ens3", "ens3.100"])
+        self.assertEqual(self.table.find_by_mac("fe:54:00:e2:28:a3"), [])
+        self.assertIs(self.table.find_by_address("10.100.0.5"), vlan)
+        self.assertIsNone(self.table.find_by_address("10.100.0.50"))
+
+    def test_get_interface_table(self):
+        with mock.patch.object(helpers, "get_ip_link_show", lambda: IP_LINK):
+            with mock.patch.object(helpers, "get_ip_addr", lambda: IP_ADDR):
+                table = interfacetable.get_interface_table()
+                self.assertIs(interfacetable.get_interface_table(), table)
+
+            with mock.patch.object(helpers, "get_ip_addr", lambda: []):
+                table = interfacetable.get_interface_table()
+                self.assertIsNone(table.find_by_address("10.78.2.55"))
+
+    def test_get_interface_table_invalidated(self):
+        get_ip_addr = mock.MagicMock(return_value=IP_ADDR)
+        with mock.patch.object(helpers, "get_ip_link_show", lambda: IP_LINK), \
+                mock.patch.object(helpers, "get_ip_addr", get_ip_addr):
+            table = interfacetable.get_interface_table()
+            self.assertIs(interfacetable.get_interface_table(), table)
+            # the ip output is not read again to check the table
+            self.assertEqual(get_ip_addr.call_count, 1)
+            helpers.DATA_SOURCES.invalidate(helpers.get_ip_addr)
+            self.assertIsNot(interfacetable.get_interface_table(), table)
+            self.assertEqual(get_ip_addr.call_count, 2)
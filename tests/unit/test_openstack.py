@@ -9,6 +9,7 @@ from importlib.machinery import SourceFileLoader
 
 import utils
 
+from common import searchtools
 
 # need this for non-standard import
 specs = {}
@@ -65,6 +66,14 @@ with open(os.path.join(os.environ['DATA_ROOT'],
                        "sos_commands/networking/ip_-s_-d_link")) as fd:
     IP_LINK_SHOW = fd.readlines()
 
+NOVA_EXT_EVENTS_LOG = """2021-01-27 16:00:00 1 DEBUG nova.compute.manager [req-1] [instance: i1] Preparing to wait for external event network-vif-plugged-aaaa prepare_for_instance_event
+2021-01-27 16:00:02.500 1 DEBUG nova.compute.manager [req-2] [instance: i1] Received event network-vif-plugged-aaaa external_instance_event
+2021-01-27 16:00:03 1 DEBUG nova.compute.manager [req-2] [instance: i1] Processing event network-vif-plugged-aaaa _process_instance_event
+2021-01-27 16:01:00.000 1 DEBUG nova.compute.manager [req-3] [instance: i2] Plugging vifs. Preparing to wait for external event network-vif-plugged-bbbb prepare_for_instance_event
+2021-01-27 16:01:01.000 1 DEBUG nova.compute.manager [req-4] [instance: i2] Received event network-vif-plugged-bbbb external_instance_event
+[instance: i2] Processing event network-vif-plugged-bbbb _process_instance_event
+"""  # noqa: E501
+
 
 def fake_ip_link_show_w_errors_drops():
     lines = ''.join(IP_LINK_SHOW).format(10000000, 100000000)
@@ -151,12 +160,66 @@ class TestOpenstackPlugin03nova_external_events(utils.BaseTestCase):
     def test_get_events(self):
         data_root = ost_03nova_external_events.constants.DATA_ROOT
         data_source = os.path.join(data_root, "var/log/nova")
-        ost_03nova_external_events.get_events("network-vif-plugged",
-                                              data_source)
+        ret = ost_03nova_external_events.get_events("network-vif-plugged",
+                                                    data_source)
         events = {'network-vif-plugged':
                   {'succeeded': ['d2666e01-73c8-4a97-9c22-0c175659e6db'],
-                   'failed': ['5b367a10-9e6a-4eb9-9c7d-891dab7e87fa']}}
+                   'failed': ['5b367a10-9e6a-4eb9-9c7d-891dab7e87fa'],
+                   'stage-latencies':
+                   {'Preparing-Received': {'min': 3.78, 'max': 5.842,
+                                           'stdev': 1.031, 'avg': 4.811,
+                                           'samples': 2},
+                    'Received-Processing': {'min': 0.002, 'max': 0.004,
+                                            'stdev': 0.001, 'avg': 0.003,
+                                            'samples': 2}}}}
         self.assertEquals(ost_03nova_external_events.EXT_EVENT_INFO, events)
+        event = ret['network-vif-plugged-f6f5e6c5-2fdd-4719-9489-ca385d7fa7a7']
+        self.assertEqual(event, {'instance_id':
+                                 'd2666e01-73c8-4a97-9c22-0c175659e6db',
+                                 'result': 'succeeded',
+                                 'latencies': {'Preparing-Received': 3.78,
+                                               'Received-Processing': 0.002}})
+        event = ret['network-vif-plugged-9a3673bf-58ac-423a-869a-6c4ae801b57b']
+        self.assertEqual(event['result'], 'failed')
+        self.assertEqual(event['latencies'], {})
+
+    @mock.patch.object(ost_03nova_external_events, "EXT_EVENT_INFO", {})
+    def test_get_events_stage_latencies(self):
+        with tempfile.NamedTemporaryFile(mode='w') as ftmp:
+            ftmp.write(NOVA_EXT_EVENTS_LOG)
+            ftmp.flush()
+            ret = ost_03nova_external_events.get_events("network-vif-plugged",
+                                                        ftmp.name)
+
+        # no fractional seconds
+        self.assertEqual(ret['network-vif-plugged-aaaa']['latencies'],
+                         {'Preparing-Received': 2.5,
+                          'Received-Processing': 0.5})
+        self.assertEqual(ret['network-vif-plugged-aaaa']['result'],
+                         'succeeded')
+        # starter with text between the instance and the event, and a stage
+        # without a timestamp.
+        self.assertEqual(ret['network-vif-plugged-bbbb'],
+                         {'instance_id': 'i2', 'result': 'succeeded',
+                          'latencies': {'Preparing-Received': 1.0}})
+        stats = ost_03nova_external_events.EXT_EVENT_INFO[
+            'network-vif-plugged']['stage-latencies']
+        self.assertEqual(stats,
+                         {'Preparing-Received': {'min': 1.0, 'max': 2.5,
+                                                 'stdev': 0.75, 'avg': 1.75,
+                                                 'samples': 2},
+                          'Received-Processing': {'min': 0.5, 'max': 0.5,
+                                                  'stdev': 0.0, 'avg': 0.5,
+                                                  'samples': 1}})
+
+    def test_parse_timestamp(self):
+        parse_timestamp = ost_03nova_external_events.parse_timestamp
+        self.assertEqual(parse_timestamp("2021-01-27 16:11:59.018"),
+                         datetime.datetime(2021, 1, 27, 16, 11, 59, 18000))
+        self.assertEqual(parse_timestamp("2021-01-27 16:11:59"),
+                         datetime.datetime(2021, 1, 27, 16, 11, 59))
+        self.assertIsNone(parse_timestamp("2021-01-27 16:11"))
+        self.assertIsNone(parse_timestamp(None))
 
 
 class TestOpenstackPlugin04package_versions(utils.BaseTestCase):
@@ -280,6 +343,45 @@ class TestOpenstackPlugin09neutron_agent_errors(utils.BaseTestCase):
         self.assertEqual(ost_09neutron_agent_errors.NEUTRON_AGENT_ERROR_INFO,
                          expected)
 
+    def test_get_rpc_message_timeout_checkpoints(self):
+        expected = {'neutron-openvswitch-agent':
+                    {'MessagingTimeout': {'2021-03-04_16:19': 2},
+                     'AMQP server on 10.10.123.22:5672 is unreachable':
+                     {'2021-03-04_16:18': 1,
+                      '2021-03-04_16:19': 2}}}
+        bytes_read = []
+        with tempfile.TemporaryDirectory() as dtmp:
+            with mock.patch("common.constants.STATE_DIR", dtmp), \
+                    mock.patch("common.constants.PROFILE", True), \
+                    mock.patch.dict(searchtools.SEARCH_STATS, clear=True):
+                # the second run only uses counts saved by the first.
+                for _ in range(2):
+                    # search workers are forked with profiling enabled.
+                    searchtools.close_pool()
+                    searchtools.SEARCH_STATS.clear()
+                    with mock.patch.object(ost_09neutron_agent_errors,
+                                           "NEUTRON_AGENT_ERROR_INFO", {}):
+                        ost_09neutron_agent_errors.get_agents_exceptions()
+                        info = ost_09neutron_agent_errors.\
+                            NEUTRON_AGENT_ERROR_INFO
+                        self.assertEqual(info, expected)
+
+                    bytes_read.append(sum(
+                        stats["bytes-read"] for stats in
+                        searchtools.SEARCH_STATS.values()))
+
+                searchtools.close_pool()
+
+            # checkpoints of another data root are kept apart.
+            with mock.patch("common.constants.DATA_ROOT", dtmp):
+                checkpoints = searchtools.SearchCheckpoints(
+                    "neutron-openvswitch-agent-exceptions", [], dtmp)
+                self.assertNotIn(os.path.basename(checkpoints.path),
+                                 os.listdir(dtmp))
+
+        self.assertGreater(bytes_read[0], 0)
+        self.assertEqual(bytes_read[1], 0)
+
 
 class TestOpenstackPlugin10nova_agent_errors(utils.BaseTestCase):
 
@@ -0,0 +1,209 @@
+import os
+import tempfile
+
+import mock
+import yaml
+import utils
+
+from common import (
+    interfacetable,
+    plugin_runner,
+    processtable,
+)
+
+
+class TestPluginRunner(utils.BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+
+    def tearDown(self):
+        super().tearDown()
+
+    def test_get_plugin_parts(self):
+        parts = [os.path.basename(p)
+                 for p in plugin_runner.get_plugin_parts("juju")]
+        self.assertEqual(parts, ["01juju", "02charms", "03units"])
+
+    def test_get_plugin_parts_unknown(self):
+        self.assertEqual(plugin_runner.get_plugin_parts("noplugin"), [])
+
+    def test_is_python_part(self):
+        parts = plugin_runner.get_plugin_parts("kernel")
+        self.assertFalse(plugin_runner.is_python_part(parts[0]))
+        parts = plugin_runner.get_plugin_parts("system")
+        self.assertTrue(plugin_runner.is_python_part(parts[0]))
+
+    def test_run_python_part(self):
+        part = plugin_runner.get_plugin_parts("system")[0]
+        plugin_runner.helpers.PLUGIN_RESULTS.pop_pending()
+        output = plugin_runner.run_python_part(part)
+        self.assertEqual(output, "")
+        results = plugin_runner.helpers.PLUGIN_RESULTS.pop_pending()
+        self.assertEqual([r[0] for r in results], ["system"])
+
+    def test_get_part_declarations(self):
+        parts = plugin_runner.get_plugin_parts("openstack")
+        declarations = plugin_runner.get_part_declarations(parts[1])
+        self.assertEqual(declarations,
+                         {"PLUGIN_PRODUCES": ["openstack.instances"],
+                          "PLUGIN_CONSUMES": [],
+                          "PLUGIN_DATA_SOURCES": ["get_process_table"],
+                          "PLUGIN_SEARCHERS": {}})
+
+    def test_get_part_dependencies(self):
+        parts = plugin_runner.get_plugin_parts("openstack")
+        deps = plugin_runner.get_part_dependencies(parts)
+        names = [os.path.basename(p) for p in parts]
+        self.assertEqual(deps[names.index("05network")],
+                         set([names.index("02vm_info")]))
+        self.assertEqual(deps[names.index("01openstack")], set())
+
+    def test_get_part_searchers(self):
+        parts = {os.path.basename(p): p for p in
+                 plugin_runner.get_plugin_parts("openstack")}
+        self.assertFalse(plugin_runner.has_part_searchers(
+            parts["01openstack"]))
+        self.assertEqual(plugin_runner.get_part_searchers(
+            parts["01openstack"]), [])
+        self.assertTrue(plugin_runner.has_part_searchers(
+            parts["08neutron_openvswitch"]))
+        with mock.patch.object(plugin_runner.runpy, "run_path") as run_path:
+            searchers = plugin_runner.get_part_searchers(
+                parts["08neutron_openvswitch"])
+            # the part is not executed
+            self.assertFalse(run_path.called)
+
+        self.assertEqual(len(searchers), 1)
+        self.assertIsInstance(searchers[0],
+                              plugin_runner.searchtools.FileSearcher)
+        searchers = plugin_runner.get_part_searchers(
+            parts["09neutron_agent_errors"])
+        self.assertEqual(len(searchers), 4)
+
+    def test_run_plugins_planned(self):
+        forks = []
+        start = plugin_runner.multiprocessing.Process.start
+
+        def fake_start(proc):
+            # no part is forked while the search pool is running
+            forks.append(plugin_runner.searchtools._POOL)
+            start(proc)
+
+        plugin_runner.searchtools.close_pool()
+        with tempfile.NamedTemporaryFile() as ftmp:
+            with mock.patch.object(plugin_runner.constants, "MASTER_YAML_OUT",
+                                   ftmp.name), \
+                    mock.patch.object(plugin_runner.multiprocessing.Process,
+                                      "start", fake_start):
+                plugin_runner.run_plugins(["openstack"])
+
+        self.assertEqual(len(forks),
+                         len(plugin_runner.get_plugin_parts("openstack")))
+        self.assertEqual(forks, [None] * len(forks))
+
+    def test_get_part_data_sources(self):
+        parts = plugin_runner.get_plugin_parts("kubernetes")
+        self.assertEqual(plugin_runner.get_part_data_sources(parts),
+                         ["get_interface_table", "get_process_table"])
+        parts = plugin_runner.get_plugin_parts("system")
+        self.assertEqual(plugin_runner.get_part_data_sources(parts), [])
+
+    def test_share_state(self):
+        parts = plugin_runner.get_plugin_parts("kubernetes")
+        ps = ["root 1 0.0 0.0 100 100 ? Ss Feb17 0:01 /sbin/init\n"]
+        with mock.patch.object(processtable, "_PROCESS_TABLE", None), \
+                mock.patch.object(interfacetable, "_INTERFACE_TABLE", None), \
+                mock.patch.object(plugin_runner.helpers, "get_ps",
+                                  lambda: ps), \
+                mock.patch.object(plugin_runner.helpers,
+                                  "get_snap_list_all") as snaps:
+            plugin_runner.share_state(parts)
+            self.assertEqual(processtable._PROCESS_TABLE.ps, ps)
+            self.assertIsNotNone(interfacetable._INTERFACE_TABLE)
+            # only declared data sources are loaded
+            self.assertFalse(snaps.called)
+
+    def test_get_output_results(self):
+        output = "kernel:\n  boot: foo\n  systemd:\nother:\n  - a\n"
+        results = plugin_runner.get_output_results("01kernel", output)
+        self.assertEqual(results, [
+            ("kernel", plugin_runner.helpers.RawResults(
+                "kernel", "kernel:\n  boot: foo\n  systemd:")),
+            ("other", plugin_runner.helpers.RawResults("other",
+                                                       "other:\n  - a"))])
+        self.assertEqual(results[0][1].data, {"boot": "foo",
+                                              "systemd": None})
+
+    def test_get_output_results_invalid(self):
+        results = plugin_runner.get_output_results("01kernel", "a: b: c")
+        self.assertEqual(results, [])
+
+    def test_run_python_part_standalone(self):
+        part = plugin_runner.get_plugin_parts("system")[0]
+        with mock.patch.object(plugin_runner.helpers.PLUGIN_RESULTS, "echo",
+                               True):
+            output = plugin_runner.run_python_part(part)
+            self.assertTrue(plugin_runner.helpers.PLUGIN_RESULTS.echo)
+
+        self.assertEqual(output, "")
+        plugin_runner.helpers.PLUGIN_RESULTS.pop_pending()
+
+    def test_run_part(self):
+        part = plugin_runner.get_plugin_parts("system")[0]
+        results = plugin_runner.run_part(part)
+        self.assertEqual([r[0] for r in results], ["system"])
+
+    def test_run_plugins(self):
+        with tempfile.NamedTemporaryFile() as ftmp:
+            with mock.patch.object(plugin_runner.constants, "MASTER_YAML_OUT",
+                                   ftmp.name):
+                plugin_runner.run_plugins(["system", "storage"],
+                                          max_workers=2)
+
+            with open(ftmp.name) as fd:
+                keys = [line for line in fd if not line[0].isspace()]
+
+        self.assertEqual(keys, ["system:\n", "storage:\n"])
+
+    def test_run_plugins_max_workers(self):
+        wait = plugin_runner.multiprocessing.connection.wait
+        running = []
+
+        def fake_wait(readers):
+            running.append(len(readers))
+            return wait(readers)
+
+        with tempfile.NamedTemporaryFile() as ftmp:
+            with mock.patch.object(plugin_runner.constants, "MASTER_YAML_OUT",
+                                   ftmp.name), \
+                    mock.patch.object(plugin_runner.constants, "MAX_WORKERS",
+                                      1), \
+                    mock.patch.object(plugin_runner.multiprocessing.connection,
+                                      "wait", fake_wait):
+                plugin_runner.run_plugins(["system", "storage"])
+
+        self.assertTrue(running)
+        self.assertEqual(max(running), 1)
+
+    def test_run_plugins_profile(self):
+        with tempfile.NamedTemporaryFile() as ftmp, \
+                tempfile.TemporaryDirectory() as dtmp:
+            with mock.patch.object(plugin_runner.constants, "MASTER_YAML_OUT",
+                                   ftmp.name), \
+                    mock.patch.object(plugin_runner.constants, "PROFILE",
+                                      True), \
+                    mock.patch.object(plugin_runner.constants, "PROFILE_DIR",
+                                      dtmp):
+                plugin_runner.run_plugins(["system"])
+
+            with open(ftmp.name) as fd:
+                output = yaml.safe_load(fd)
+
+            self.assertEqual(os.listdir(dtmp), ["system.01system.pstats"])
+
+        self.assertEqual(list(output)[-1], "profile")
+        self.assertEqual(list(output["profile"]), ["system/01system"])
+        stats = output["profile"]["system/01system"]
+        self.assertEqual(sorted(stats), ["bytes-read", "cpu-time",
+                                         "peak-rss-kb", "wall-time"])
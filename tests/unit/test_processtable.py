@@ -0,0 +1,90 @@
+import mock
+import utils
+
+from common import (
+    helpers,
+    processtable,
+)
+
+PS = """USER  PID %CPU %MEM    VSZ   RSS TTY STAT START   TIME COMMAND
+nova  1285  0.6  2.6 294340 106260 ?   Ss   Feb17  11:14 /usr/bin/python3 /usr/bin/nova-compute --config-file=/etc/nova/nova.conf
+ceph 28718 12.4  0.7 6288484 3960044 ? Ssl  2020 42280:23 /usr/bin/ceph-osd -f --cluster ceph --id 63 --setuser ceph
+ceph 30119 11.0  0.7 6510576 4163504 ? Ssl  2020 37296:54 /usr/bin/ceph-osd -f --cluster ceph --id 81 --setuser ceph
+root  1364  0.0  2.0 826280 82196 ?    Sl   Feb17   0:38 /var/lib/juju/tools/unit-nova-compute-0/jujud unit --unit-name nova-compute/0
+mysql 2001  0.1  1.0 100000 20000 ?    Sl   Feb17   1:00 /usr/sbin/mysqld
+nova  1300  0.1  1.0 100000 20000 ?    Ss   Feb17   1:00 /usr/bin/python3 /usr/bin/nova-api-metadata --config-dir /etc/nova
+""".splitlines(keepends=True)  # noqa: E501
+
+PS_AXO_FLAGS = """F S UID PID PPID PGID SID CLS PRI ADDR SZ WCHAN STARTED TT TIME CMD
+4 S 64045 28718 1 28718 28718 TS 19 - 1572121 - Thu Feb 18 10:00:00 2021 ? 11:44:23 /usr/bin/ceph-osd -f --cluster ceph --id 63
+""".splitlines(keepends=True)  # noqa: E501
+
+
+class TestProcessTable(utils.BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.table = processtable.ProcessTable(PS)
+
+    def tearDown(self):
+        super().tearDown()
+
+    def test_parse(self):
+        self.assertEqual(len(self.table.processes), 6)
+        process = self.table.processes[0]
+        self.assertEqual(process.pid, 1285)
+        self.assertEqual(process.rss, 106260)
+        self.assertEqual(process.exe, "python3")
+        self.assertEqual(process.names, ["python3", "nova-compute",
+                                         "nova.conf"])
+        self.assertEqual(process.get_arg("--config-file"),
+                         "/etc/nova/nova.conf")
+        self.assertIsNone(process.get_arg("--log-file"))
+
+    def test_indexes(self):
+        self.assertEqual([p.pid for p in self.table.find_by_exe("ceph-osd")],
+                         [28718, 30119])
+        self.assertEqual([p.pid for p in
+                          self.table.find_by_name("nova-compute")], [1285])
+        self.assertEqual([p.pid for p in self.table.find_by_arg("--id", 81)],
+                         [30119])
+        self.assertEqual(self.table.get_arg_values("unit"),
+                         ["nova-compute-0"])
+        self.assertEqual(self.table.find_by_exe("nova-compute"), [])
+
+    def test_get_service_counts(self):
+        counts = self.table.get_service_counts([r"nova[0-9a-zA-Z-_]*",
+                                                r"ceph-[A-Za-z]+",
+                                                r"mysqld"])
+        # nova-api-metadata is not also counted as nova.
+        self.assertEqual(list(counts.items()), [("nova-compute", 1),
+                                                ("ceph-osd", 2),
+                                                ("mysqld", 1),
+                                                ("nova-api-metadata", 1)])
+
+    @mock.patch.object(helpers, "get_ps_axo_flags", lambda: PS_AXO_FLAGS)
+    def test_get_lstart(self):
+        osds = self.table.find_by_exe("ceph-osd")
+        self.assertEqual(self.table.get_lstart(osds[0]),
+                         "Feb 18 10:00:00 2021")
+        self.assertIsNone(self.table.get_lstart(osds[1]))
+
+    def test_get_process_table(self):
+        with mock.patch.object(helpers, "get_ps", lambda: PS):
+            table = processtable.get_process_table()
+            self.assertIs(processtable.get_process_table(), table)
+
+        with mock.patch.object(helpers, "get_ps", lambda: PS[:2]):
+            self.assertEqual(len(processtable.get_process_table().processes),
+                             1)
+
+    def test_get_process_table_invalidated(self):
+        get_ps = mock.MagicMock(return_value=PS)
+        with mock.patch.object(helpers, "get_ps", get_ps):
+            table = processtable.get_process_table()
+            self.assertIs(processtable.get_process_table(), table)
+            # the ps output is not read again to check the table
+            self.assertEqual(get_ps.call_count, 1)
+            helpers.DATA_SOURCES.invalidate(helpers.get_ps)
+            self.assertIsNot(processtable.get_process_table(), table)
+            self.assertEqual(get_ps.call_count, 2)
@@ -1,7 +1,18 @@
+import bz2
+import gzip
+import io
+import lzma
 import os
+import re
+import tempfile
+
+import mock
 import utils
 
-from common import searchtools
+from common import (
+    logtools,
+    searchtools,
+)
 
 
 class TestSearchTools(utils.BaseTestCase):
@@ -104,3 +115,496 @@ class TestSearchTools(utils.BaseTestCase):
             ln = result.linenumber
             self.assertEquals(result.tag, None)
             self.assertEquals(result.get(1), expected[ln])
+
+    def test_combined_matcher(self):
+        terms = [{"key": re.compile(r"^(\S+) foo (\S+)"), "indices": [1, 2]},
+                 {"key": re.compile(r"^(\S+) bar"), "indices": [1]},
+                 {"key": re.compile(r".+ (foo) .+"), "indices": [1]},
+                 {"key": re.compile(r"^(\S+) (\1)"), "indices": [1, 2]}]
+        matcher = searchtools.CombinedMatcher(terms)
+        self.assertEqual(matcher.match("a b c"), [])
+
+        matches = matcher.match("x foo y\n")
+        self.assertEqual([m[0] for m in matches], [0, 2])
+        self.assertEqual(matches[0][1][2], "y")
+        self.assertEqual(matches[1][1][1], "foo")
+
+        matches = matcher.match("x x bar")
+        self.assertEqual([m[0] for m in matches], [3])
+        self.assertEqual(matches[0][1][2], "x")
+
+    def test_combined_matcher_equivalence(self):
+        path = os.path.join(os.environ["DATA_ROOT"], "var/log/neutron",
+                            "neutron-openvswitch-agent.log")
+        terms = [{"key": re.compile(expr), "indices": []}
+                 for expr in [r'^(\S+\s+[0-9:\.]+)\s+.+full sync.+',
+                              r'^(\S+\s+[0-9:\.]+)\s+.+ERROR.+',
+                              r'^(\S+\s+[0-9:\.]+)\s+.+INFO.+',
+                              r'.+(rpc_loop).+']]
+        matcher = searchtools.CombinedMatcher(terms)
+        with open(path) as fd:
+            for line in fd:
+                expected = [idx for idx, term in enumerate(terms)
+                            if term["key"].match(line)]
+                self.assertEqual([m[0] for m in matcher.match(line)],
+                                 expected)
+
+    def test_get_required_literal(self):
+        expected = {r'^([0-9\-]+) (\S+) .+(AMQP server on .+ is '
+                    r'unreachable).+': 'AMQP server on ',
+                    r'^(\S+\s+[0-9:\.]+)\s+.+full sync.+': 'full sync',
+                    r'(?i)full sync': None,
+                    r'full|sync': None,
+                    r'(?:full sync)?.+': None,
+                    r'^(\S+) (\S+) .+': None}
+        for key, literal in expected.items():
+            self.assertEqual(searchtools.get_required_literal(key), literal)
+
+    def test_combined_matcher_literals(self):
+        path = os.path.join(os.environ["DATA_ROOT"], "var/log/neutron",
+                            "neutron-openvswitch-agent.log")
+        terms = []
+        for expr in [r'^(\S+\s+[0-9:\.]+)\s+.+full sync.+',
+                     r'^(\S+\s+[0-9:\.]+)\s+.+ERROR.+',
+                     r'^(\S+\s+[0-9:\.]+)\s+.+INFO.+']:
+            terms.append({"key": re.compile(expr), "indices": [],
+                          "literal": searchtools.get_required_literal(expr)})
+
+        matcher = searchtools.CombinedMatcher(terms)
+        with open(path) as fd:
+            for line in fd:
+                expected = [idx for idx, term in enumerate(terms)
+                            if term["key"].match(line)]
+                self.assertEqual([m[0] for m in matcher.match(line)],
+                                 expected)
+
+    def test_filesearcher_hint(self):
+        filepath = os.path.join(os.environ["DATA_ROOT"], 'sos_commands',
+                                'networking', 'ip_-d_address')
+        s = searchtools.FileSearcher()
+        # a hint that is never found means nothing can match
+        s.add_search_term(r".+(10.10.101.33).+", [1], filepath,
+                          hint="not-an-address")
+        results = s.search()
+        self.assertEqual(results.find_by_path(filepath), [])
+
+        s = searchtools.FileSearcher()
+        s.add_search_term(r".+(10.10.101.33).+", [1], filepath,
+                          hint="10.10.101.33")
+        results = s.search()
+        self.assertEqual(len(results.find_by_path(filepath)), 1)
+
+    def test_get_file_chunks(self):
+        filepath = os.path.join(os.environ["DATA_ROOT"], 'var/log/neutron',
+                                'neutron-openvswitch-agent.log')
+        size = os.path.getsize(filepath)
+        self.assertEqual(searchtools.get_file_chunks(filepath), [(0, size)])
+        with mock.patch.object(searchtools, "CHUNK_SIZE", 4096):
+            chunks = searchtools.get_file_chunks(filepath)
+
+        self.assertTrue(len(chunks) > 1)
+        self.assertEqual(chunks[0][0], 0)
+        self.assertEqual(chunks[-1][1], size)
+        with open(filepath, 'rb') as fd:
+            for start, end in chunks[1:]:
+                fd.seek(start - 1)
+                self.assertEqual(fd.read(1), b"\n")
+
+    def test_filesearcher_chunked(self):
+        filepath = os.path.join(os.environ["DATA_ROOT"], 'var/log/neutron',
+                                'neutron-openvswitch-agent.log')
+        s = searchtools.FileSearcher()
+        s.add_search_term(r"^(\S+ \S+) .+ Agent rpc_loop - iteration:(\d+) "
+                          "started.*", [1, 2], filepath, tag="start")
+        s.add_search_term(r"^(\S+ \S+) .+ Agent rpc_loop - iteration:(\d+) "
+                          "completed.*", [1, 2], filepath, tag="end")
+        expected = [(r.linenumber, r.tag, r.get(1), r.get(2))
+                    for r in s.search().find_by_path(filepath)]
+        self.assertTrue(expected)
+        with mock.patch.object(searchtools, "CHUNK_SIZE", 4096):
+            results = s.search().find_by_path(filepath)
+
+        self.assertEqual([(r.linenumber, r.tag, r.get(1), r.get(2))
+                          for r in results], expected)
+
+    def test_get_pool(self):
+        pool = searchtools.get_pool()
+        self.assertIs(searchtools.get_pool(), pool)
+        with mock.patch.object(searchtools, "_POOL_PID", -1):
+            new_pool = searchtools.get_pool()
+
+        self.assertIsNot(new_pool, pool)
+        pool.terminate()
+
+    def test_search_batch(self):
+        logs_root = os.path.join(os.environ["DATA_ROOT"], "var/log/neutron")
+        searchers = []
+        for agent in ["neutron-openvswitch-agent", "neutron-l3-agent"]:
+            s = searchtools.FileSearcher()
+            s.add_search_term(r"^(\S+ \S+) .+ (\S+Error|\S+Timeout).+", [1, 2],
+                              os.path.join(logs_root, agent + ".log"))
+            searchers.append(s)
+
+        expected = []
+        for s in searchers:
+            expected.append({path: [(r.linenumber, r.get(1), r.get(2))
+                                    for r in results]
+                             for path, results in s.search()})
+
+        batch = searchtools.search_batch(searchers)
+        self.assertEqual(len(batch), len(searchers))
+        for results, _expected in zip(batch, expected):
+            self.assertEqual({path: [(r.linenumber, r.get(1), r.get(2))
+                                     for r in _results]
+                              for path, _results in results}, _expected)
+
+    def test_search_batch_fused(self):
+        path = os.path.join(os.environ["DATA_ROOT"],
+                            "var/log/neutron/neutron-openvswitch-agent.log")
+        searchers = []
+        for expr, tag in [(r"^(\S+ \S+) .+ Agent rpc_loop - iteration:(\d+) "
+                           "started.*", "start"),
+                          (r"^(\S+ \S+) .+ Agent rpc_loop - iteration:(\d+) "
+                           "completed.*", None)]:
+            s = searchtools.FileSearcher()
+            s.add_search_term(expr, [1, 2], path, tag=tag)
+            searchers.append(s)
+
+        expected = [[(r.linenumber, r.tag, r.get(2))
+                     for r in s.search().find_by_path(path)]
+                    for s in searchers]
+        self.assertTrue(all(expected))
+        tasks, _ = searchtools.fuse_tasks(searchers)
+        self.assertEqual(len(tasks), 1)
+        batch = searchtools.search_batch(searchers)
+        self.assertEqual([[(r.linenumber, r.tag, r.get(2))
+                           for r in results.find_by_path(path)]
+                          for results in batch], expected)
+
+    @mock.patch.dict(searchtools._PLANNED)
+    def test_plan_searches(self):
+        path = os.path.join(os.environ["DATA_ROOT"],
+                            "var/log/neutron/neutron-openvswitch-agent.log")
+
+        def get_searcher(expr):
+            s = searchtools.FileSearcher()
+            s.add_search_term(expr, [1], path)
+            return s
+
+        start = r".+ Agent rpc_loop - iteration:(\d+) started.*"
+        end = r".+ Agent rpc_loop - iteration:(\d+) completed.*"
+        expected = [[r.get(1) for r in get_searcher(expr).search().
+                     find_by_path(path)] for expr in [start, end]]
+        searchtools.plan_searches([get_searcher(start), get_searcher(end)])
+        searchtools.wait_planned()
+        pool = mock.MagicMock()
+        with mock.patch.object(searchtools, "get_pool", lambda: pool):
+            actual = [[r.get(1) for r in get_searcher(expr).search().
+                       find_by_path(path)] for expr in [end, start]]
+            self.assertFalse(pool.apply_async.called)
+            # each planned search is only used once
+            get_searcher(end).search()
+            self.assertTrue(pool.apply_async.called)
+
+        self.assertEqual(actual, expected[::-1])
+
+    def test_search_result(self):
+        r = searchtools.SearchResult(1, "afile", "atag", (1, 3), ("a", "c"))
+        r.add(2, "b")
+        self.assertEqual([r.get(i) for i in range(5)],
+                         [None, "a", "b", "c", None])
+        self.assertFalse(hasattr(r, "__dict__"))
+
+    def test_search_iter(self):
+        logs_root = os.path.join(os.environ["DATA_ROOT"], "var/log/neutron")
+        s = searchtools.FileSearcher()
+        s.add_search_term(r"^(\S+ \S+) .+ Agent rpc_loop - iteration:(\d+) "
+                          "started.*", [1, 2], os.path.join(logs_root, "*"))
+        expected = []
+        for path, results in s.search():
+            for r in results:
+                expected.append((path, r.linenumber, r.get(1), r.get(2)))
+
+        self.assertTrue(expected)
+        actual = [(path, r.linenumber, r.get(1), r.get(2))
+                  for path, r in s.search_iter()]
+        self.assertEqual(actual, expected)
+        with mock.patch.object(searchtools, "CHUNK_SIZE", 4096):
+            actual = [(path, r.linenumber, r.get(1), r.get(2))
+                      for path, r in s.search_iter(max_pending=1)]
+
+        self.assertEqual(actual, expected)
+
+    def test_search_profile(self):
+        path = os.path.join(os.environ["DATA_ROOT"],
+                            "var/log/neutron/neutron-openvswitch-agent.log")
+        with open(path) as fd:
+            num_lines = len(fd.readlines())
+
+        for use_mmap, chunk_size in [(True, searchtools.CHUNK_SIZE),
+                                     (False, searchtools.CHUNK_SIZE),
+                                     (False, 4096)]:
+            s = searchtools.FileSearcher()
+            s.add_search_term(r"^(\S+ \S+) .+ Agent rpc_loop - iteration:"
+                              r"(\d+) started.*", [1, 2], path, tag="start")
+            s.add_search_term(r".+ NoSuchTerm (\d+)", [1], path)
+            searchtools.SEARCH_STATS.clear()
+            with mock.patch.object(searchtools.constants, "PROFILE", True), \
+                    mock.patch.object(searchtools, "USE_MMAP", use_mmap), \
+                    mock.patch.object(searchtools, "CHUNK_SIZE", chunk_size):
+                results = s.search().find_by_path(path)
+
+            stats = searchtools.SEARCH_STATS[path]
+            self.assertEqual(stats["lines"], num_lines)
+            self.assertEqual(stats["terms"],
+                             {"start": len(results),
+                              r".+ NoSuchTerm (\d+)": 0})
+            self.assertEqual(stats["bytes-decompressed"], 0)
+
+        searchtools.SEARCH_STATS.clear()
+
+    def test_search_results_collection(self):
+        results = searchtools.SearchResultsCollection()
+        results.add("f1", [searchtools.SearchResult(1, "f1", "T1"),
+                           searchtools.SearchResult(2, "f1", "T2")])
+        results.add("f2", [searchtools.SearchResult(1, "f2", "T1")])
+        results.add("f1", [searchtools.SearchResult(3, "f1", "T1")])
+        self.assertEqual(results.files, ["f1", "f2"])
+        self.assertEqual(results.tags, ["T1", "T2"])
+        self.assertEqual([r.linenumber for r in results.find_by_path("f1")],
+                         [1, 2, 3])
+        self.assertEqual([(r.source, r.linenumber)
+                          for r in results.find_by_tag("T1")],
+                         [("f1", 1), ("f2", 1), ("f1", 3)])
+        self.assertEqual([r.linenumber
+                          for r in results.find_by_tag("T1", path="f1")],
+                         [1, 3])
+        self.assertEqual(results.find_by_tag("T3"), [])
+        self.assertEqual(len(results.find_by_source("f2")), 1)
+        self.assertEqual({tag: len(r) for tag, r in results.group_by_tag()},
+                         {"T1": 3, "T2": 1})
+        self.assertEqual({tag: len(r)
+                          for tag, r in results.group_by_tag(path="f2")},
+                         {"T1": 1})
+
+    def test_open_log(self):
+        content = b"line 1\nline \xff 2\nline 3\n"
+        compressors = {"plain": lambda data: data,
+                       "gzip": gzip.compress,
+                       "xz": lzma.compress,
+                       "bz2": bz2.compress}
+        if logtools.zstandard:
+            compressors["zstd"] = \
+                logtools.zstandard.ZstdCompressor().compress
+
+        with tempfile.TemporaryDirectory() as dtmp:
+            for name, compress in compressors.items():
+                path = os.path.join(dtmp, name)
+                with open(path, 'wb') as fd:
+                    fd.write(compress(content))
+
+                with open(path, 'rb') as fd:
+                    compression = logtools.get_compression(fd)
+                    self.assertEqual(fd.tell(), 0)
+
+                if name == "plain":
+                    self.assertIsNone(compression)
+                else:
+                    self.assertEqual(compression, name)
+
+                with logtools.open_log(path) as fd:
+                    lines = list(fd)
+
+                self.assertEqual(lines, ["line 1\n", "line \udcff 2\n",
+                                         "line 3\n"])
+                s = searchtools.FileSearcher()
+                s.add_search_term(r"^line (\d+)", [1], path)
+                self.assertEqual([r.get(1) for r in
+                                  s.search().find_by_path(path)], ["1", "3"])
+
+    def test_zstd_unavailable(self):
+        path = os.path.join(os.environ["DATA_ROOT"], "var/log/neutron",
+                            "neutron-openvswitch-agent.log")
+        with tempfile.TemporaryDirectory() as dtmp:
+            zst = os.path.join(dtmp, "agent.log.zst")
+            with open(zst, 'wb') as fd:
+                fd.write(logtools.COMPRESSION_MAGIC["zstd"] + b"\0" * 16)
+
+            with mock.patch.object(logtools, "zstandard", None), \
+                    mock.patch.object(logtools, "_UNREADABLE", set()), \
+                    mock.patch("sys.stderr", new_callable=io.StringIO) as err:
+                self.assertTrue(logtools.is_readable(None, path))
+                self.assertTrue(logtools.is_readable("gzip", path))
+                self.assertFalse(logtools.is_readable("zstd", zst))
+                self.assertFalse(logtools.is_readable("zstd", zst))
+                # warned once
+                self.assertEqual(err.getvalue().count(zst), 1)
+                s = searchtools.FileSearcher()
+                s.add_search_term(r".+", [0], zst)
+                s.add_search_term(r"^(\S+ \S+) .+ Agent rpc_loop", [1], path)
+                results = s.search()
+                self.assertEqual(results.find_by_path(zst), [])
+                self.assertTrue(results.find_by_path(path))
+
+    def test_search_mmap(self):
+        logs_root = os.path.join(os.environ["DATA_ROOT"], "var/log/neutron")
+        with tempfile.TemporaryDirectory() as dtmp:
+            path = os.path.join(dtmp, "nonewline.log")
+            with open(path, 'wb') as fd:
+                fd.write(b"a started \xff\n\nb completed\nc started")
+
+            s = searchtools.FileSearcher()
+            s.add_search_term(r"^(\S+ \S+) .+ Agent rpc_loop - iteration:"
+                              r"(\d+) started.*", [1, 2],
+                              os.path.join(logs_root, "*"))
+            s.add_search_term(r"^(\S+) (started)", [1, 2],
+                              os.path.join(dtmp, "*"))
+            s.add_search_term(r"^(\S+) (completed)", [1, 2],
+                              os.path.join(dtmp, "*"))
+
+            def get_results(**kwargs):
+                return [(path, r.linenumber, r.get(1), r.get(2))
+                        for path, r in s.search_iter(**kwargs)]
+
+            with mock.patch.object(searchtools, "USE_MMAP", False):
+                expected = get_results()
+
+            self.assertIn((path, 4, "c", "started"), expected)
+            self.assertEqual(get_results(), expected)
+            with mock.patch.object(searchtools, "CHUNK_SIZE", 4096):
+                self.assertEqual(get_results(max_pending=1), expected)
+
+            with open(path, 'rb') as fd:
+                self.assertEqual(searchtools._search_mmap(
+                    s.paths[os.path.join(dtmp, "*")], fd, path)[1], 4)
+
+    def test_get_rotation(self):
+        self.assertEqual(searchtools.get_rotation("/a/b.log"), ("/a/b.log", 0))
+        self.assertEqual(searchtools.get_rotation("/a/b.log.1"),
+                         ("/a/b.log", 1))
+        self.assertEqual(searchtools.get_rotation("/a/b.log.12.gz"),
+                         ("/a/b.log", 12))
+        files = ["/a/b.log", "/a/b.log.1", "/a/b.log.3.gz", "/a/c.log.2"]
+        self.assertEqual(searchtools.get_newer_rotation("/a/b.log.3.gz",
+                                                        files), "/a/b.log.1")
+        self.assertEqual(searchtools.get_newer_rotation("/a/b.log.1", files),
+                         "/a/b.log")
+        self.assertIsNone(searchtools.get_newer_rotation("/a/b.log", files))
+        self.assertIsNone(searchtools.get_newer_rotation("/a/c.log.2",
+                                                         files))
+
+    def test_filesearcher_window(self):
+        filepath = os.path.join(os.environ["DATA_ROOT"], 'var/log/neutron',
+                                'neutron-openvswitch-agent.log.1')
+        since = "2021-03-04 09:50:00"
+        until = "2021-03-04 11:34:59"
+        s = searchtools.FileSearcher()
+        s.add_search_term(r"^(\S+ \S+) .+", [1], filepath)
+        results = s.search().find_by_path(filepath)
+        expected = [(r.linenumber, r.get(1)) for r in results
+                    if since <= r.get(1)[:19] <= until]
+        self.assertTrue(0 < len(expected) < len(results))
+
+        with tempfile.TemporaryDirectory() as dtmp:
+            gzpath = os.path.join(dtmp, "agent.log.1.gz")
+            with open(filepath, 'rb') as fd:
+                with gzip.open(gzpath, 'wb') as gzfd:
+                    gzfd.write(fd.read())
+
+            for path in [filepath, gzpath]:
+                s = searchtools.FileSearcher(since=since, until=until)
+                s.add_search_term(r"^(\S+ \S+) .+", [1], path)
+                results = s.search().find_by_path(path)
+                self.assertEqual([(r.linenumber, r.get(1)) for r in results],
+                                 expected)
+
+            with mock.patch.object(searchtools, "CHUNK_SIZE", 1024):
+                s = searchtools.FileSearcher(since=since, until=until)
+                s.add_search_term(r"^(\S+ \S+) .+", [1], filepath)
+                results = s.search().find_by_path(filepath)
+                self.assertEqual([(r.linenumber, r.get(1)) for r in results],
+                                 expected)
+
+    def test_filesearcher_window_rotated(self):
+        with tempfile.TemporaryDirectory() as dtmp:
+            for name, day in [("a.log", "05"), ("a.log.1", "03"),
+                              ("a.log.2", "01")]:
+                with open(os.path.join(dtmp, name), 'w') as fd:
+                    for hour in range(10, 20):
+                        fd.write("2021-03-{} {}:00:00.000 1 ERROR foo\n".
+                                 format(day, hour))
+
+            s = searchtools.FileSearcher(since="2021-03-04 00:00:00")
+            s.add_search_term(r"^(\S+ \S+) .+ (ERROR) .+", [1, 2],
+                              os.path.join(dtmp, "a.log*"))
+            results = s.search()
+            # a.log.1 may have entries up until a.log starts
+            self.assertEqual(sorted([os.path.basename(f)
+                                     for f in results.files]),
+                             ["a.log", "a.log.1"])
+            self.assertEqual(len(results.find_by_path(
+                os.path.join(dtmp, "a.log.1"))), 0)
+            self.assertEqual(len(results.find_by_path(
+                os.path.join(dtmp, "a.log"))), 10)
+
+            s = searchtools.FileSearcher(until="2021-03-02 00:00:00")
+            s.add_search_term(r"^(\S+ \S+) .+ (ERROR) .+", [1, 2],
+                              os.path.join(dtmp, "a.log*"))
+            results = s.search()
+            self.assertEqual([os.path.basename(f) for f in results.files],
+                             ["a.log.2"])
+
+        with self.assertRaises(ValueError):
+            searchtools.FileSearcher(since="yesterday")
+
+    def test_filesearcher_checkpoints(self):
+        with tempfile.TemporaryDirectory() as dtmp:
+            state_dir = os.path.join(dtmp, "state")
+            logpath = os.path.join(dtmp, "a.log")
+
+            def search():
+                checkpoints = searchtools.SearchCheckpoints("a", ["ERROR"],
+                                                            state_dir)
+                s = searchtools.FileSearcher(checkpoints=checkpoints)
+                s.add_search_term(r"^(\S+) ERROR", [1],
+                                  os.path.join(dtmp, "a.log*"))
+                results = s.search()
+                for path, _results in results:
+                    data = checkpoints.get_data(path) or 0
+                    checkpoints.set_data(path, data + len(_results))
+
+                checkpoints.save()
+                return ({os.path.basename(path): [(r.linenumber, r.get(1))
+                                                  for r in _results]
+                         for path, _results in results},
+                        sorted(checkpoints.get_all_data()))
+
+            with open(logpath, 'w') as fd:
+                fd.write("1 ERROR\n2 INFO\n3 ERROR\n4 ERR")
+
+            self.assertEqual(search(), ({"a.log": [(1, "1"), (3, "3")]},
+                                        [2]))
+            # nothing changed so nothing searched
+            self.assertEqual(search(), ({}, [2]))
+            with open(logpath, 'a') as fd:
+                fd.write("OR\n5 ERROR\n")
+
+            self.assertEqual(search(), ({"a.log": [(4, "4"), (5, "5")]},
+                                        [4]))
+            # rotate
+            os.rename(logpath, logpath + ".1")
+            with open(logpath + ".1", 'a') as fd:
+                fd.write("6 ERROR\n")
+
+            with open(logpath, 'w') as fd:
+                fd.write("1 ERROR\n")
+
+            self.assertEqual(search(), ({"a.log": [(1, "1")],
+                                         "a.log.1": [(6, "6")]},
+                                        [1, 5]))
+            os.remove(logpath + ".1")
+            self.assertEqual(search(), ({}, [1]))
+            # checkpoints saved with a different signature are discarded
+            checkpoints = searchtools.SearchCheckpoints("a", ["INFO"],
+                                                        state_dir)
+            self.assertIsNone(checkpoints.get(logpath))
@@ -0,0 +1,137 @@
+import io
+import os
+import tarfile
+import tempfile
+
+import mock
+import utils
+
+from common import (
+    searchtools,
+    sosarchive,
+    sosindex,
+)
+
+LOG = "".join("2021-03-04 10:00:{:02d}.000 1 INFO agent line {}\n".format(
+              i % 60, i) for i in range(100))
+
+
+class TestSOSArchive(utils.BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        src = os.path.join(self.tmpdir.name, "src", "sosreport-test")
+        os.makedirs(os.path.join(src, "var/log/nova"))
+        os.makedirs(os.path.join(src, "etc"))
+        with open(os.path.join(src, "var/log/nova/nova-compute.log"),
+                  'w') as fd:
+            fd.write(LOG)
+
+        with open(os.path.join(src, "etc/hostname"), 'w') as fd:
+            fd.write("compute1\n")
+
+        self.archive = os.path.join(self.tmpdir.name, "sosreport-test.tar.gz")
+        with tarfile.open(self.archive, 'w:gz') as tar:
+            tar.add(src, arcname="sosreport-test")
+
+        self.extract_dir = os.path.join(self.tmpdir.name, "extracted")
+        os.makedirs(self.extract_dir)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+        super().tearDown()
+
+    def test_is_archive(self):
+        self.assertTrue(sosarchive.is_archive(self.archive))
+        self.assertFalse(sosarchive.is_archive(self.extract_dir))
+
+    def test_unpack_and_extract(self):
+        with mock.patch.object(sosarchive, "DEFER_SIZE", 1024):
+            data_root = sosarchive.SOSArchive(self.archive,
+                                              self.extract_dir).unpack()
+
+        self.assertEqual(data_root,
+                         os.path.join(self.extract_dir, "sosreport-test"))
+        log = os.path.join(data_root, "var/log/nova/nova-compute.log")
+        # small files are extracted, large logs are deferred.
+        with open(os.path.join(data_root, "etc/hostname")) as fd:
+            self.assertEqual(fd.read(), "compute1\n")
+
+        self.assertEqual(os.path.getsize(log), 0)
+
+        archive = sosarchive.SOSArchive("", self.extract_dir)
+        self.assertTrue(archive.load())
+        self.assertEqual(archive.get_member_stat(log)[0], len(LOG))
+        index = sosindex.SOSIndex(data_root, os.path.join(self.tmpdir.name,
+                                                          "index"))
+        with mock.patch.object(sosarchive, "_ARCHIVE", archive), \
+                mock.patch.object(sosarchive, "_ARCHIVE_LOADED", True):
+            index.build()
+            self.assertEqual(index.get_size(log), len(LOG))
+            s = searchtools.FileSearcher()
+            s.add_search_term(r".+ agent line (99)$", [1],
+                              os.path.join(data_root, "var/log/nova"))
+            results = s.search().find_by_path(log)
+
+        self.assertEqual([r.get(1) for r in results], ["99"])
+        with open(log) as fd:
+            self.assertEqual(fd.read(), LOG)
+
+    def test_unpack_hostile(self):
+        outside = os.path.join(self.tmpdir.name, "outside")
+        os.makedirs(os.path.join(outside, "nova"))
+        victims = [os.path.join(outside, "nova/nova-compute.log"),
+                   os.path.join(outside, "hostname")]
+        for victim in victims:
+            with open(victim, 'w') as fd:
+                fd.write("victim\n")
+
+        archive = os.path.join(self.tmpdir.name, "hostile.tar")
+        with tarfile.open(archive, 'w') as tar:
+            for name, target in [("sos/var/log", "../../../outside"),
+                                 ("sos/etc", outside),
+                                 ("sos/ok", "var")]:
+                member = tarfile.TarInfo(name)
+                member.type = tarfile.SYMTYPE
+                member.linkname = target
+                tar.addfile(member)
+
+            for name, data in [("sos/var/log/nova/nova-compute.log", LOG),
+                               ("sos/etc/hostname", "compute1\n")]:
+                member = tarfile.TarInfo(name)
+                member.size = len(data)
+                tar.addfile(member, io.BytesIO(data.encode()))
+
+        # with and without extraction filters
+        for data_filter in [tarfile.__dict__.get("data_filter"), None]:
+            extract_dir = os.path.join(self.tmpdir.name, "extracted",
+                                       str(bool(data_filter)))
+            os.makedirs(extract_dir)
+            with mock.patch.object(sosarchive, "DEFER_SIZE", 1024), \
+                    mock.patch.object(tarfile, "data_filter", data_filter,
+                                      create=True):
+                archive_obj = sosarchive.SOSArchive(archive, extract_dir)
+                archive_obj.unpack()
+                archive_obj.extract(
+                    [os.path.join(extract_dir,
+                                  "sos/var/log/nova/nova-compute.log")])
+
+            for victim in victims:
+                with open(victim) as fd:
+                    self.assertEqual(fd.read(), "victim\n")
+
+            # the hostile symlinks are skipped so members are extracted to
+            # directories within the extract directory.
+            sos = os.path.join(extract_dir, "sos")
+            self.assertTrue(os.path.islink(os.path.join(sos, "ok")))
+            for name in ["var/log", "etc"]:
+                self.assertFalse(os.path.islink(os.path.join(sos, name)))
+
+            with open(os.path.join(sos, "etc/hostname")) as fd:
+                self.assertEqual(fd.read(), "compute1\n")
+
+            log = os.path.join(sos, "var/log/nova/nova-compute.log")
+            self.assertEqual(list(archive_obj._deferred), [log])
+            with open(log) as fd:
+                self.assertEqual(fd.read(), LOG)
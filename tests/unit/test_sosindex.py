@@ -0,0 +1,265 @@
+import glob
+import os
+import tempfile
+
+import mock
+import utils
+
+from common import (
+    constants,
+    logtools,
+    searchtools,
+    sosindex,
+)
+
+
+class TestSOSIndex(utils.BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.data_root = os.environ["DATA_ROOT"]
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.index_path = os.path.join(self.tmpdir.name, "index")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+        super().tearDown()
+
+    def test_index_path(self):
+        path = sosindex.get_index_path(self.data_root)
+        self.assertFalse(path.startswith(self.data_root + os.sep))
+        self.assertNotEqual(sosindex.get_index_path(self.tmpdir.name), path)
+        with mock.patch.object(constants, "STATE_DIR", self.tmpdir.name):
+            path = sosindex.get_index_path(self.data_root)
+            self.assertEqual(os.path.dirname(path), self.tmpdir.name)
+
+    def test_inventory(self):
+        index = sosindex.SOSIndex(self.data_root, self.index_path)
+        self.assertFalse(index.load())
+        index.save()
+
+        index = sosindex.SOSIndex(self.data_root, self.index_path)
+        self.assertTrue(index.load())
+        logs = os.path.join(self.data_root, "var/log/neutron")
+        self.assertEqual(sorted(index.listdir(logs)),
+                         sorted(os.listdir(logs)))
+        for pattern in ["*.log", "*.log*", "neutron-l3-agent.log",
+                        "nonexistent.log"]:
+            pattern = os.path.join(logs, pattern)
+            self.assertEqual(sorted(index.glob(pattern)),
+                             sorted(glob.glob(pattern)))
+
+        path = os.path.join(logs, "neutron-l3-agent.log")
+        self.assertTrue(index.exists(path))
+        self.assertTrue(index.isfile(path))
+        self.assertFalse(index.isfile(logs))
+        self.assertEqual(index.get_size(path), os.path.getsize(path))
+        self.assertFalse(index.exists(os.path.join(logs, "nonexistent.log")))
+        self.assertIsNone(index.exists("/not/in/sosreport"))
+        self.assertIsNone(index.glob(os.path.join(self.data_root, "*/log")))
+
+    def test_log_info(self):
+        index = sosindex.SOSIndex(self.data_root, self.index_path)
+        index.build()
+        path = os.path.join(self.data_root,
+                            "var/log/neutron/neutron-openvswitch-agent.log.1")
+        info = index.get_log_info(path)
+        self.assertIsNone(info["compression"])
+        self.assertEqual(info["first"], "2021-03-04 08:51:13")
+        self.assertEqual(info["last"], "2021-03-04 16:19:22")
+        # line offsets are recorded as searches reach them.
+        self.assertEqual(info["offsets"], [])
+        with mock.patch.object(sosindex, "LINE_OFFSET_INTERVAL", 1024):
+            index.add_line_offset(path, 2048, 10)
+            index.add_line_offset(path, 1024, 5)
+            # too close to a recorded offset
+            index.add_line_offset(path, 2100, 11)
+            # end of file
+            index.add_line_offset(path, info["size"], 40)
+
+        self.assertEqual(info["offsets"], [[1024, 5], [2048, 10]])
+        self.assertTrue(index.dirty)
+        index.save()
+        self.assertFalse(index.dirty)
+        index = sosindex.SOSIndex(self.data_root, self.index_path)
+        self.assertTrue(index.load())
+        self.assertEqual(index.get_log_info(path), info)
+        self.assertFalse(index.dirty)
+
+        # offsets recorded by other processes are merged.
+        other = sosindex.SOSIndex(self.data_root, self.index_path)
+        other.load()
+        with mock.patch.object(sosindex, "LINE_OFFSET_INTERVAL", 1024):
+            other.add_line_offset(path, 3072, 15)
+
+        other.save()
+        index = sosindex.SOSIndex(self.data_root, self.index_path)
+        index.load()
+        self.assertEqual(index.get_log_info(path)["offsets"],
+                         [[1024, 5], [2048, 10], [3072, 15]])
+
+        path = os.path.join(self.data_root,
+                            "var/log/neutron/neutron-l3-agent.log.1.gz")
+        info = index.get_log_info(path)
+        self.assertEqual(info["compression"], "gzip")
+        self.assertIsNotNone(info["first"])
+        self.assertIsNone(info["last"])
+
+    def test_log_info_head_and_tail(self):
+        data_root = os.path.join(self.tmpdir.name, "sosreport")
+        os.makedirs(os.path.join(data_root, "var/log"))
+        path = os.path.join(data_root, "var/log/big.log")
+        line = "2021-03-04 08:51:13.000 1 INFO {}\n".format("x" * 64)
+        with open(path, 'w') as fd:
+            for _ in range(8 * logtools.READ_BUFFER_SIZE // len(line)):
+                fd.write(line)
+
+            fd.write(line.replace("08:51:13", "09:00:00"))
+
+        index = sosindex.SOSIndex(data_root, self.index_path)
+        index.build()
+        start = searchtools.get_read_bytes()
+        info = index.get_log_info(path)
+        read = searchtools.get_read_bytes() - start
+        self.assertEqual(info["first"], "2021-03-04 08:51:13")
+        self.assertEqual(info["last"], "2021-03-04 09:00:00")
+        if read:
+            self.assertLess(read, 3 * logtools.READ_BUFFER_SIZE)
+
+    def test_stale_log_info(self):
+        data_root = os.path.join(self.tmpdir.name, "sosreport")
+        os.makedirs(os.path.join(data_root, "var/log/nova"))
+        path = os.path.join(data_root, "var/log/nova/nova-compute.log")
+        with open(path, 'w') as fd:
+            fd.write("2021-03-04 08:51:13.000 1 INFO a\n")
+
+        index = sosindex.SOSIndex(data_root, self.index_path)
+        index.load()
+        self.assertEqual(index.get_log_info(path)["last"],
+                         "2021-03-04 08:51:13")
+        index.save()
+
+        # a change deep in the sosreport is noticed.
+        with open(path, 'a') as fd:
+            fd.write("2021-03-04 09:00:00.000 1 INFO b\n")
+
+        index = sosindex.SOSIndex(data_root, self.index_path)
+        self.assertTrue(index.load())
+        self.assertEqual(index.get_log_info(path)["last"],
+                         "2021-03-04 09:00:00")
+        self.assertEqual(index.get_size(path), os.path.getsize(path))
+        self.assertTrue(index.dirty)
+
+    def test_saved_inventory(self):
+        data_root = os.path.join(self.tmpdir.name, "sosreport")
+        os.makedirs(os.path.join(data_root, "var/log"))
+        index = sosindex.SOSIndex(data_root, self.index_path)
+        self.assertFalse(index.load())
+        self.assertTrue(index.dirty)
+        index.save()
+
+        # the saved inventory is used without walking the sosreport.
+        index = sosindex.SOSIndex(data_root, self.index_path)
+        with mock.patch.object(sosindex.os, "walk") as walk:
+            self.assertTrue(index.load())
+            self.assertFalse(walk.called)
+
+        self.assertFalse(index.dirty)
+        self.assertEqual(index.listdir(os.path.join(data_root, "var")),
+                         ["log"])
+
+        # until the top-level of the sosreport changes.
+        os.makedirs(os.path.join(data_root, "etc"))
+        index = sosindex.SOSIndex(data_root, self.index_path)
+        self.assertFalse(index.load())
+        self.assertEqual(sorted(index.listdir(data_root)), ["etc", "var"])
+
+    def test_archive_index_path(self):
+        archive = os.path.join(self.tmpdir.name, "sosreport.tar")
+        with open(archive, 'w') as fd:
+            fd.write("archive")
+
+        paths = []
+        for extract_dir in ["extract1", "extract2"]:
+            sos_archive = mock.MagicMock(archive=archive)
+            sos_archive.data_root = os.path.join(self.tmpdir.name,
+                                                 extract_dir)
+            with mock.patch.object(sosindex.sosarchive, "get_archive",
+                                   lambda: sos_archive):
+                paths.append(sosindex.get_index_path(sos_archive.data_root))
+
+        # each run extracts to a new directory.
+        self.assertEqual(paths[0], paths[1])
+        self.assertNotEqual(paths[0], sosindex.get_index_path(
+            os.path.join(self.tmpdir.name, "extract1")))
+        with open(archive, 'a') as fd:
+            fd.write("changed")
+
+        with mock.patch.object(sosindex.sosarchive, "get_archive",
+                               lambda: sos_archive):
+            self.assertNotEqual(sosindex.get_index_path(sos_archive.data_root),
+                                paths[1])
+
+    def test_prune_indexes(self):
+        index_dir = self.tmpdir.name
+        for name in ["index-old", "index-old.lock", "index-new", "other"]:
+            with open(os.path.join(index_dir, name), 'w'):
+                pass
+
+        old = os.path.getmtime(os.path.join(index_dir, "index-new")) - \
+            sosindex.INDEX_MAX_AGE - 1
+        for name in ["index-old", "index-old.lock", "other"]:
+            os.utime(os.path.join(index_dir, name), (old, old))
+
+        sosindex.prune_indexes(index_dir)
+        self.assertEqual(sorted(os.listdir(index_dir)),
+                         ["index-new", "other"])
+
+    def test_exists(self):
+        path = os.path.join(self.data_root, "var/log/neutron")
+        index = sosindex.SOSIndex(self.data_root, self.index_path)
+        index.build()
+        with mock.patch.object(sosindex, "_INDEX", index), \
+                mock.patch.object(sosindex, "_INDEX_LOADED", True), \
+                mock.patch.object(sosindex.os.path, "exists") as exists:
+            self.assertTrue(sosindex.exists(path))
+            self.assertFalse(sosindex.exists(os.path.join(path, "foo")))
+            self.assertFalse(exists.called)
+            self.assertEqual(sosindex.glob_files(os.path.join(path,
+                                                              "*.gz")),
+                             glob.glob(os.path.join(path, "*.gz")))
+
+    def test_filesearcher_with_index(self):
+        index = sosindex.SOSIndex(self.data_root, self.index_path)
+        index.build()
+        path = os.path.join(self.data_root,
+                            "var/log/neutron/neutron-openvswitch-agent.log.1")
+        since = "2021-03-04 09:50:00"
+        s = searchtools.FileSearcher(since=since)
+        s.add_search_term(r"^(\S+ \S+) .+", [1], path)
+        expected = [(r.linenumber, r.get(1))
+                    for r in s.search().find_by_path(path)]
+        self.assertTrue(expected)
+        with mock.patch.object(sosindex, "_INDEX", index), \
+                mock.patch.object(sosindex, "_INDEX_LOADED", True), \
+                mock.patch.object(sosindex, "LINE_OFFSET_INTERVAL", 1024):
+            s = searchtools.FileSearcher(since=since)
+            s.add_search_term(r"^(\S+ \S+) .+", [1], path)
+            results = s.search().find_by_path(path)
+            offsets = index.get_log_info(path)["offsets"]
+            self.assertTrue(offsets)
+            with open(path, 'rb') as fd:
+                content = fd.read()
+
+            for offset, line in offsets:
+                self.assertEqual(content[offset - 1:offset], b"\n")
+                self.assertEqual(content[:offset].count(b"\n"), line)
+
+            # the next search counts lines from the recorded offset.
+            s = searchtools.FileSearcher(since=since)
+            s.add_search_term(r"^(\S+ \S+) .+", [1], path)
+            self.assertEqual([(r.linenumber, r.get(1)) for r in
+                              s.search().find_by_path(path)], expected)
+
+        self.assertEqual([(r.linenumber, r.get(1)) for r in results],
+                         expected)
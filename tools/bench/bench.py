@@ -0,0 +1,245 @@
+#!/usr/bin/python3
+"""Benchmark plugins and FileSearcher against a synthetic sosreport.
+
+A sosreport is generated at the chosen scale (see gensos.py) and the
+following are timed, taking the best of a number of runs:
+
+  * each part of each plugin, as run by the plugin runner.
+  * FileSearcher searching all logs of the sosreport in each of its modes.
+
+Each benchmark also records a digest of its results. Digests are compared
+with those in baseline.yaml, which is kept in the repository since they
+don't depend on the machine. Times are compared with those saved on the same
+machine by a previous run with --save-baseline, if any. The exit code is
+non-zero if the results of any benchmark differ or it is slower than the
+saved time by more than the tolerance.
+"""
+import argparse
+import hashlib
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import yaml
+
+import gensos
+
+REPO_DIR = gensos.REPO_DIR
+# Digests of the results of each benchmark at each scale.
+BASELINE = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                        "baseline.yaml")
+# Times of each benchmark at each scale on this machine.
+TIMES_BASELINE = os.path.join(os.environ.get("XDG_CACHE_HOME",
+                                             os.path.expanduser("~/.cache")),
+                              "hotsos", "bench-times.yaml")
+PLUGINS = ["system", "openstack", "kubernetes", "storage", "juju", "kernel"]
+SCALES = {"small": {"log_lines": 20000, "rotations": 2, "vms": 10,
+                    "osds": 8, "ports": 50, "packages": 1000},
+          "medium": {"log_lines": 200000, "rotations": 3, "vms": 50,
+                     "osds": 24, "ports": 200, "packages": 3000},
+          "large": {"log_lines": 1000000, "rotations": 5, "vms": 200,
+                    "osds": 60, "ports": 1000, "packages": 5000}}
+# Slowdowns smaller than this many seconds are never regressions.
+MIN_REGRESSION = 0.05
+SEARCH_TERMS = [r"^(\S+ \S+) .+ Agent rpc_loop - iteration:(\d+) started",
+                r"^(\S+ \S+) .+ (DBConnectionError) .+",
+                r"^(\S+ \S+) .+ (MessagingTimeout): .+",
+                # no literal so every line is matched against the regex
+                r"^(\S+) \S+ \d+ (WARNING|CRITICAL) .+"]
+# {mode: (module attributes, FileSearcher args, log glob, use search_iter)}
+SEARCH_MODES = {
+    "stream": ({"USE_MMAP": False, "CHUNK_SIZE": 2 ** 62}, {}, "*.log",
+               False),
+    "mmap": ({"USE_MMAP": True, "CHUNK_SIZE": 2 ** 62}, {}, "*.log", False),
+    "chunked": ({"USE_MMAP": True, "CHUNK_SIZE": 4 * 1024 * 1024}, {},
+                "*.log", False),
+    "compressed": ({}, {}, "*.gz", False),
+    "window": ({}, {"since": "2021-03-01 00:10:00",
+                    "until": "2021-03-01 00:20:00"}, "*.log*", False),
+    "search-iter": ({}, {}, "*.log*", True)}
+
+
+def get_digest(data):
+    return hashlib.sha1(yaml.safe_dump(data).encode()).hexdigest()[:12]
+
+
+def bench_plugin(data_root, plugin, repeat):
+    """Run all parts of a plugin, with profiling, repeat times.
+
+    @return: dict of {part: {"time": best time, "digest": of the results}}
+    """
+    env = dict(os.environ, DATA_ROOT=data_root + "/", PROFILE="true",
+               USE_INDEX="false", PYTHONPATH=REPO_DIR)
+    times = {}
+    digest = None
+    for _ in range(repeat):
+        with tempfile.NamedTemporaryFile() as ftmp:
+            env["MASTER_YAML_OUT"] = ftmp.name
+            subprocess.run([sys.executable, "-m", "common.plugin_runner",
+                            plugin], env=env, cwd=REPO_DIR, check=True,
+                           stderr=subprocess.DEVNULL)
+            output = yaml.safe_load(ftmp) or {}
+
+        profile = output.pop("profile", {})
+        digest = get_digest(output)
+        for part, stats in profile.items():
+            times[part] = min(times.get(part, stats["wall-time"]),
+                              stats["wall-time"])
+
+    # all parts of a plugin share the digest of the plugin's results
+    return {part: {"time": t, "digest": digest} for part, t in times.items()}
+
+
+def bench_searches(data_root, repeat):
+    """Search all logs of the sosreport in each FileSearcher mode.
+
+    @return: dict of {mode: {"time": best time, "digest": of the results}}
+    """
+    os.environ["DATA_ROOT"] = data_root + "/"
+    sys.path.insert(0, REPO_DIR)
+    from common import searchtools
+
+    results = {}
+    for mode, (attrs, kwargs, logs, use_iter) in SEARCH_MODES.items():
+        saved = {k: getattr(searchtools, k) for k in attrs}
+        for k, v in attrs.items():
+            setattr(searchtools, k, v)
+
+        try:
+            best = None
+            for _ in range(repeat):
+                s = searchtools.FileSearcher(**kwargs)
+                for term in SEARCH_TERMS:
+                    s.add_search_term(term, [1, 2],
+                                      os.path.join(data_root, "var/log/*",
+                                                   logs))
+
+                start = time.monotonic()
+                if use_iter:
+                    found = [(os.path.relpath(f, data_root), r.linenumber,
+                              r.get(2)) for f, r in s.search_iter()]
+                else:
+                    found = [(os.path.relpath(f, data_root), r.linenumber,
+                              r.get(2)) for f, _results in s.search()
+                             for r in _results]
+
+                elapsed = time.monotonic() - start
+                best = elapsed if best is None else min(best, elapsed)
+        finally:
+            for k, v in saved.items():
+                setattr(searchtools, k, v)
+
+        results["search/{}".format(mode)] = {
+            "time": round(best, 3), "digest": get_digest(sorted(found)),
+            "matches": len(found)}
+
+    searchtools.close_pool()
+    return results
+
+
+def compare(results, baseline, times, tolerance):
+    """Compare results with the digests of a baseline and the times of a
+    previous run on this machine.
+
+    @return: list of regressions.
+    """
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is not None and result["digest"] != base["digest"]:
+            regressions.append("{}: results differ from baseline".format(
+                name))
+
+        base_time = times.get(name)
+        if base_time is None:
+            continue
+
+        slowdown = result["time"] - base_time
+        if (slowdown > MIN_REGRESSION and
+                result["time"] > base_time * (1 + tolerance)):
+            regressions.append("{}: {}s is slower than baseline {}s".format(
+                name, result["time"], base_time))
+
+    return regressions
+
+
+def load_yaml(path):
+    if not os.path.exists(path):
+        return {}
+
+    with open(path) as fd:
+        return yaml.safe_load(fd) or {}
+
+
+def save_yaml(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as fd:
+        yaml.safe_dump(data, fd, default_flow_style=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scale", choices=sorted(SCALES), default="small")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="number of runs of each benchmark")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="slowdown relative to the baseline allowed "
+                             "before it is a regression")
+    parser.add_argument("--baseline", default=BASELINE,
+                        help="file of the digests of results")
+    parser.add_argument("--times-baseline", default=TIMES_BASELINE,
+                        help="file of the times of this machine")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="save times as the baseline of this machine "
+                             "for the scale")
+    parser.add_argument("--save-digests", action="store_true",
+                        help="save digests as the baseline for the scale "
+                             "e.g. after an intended change of results")
+    parser.add_argument("--sosreport",
+                        help="use this sosreport, generated by gensos.py "
+                             "for the scale, rather than generating one")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as dtmp:
+        data_root = args.sosreport
+        if not data_root:
+            data_root = os.path.join(dtmp, "sosreport")
+            gensos.generate(data_root, **SCALES[args.scale])
+
+        data_root = os.path.realpath(data_root)
+        results = {}
+        for plugin in PLUGINS:
+            results.update(bench_plugin(data_root, plugin, args.repeat))
+
+        results.update(bench_searches(data_root, args.repeat))
+
+    baselines = load_yaml(args.baseline)
+    if args.save_digests:
+        baselines[args.scale] = {
+            name: {k: v for k, v in result.items() if k != "time"}
+            for name, result in results.items()}
+        save_yaml(args.baseline, baselines)
+
+    times = load_yaml(args.times_baseline)
+    if args.save_baseline:
+        times[args.scale] = {name: result["time"]
+                             for name, result in results.items()}
+        save_yaml(args.times_baseline, times)
+    elif args.scale not in times:
+        sys.stderr.write("WARNING: times not compared since there is no "
+                         "baseline for this machine - run with "
+                         "--save-baseline first\n")
+
+    regressions = compare(results, baselines.get(args.scale, {}),
+                          times.get(args.scale, {}), args.tolerance)
+    report = {"scale": args.scale, "results": results}
+    if regressions:
+        report["regressions"] = regressions
+
+    yaml.safe_dump(report, sys.stdout, default_flow_style=False)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,356 @@
+#!/usr/bin/python3
+"""Generate a synthetic sosreport at a chosen scale.
+
+The sosreport is a copy of tests/unit/fake_data_root, so that every plugin
+has something to analyse, with the files whose size drives the cost of
+analysis replaced by generated content:
+
+  * logs of nova-compute and the neutron openvswitch and l3 agents along
+    with rotated copies, the most recent uncompressed and the rest gzipped.
+  * a qemu process for each VM and a ceph-osd process for each OSD in ps.
+  * tap devices in ip -s -d link and ip -d address, including one per VM.
+  * packages in dpkg -l.
+  * OSDs in ceph osd df tree and ceph-volume lvm list.
+
+Output is deterministic for a given seed.
+"""
+import argparse
+import datetime
+import gzip
+import heapq
+import os
+import random
+import shutil
+import uuid
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.realpath(__file__))))
+FAKE_DATA_ROOT = os.path.join(REPO_DIR, "tests/unit/fake_data_root")
+LOG_START = datetime.datetime(2021, 3, 1)
+# Logs are written in blocks of this many lines.
+WRITE_BLOCK_LINES = 10000
+
+NOVA_LOG = "var/log/nova/nova-compute.log"
+OVS_AGENT_LOG = "var/log/neutron/neutron-openvswitch-agent.log"
+L3_AGENT_LOG = "var/log/neutron/neutron-l3-agent.log"
+
+PS_QEMU = ("libvirt+ {pid:5d}  0.1 20.7 3461772 837468 ?      Sl   Feb17   "
+           "2:18 /usr/bin/qemu-system-x86_64 -name guest=instance-{idx:08x},"
+           "debug-threads=on -S -machine pc-i440fx-4.2,accel=kvm,usb=off "
+           "-m 2048 -uuid {uuid} -smbios type=1,manufacturer=OpenStack "
+           "Foundation,product=OpenStack Nova,version=21.1.0,serial={uuid},"
+           "uuid={uuid},family=Virtual Machine -display none -netdev tap,"
+           "fd=33,id=hostnet0,vhost=on,vhostfd=34 -device virtio-net-pci,"
+           "host_mtu=1492,netdev=hostnet0,id=net0,mac={mac},bus=pci.0,"
+           "addr=0x2 -msg timestamp=on\n")
+PS_OSD = ("ceph     {pid:6d} 12.4  0.7 6288484 3960044 ?     Ssl   2020 "
+          "42280:23 /usr/bin/ceph-osd -f --cluster ceph --id {osd} --setuser "
+          "ceph --setgroup ceph\n")
+IP_LINK_TAP = ("{idx}: {name}: <BROADCAST,MULTICAST,UP,LOWER_UP> mtu 1450 "
+               "qdisc pfifo_fast master ovs-system state UNKNOWN mode DEFAULT "
+               "group default qlen 1000\n"
+               "    link/ether {mac} brd ff:ff:ff:ff:ff:ff promiscuity 1\n"
+               "    tun\n"
+               "    openvswitch_slave addrgenmode eui64 numtxqueues 1 "
+               "numrxqueues 1 gso_max_size 65536 gso_max_segs 65535\n"
+               "    RX: bytes  packets  errors  dropped overrun mcast\n"
+               "    {rx_bytes} {rx_packets} 0       {rx_dropped}       0"
+               "       0\n"
+               "    TX: bytes  packets  errors  dropped carrier collsns\n"
+               "    {tx_bytes} {tx_packets} 0       0       0       0\n")
+IP_ADDR_TAP = ("{idx}: {name}: <BROADCAST,MULTICAST,UP,LOWER_UP> mtu 1450 "
+               "qdisc pfifo_fast master ovs-system state UNKNOWN group "
+               "default qlen 1000\n"
+               "    link/ether {mac} brd ff:ff:ff:ff:ff:ff promiscuity 1 \n"
+               "    tun \n"
+               "    openvswitch_slave \n")
+DPKG = ("ii  {name:<38} {version:<47} amd64        {name} package\n")
+OSD_DF_TREE_HEADER = ("ID  CLASS WEIGHT    REWEIGHT SIZE    RAW USE DATA     "
+                      "OMAP    META    AVAIL    %USE  VAR  PGS STATUS TYPE "
+                      "NAME\n"
+                      " -1       400.37894        - 569 TiB 248 TiB  324 TiB "
+                      "637 GiB 108 GiB  322 TiB 43.52 1.00   -        root "
+                      "default\n")
+OSD_DF_TREE = ("{osd:3d}   hdd   3.64000  1.00000 3.6 TiB 2.5 TiB  1.2 TiB "
+               "3.4 GiB     0 B  1.2 TiB 68.07 1.56 {pgs:3d}     up         "
+               "osd.{osd}\n")
+LVM_LIST = ("\n"
+            "====== osd.{osd} =======\n"
+            "\n"
+            "  [block]       /dev/ceph-{fsid}/osd-block-{fsid}\n"
+            "\n"
+            "      osd fsid                  {fsid}\n"
+            "      osd id                    {osd}\n"
+            "      devices                   /dev/bcache{osd}\n")
+
+
+def get_mac(rng, prefix):
+    return prefix + ":".join("{:02x}".format(rng.randrange(256))
+                             for _ in range(3))
+
+
+def get_uuid(rng):
+    return str(uuid.UUID(int=rng.getrandbits(128)))
+
+
+class LogGenerator(object):
+    """Generates the lines of a log of a given service."""
+
+    def __init__(self, rng, service, vms):
+        self.rng = rng
+        self.service = service
+        self.vms = vms
+        self.pid = rng.randrange(1000, 60000)
+        self.iteration = 0
+        # heap of (timestamp, seq, line) of lines of operations in progress
+        self.pending = []
+        self.seq = 0
+
+    def _line(self, timestamp, level, module, msg):
+        return "{} {} {} {} [req-{} - - - - -] {}\n".format(
+            timestamp.strftime("%Y-%m-%d %H:%M:%S.%f")[:-3], self.pid, level,
+            module, get_uuid(self.rng), msg)
+
+    def _add_pending(self, timestamp, line):
+        self.seq += 1
+        heapq.heappush(self.pending, (timestamp, self.seq, line))
+
+    def get_lines(self, timestamp):
+        """Return a list of lines for the given time, preceded by those of
+        operations in progress that are due. Most are noise with a
+        proportion of lines that plugins look for.
+        """
+        lines = []
+        while self.pending and self.pending[0][0] <= timestamp:
+            lines.append(heapq.heappop(self.pending)[2])
+
+        return lines + self._get_lines(timestamp)
+
+    def _get_lines(self, timestamp):
+        rng = self.rng
+        roll = rng.random()
+        if self.service == "nova-compute":
+            module = "nova.compute.manager"
+            if roll < 0.01:
+                return [self._line(timestamp, "ERROR",
+                                   "nova.servicegroup.drivers.db",
+                                   "Unexpected error while reporting service "
+                                   "status: DBConnectionError (pymysql.err."
+                                   "OperationalError)")]
+
+            if roll < 0.05 and self.vms:
+                instance = rng.choice(self.vms)
+                event = "network-vif-plugged-{}".format(get_uuid(rng))
+                for stage in ["Preparing to wait for external", "Received",
+                              "Processing"]:
+                    timestamp += datetime.timedelta(
+                        milliseconds=rng.randrange(1, 5000))
+                    self._add_pending(timestamp, self._line(
+                        timestamp, "DEBUG", module,
+                        "[instance: {}] {} event {} "
+                        "external_instance_event".format(instance, stage,
+                                                         event)))
+                    if rng.random() < 0.1:
+                        # event never completes
+                        break
+
+                return []
+
+            return [self._line(timestamp, "INFO", module,
+                               "Running periodic task ComputeManager."
+                               "_poll_rebooting_instances")]
+
+        module = "neutron.agent.{}".format(self.service)
+        if roll < 0.01:
+            return [self._line(timestamp, "ERROR", module,
+                               "Failed reporting state!: oslo_messaging."
+                               "exceptions.MessagingTimeout: Timed out "
+                               "waiting for a reply")]
+
+        if roll < 0.03 and self.service == "neutron-openvswitch-agent":
+            module = ("neutron.plugins.ml2.drivers.openvswitch.agent."
+                      "ovs_neutron_agent")
+            self.iteration += 1
+            end = timestamp + datetime.timedelta(
+                milliseconds=rng.randrange(100, 30000))
+            self._add_pending(end, self._line(
+                end, "INFO", module,
+                "Agent rpc_loop - iteration:{} completed. Processed ports "
+                "statistics: {{'regular': {{'added': 0, 'updated': 0, "
+                "'removed': 0}}}}. Elapsed:{:.3f}".format(
+                    self.iteration, (end - timestamp).total_seconds())))
+            return [self._line(timestamp, "INFO", module,
+                               "Agent rpc_loop - iteration:{} started".format(
+                                   self.iteration))]
+
+        return [self._line(timestamp, "DEBUG", module,
+                           "Sending state report {'binary': '%s', 'host': "
+                           "'compute1', 'agent_type': 'Open vSwitch agent'}" %
+                           self.service)]
+
+
+def write_log(path, generator, start, num_lines, compress=False):
+    """Write a log of roughly num_lines lines starting at start.
+
+    @return: timestamp of the last line.
+    """
+    opener = gzip.open if compress else open
+    timestamp = start
+    written = 0
+    with opener(path, 'wt') as fd:
+        while written < num_lines:
+            block = []
+            while len(block) < WRITE_BLOCK_LINES and \
+                    written + len(block) < num_lines:
+                timestamp += datetime.timedelta(
+                    milliseconds=generator.rng.randrange(1, 200))
+                block += generator.get_lines(timestamp)
+
+            fd.write("".join(block))
+            written += len(block)
+
+    return timestamp
+
+
+def write_logs(root, rng, log_lines, rotations, vms):
+    for log in [NOVA_LOG, OVS_AGENT_LOG, L3_AGENT_LOG]:
+        path = os.path.join(root, log)
+        for existing in os.listdir(os.path.dirname(path)):
+            if existing.startswith(os.path.basename(path)):
+                os.remove(os.path.join(os.path.dirname(path), existing))
+
+        service = os.path.basename(log).partition(".")[0]
+        generator = LogGenerator(rng, service, vms)
+        timestamp = LOG_START
+        # oldest first so that timestamps increase with each rotation.
+        for rotation in range(rotations, -1, -1):
+            if rotation == 0:
+                rotated = path
+            elif rotation == 1:
+                rotated = "{}.1".format(path)
+            else:
+                rotated = "{}.{}.gz".format(path, rotation)
+
+            timestamp = write_log(rotated, generator, timestamp, log_lines,
+                                  compress=rotation > 1)
+
+
+def write_ps(root, rng, vms, osds):
+    path = os.path.join(root, "sos_commands/process/ps_auxwww")
+    with open(path) as fd:
+        lines = [line for line in fd
+                 if "qemu-system" not in line and "ceph-osd " not in line]
+
+    macs = []
+    for idx, instance in enumerate(vms):
+        mac = get_mac(rng, "fa:16:3e:")
+        macs.append(mac)
+        lines.append(PS_QEMU.format(pid=rng.randrange(10000, 99999),
+                                    idx=idx + 1, uuid=instance, mac=mac))
+
+    for osd in range(osds):
+        lines.append(PS_OSD.format(pid=rng.randrange(10000, 999999),
+                                   osd=osd))
+
+    with open(path, 'w') as fd:
+        fd.write("".join(lines))
+
+    return macs
+
+
+def write_ports(root, rng, ports, vm_macs):
+    link_path = os.path.join(root, "sos_commands/networking/ip_-s_-d_link")
+    addr_path = os.path.join(root, "sos_commands/networking/ip_-d_address")
+    links = []
+    addrs = []
+    for idx in range(max(ports, len(vm_macs))):
+        if idx < len(vm_macs):
+            # the tap of a VM has the mac of the VM with the first byte fe.
+            mac = "fe" + vm_macs[idx][2:]
+        else:
+            mac = get_mac(rng, "fe:16:3e:")
+
+        info = {"idx": 1000 + idx,
+                "name": "tap{}".format(get_uuid(rng)[:11]),
+                "mac": mac,
+                "rx_bytes": rng.randrange(10 ** 9),
+                "rx_packets": rng.randrange(10 ** 6),
+                "rx_dropped": rng.choice([0, 0, 0, rng.randrange(1000)]),
+                "tx_bytes": rng.randrange(10 ** 9),
+                "tx_packets": rng.randrange(10 ** 6)}
+        links.append(IP_LINK_TAP.format(**info))
+        addrs.append(IP_ADDR_TAP.format(**info))
+
+    for path, entries in [(link_path, links), (addr_path, addrs)]:
+        with open(path, 'a') as fd:
+            fd.write("".join(entries))
+
+
+def write_dpkg(root, rng, packages):
+    path = os.path.join(root, "sos_commands/dpkg/dpkg_-l")
+    with open(path) as fd:
+        lines = fd.readlines()
+
+    for idx in range(max(packages - len(lines), 0)):
+        lines.append(DPKG.format(name="synthetic-pkg{}".format(idx),
+                                 version="1.{}.{}-0ubuntu1".format(
+                                     rng.randrange(20), rng.randrange(100))))
+
+    with open(path, 'w') as fd:
+        fd.write("".join(lines))
+
+
+def write_ceph(root, rng, osds):
+    path = os.path.join(root, "sos_commands/ceph/ceph_osd_df_tree")
+    with open(path, 'w') as fd:
+        fd.write(OSD_DF_TREE_HEADER)
+        for osd in range(osds):
+            fd.write(OSD_DF_TREE.format(osd=osd, pgs=rng.randrange(20, 400)))
+
+    path = os.path.join(root, "sos_commands/ceph/ceph-volume_lvm_list")
+    with open(path, 'w') as fd:
+        for osd in range(osds):
+            fd.write(LVM_LIST.format(osd=osd, fsid=get_uuid(rng)))
+
+
+def generate(path, log_lines=100000, rotations=2, vms=10, osds=8, ports=50,
+             packages=1000, seed=0):
+    """Generate a synthetic sosreport.
+
+    @param path: directory to create. Must not exist.
+    @param log_lines: number of lines in each log and each of its rotations.
+    @param rotations: number of rotated copies of each log. The first is
+                      uncompressed and the rest gzipped.
+    @param vms: number of VMs in ps.
+    @param osds: number of OSDs.
+    @param ports: minimum number of tap devices.
+    @param packages: minimum number of packages in dpkg -l.
+    @param seed: seed for the random content.
+    """
+    rng = random.Random(seed)
+    shutil.copytree(FAKE_DATA_ROOT, path, symlinks=True)
+    instances = [get_uuid(rng) for _ in range(vms)]
+    write_logs(path, rng, log_lines, rotations, instances)
+    vm_macs = write_ps(path, rng, instances, osds)
+    write_ports(path, rng, ports, vm_macs)
+    write_dpkg(path, rng, packages)
+    write_ceph(path, rng, osds)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("path", help="directory to create")
+    parser.add_argument("--log-lines", type=int, default=100000,
+                        help="lines in each log and each of its rotations")
+    parser.add_argument("--rotations", type=int, default=2,
+                        help="rotated copies of each log, all but the first "
+                             "gzipped")
+    parser.add_argument("--vms", type=int, default=10)
+    parser.add_argument("--osds", type=int, default=8)
+    parser.add_argument("--ports", type=int, default=50)
+    parser.add_argument("--packages", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    generate(args.path, log_lines=args.log_lines, rotations=args.rotations,
+             vms=args.vms, osds=args.osds, ports=args.ports,
+             packages=args.packages, seed=args.seed)